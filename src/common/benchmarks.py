@@ -0,0 +1,444 @@
+import os
+import sys
+import time
+import platform
+import argparse
+import tempfile
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import nibabel as nib
+import SimpleITK as sitk
+import pydicom
+from pydicom.dataset import FileDataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+from src.common.data_loader import (load_data, load_dicom_series, load_nifti, load_nifti_mmap,
+                                    load_all_data)
+from src.common.preprocessing import (normalize_image, preprocess_image_data, preprocess_image_batch)
+from src.common.utils import save_json, load_json, save_table
+
+# pydicom 3 renamed the save_as options and takes the encoding from the transfer syntax
+PYDICOM_3 = int(pydicom.__version__.split('.')[0]) >= 3
+
+# Synthetic dataset sizes for run_suite
+SUITE_SIZES = {
+    'small': {'n_patients': 2, 'n_slices': 32, 'slice_shape': (256, 256), 'volume_shape': (128, 128, 32),
+              'clinical_rows': 1000, 'clinical_columns': 20},
+    'medium': {'n_patients': 4, 'n_slices': 100, 'slice_shape': (512, 512), 'volume_shape': (256, 256, 100),
+               'clinical_rows': 10000, 'clinical_columns': 50},
+    'large': {'n_patients': 8, 'n_slices': 300, 'slice_shape': (512, 512), 'volume_shape': (512, 512, 300),
+              'clinical_rows': 100000, 'clinical_columns': 100}
+}
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def peak_rss_bytes():
+    """
+    Peak resident set size of the current process.
+    
+    Returns:
+        int: Peak RSS in bytes, or None where the resource module is unavailable.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+def _measure(function, args, kwargs, setup):
+    if setup is not None:
+        # Inputs are built before the clock starts and count towards the RSS baseline
+        args = (setup[0](*setup[1]),) + tuple(args)
+    start_rss = peak_rss_bytes()
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    end_rss = peak_rss_bytes()
+    return {
+        'seconds': seconds,
+        'peak_rss_delta_bytes': end_rss - start_rss if end_rss is not None else None
+    }
+
+def measure_isolated(function, *args, setup=None, **kwargs):
+    """
+    Run a function in a fresh process and measure wall time and peak RSS growth.
+    
+    A new process per measurement keeps earlier runs from hiding the peak.
+    
+    Args:
+        function (callable): Module-level function to run.
+        setup (tuple): Optional (callable, args) run first in the child process; its
+            result is passed as the first argument of function and is not timed.
+    
+    Returns:
+        dict: 'seconds' and 'peak_rss_delta_bytes'.
+    """
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(_measure, function, args, kwargs, setup).result()
+
+def write_synthetic_nifti(file_path, shape=(512, 512, 300), dtype=np.int16):
+    """
+    Write a synthetic CT-like NIfTI volume.
+    
+    Args:
+        file_path (str): Output path (.nii for a memory-mappable file).
+        shape (tuple): Volume shape.
+        dtype: Stored dtype.
+    """
+    rng = np.random.default_rng(0)
+    data = rng.integers(-1000, 2000, size=shape, dtype=dtype)
+    nib.save(nib.Nifti1Image(data, np.eye(4)), file_path)
+
+def _nifti_get_fdata(file_path):
+    data, _ = load_nifti(file_path)
+    return float(data.mean())
+
+def _nifti_mmap(file_path, scale=False):
+    data, _ = load_nifti_mmap(file_path, scale=scale)
+    return float(data.mean())
+
+def _nifti_window(file_path):
+    data, _ = load_nifti_mmap(file_path, window=np.s_[:, :, 145:155])
+    return float(data.mean())
+
+def benchmark_nifti_loading(shape=(512, 512, 300), output_dir=None):
+    """
+    Compare load_nifti (get_fdata) with load_nifti_mmap on a synthetic volume.
+    
+    Args:
+        shape (tuple): Volume shape.
+        output_dir (str): Directory for the synthetic file. Defaults to a temporary directory.
+    
+    Returns:
+        dict: Measurements per loading mode.
+    """
+    with tempfile.TemporaryDirectory(dir=output_dir) as tmp_dir:
+        file_path = os.path.join(tmp_dir, 'synthetic_ct.nii')
+        write_synthetic_nifti(file_path, shape)
+        return {
+            'get_fdata': measure_isolated(_nifti_get_fdata, file_path),
+            'mmap_native': measure_isolated(_nifti_mmap, file_path),
+            'mmap_float32': measure_isolated(_nifti_mmap, file_path, scale=True),
+            'mmap_window_10_slices': measure_isolated(_nifti_window, file_path)
+        }
+
+def _synthetic_slices(n_images, shape):
+    rng = np.random.default_rng(0)
+    return rng.integers(-1000, 2000, size=(n_images,) + tuple(shape), dtype=np.int16)
+
+def _preprocess_current(images, target_size, method):
+    return preprocess_image_data(images, target_size=target_size, normalization_method=method).shape
+
+def _preprocess_batch(images, target_size, method, max_workers):
+    return preprocess_image_batch(images, target_size=target_size, normalization_method=method,
+                                  max_workers=max_workers).shape
+
+def benchmark_image_preprocessing(n_images=1000, shape=(512, 512), target_size=(256, 256),
+                                  method='min-max', max_workers=4):
+    """
+    Compare preprocess_image_data with preprocess_image_batch on synthetic int16 slices.
+    
+    Args:
+        n_images (int): Number of slices (use 10000 for the full-size comparison).
+        shape (tuple): Slice shape.
+        target_size (tuple): Target size passed to both functions.
+        method (str): Normalization method.
+        max_workers (int): Threads used by the batched engine.
+    
+    Returns:
+        dict: Measurements per implementation, including images per second.
+    """
+    setup = (_synthetic_slices, (n_images, shape))
+    results = {
+        'preprocess_image_data': measure_isolated(_preprocess_current, target_size, method, setup=setup),
+        'preprocess_image_batch': measure_isolated(_preprocess_batch, target_size, method, 1, setup=setup),
+        f'preprocess_image_batch_{max_workers}_threads': measure_isolated(
+            _preprocess_batch, target_size, method, max_workers, setup=setup)
+    }
+    for result in results.values():
+        result['images_per_second'] = n_images / result['seconds']
+    return results
+
+def write_synthetic_dicom_series(folder, n_slices=100, shape=(512, 512), spacing=(0.9, 0.9, 2.5)):
+    """
+    Write a synthetic CT series, one .dcm file per slice.
+    
+    Args:
+        folder (str): Output folder (created if needed).
+        n_slices (int): Number of slices.
+        shape (tuple): Slice shape (rows, columns).
+        spacing (tuple): Voxel spacing (x, y, z) in mm.
+    
+    Returns:
+        list: Paths of the written slices.
+    """
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(0)
+    series_uid = generate_uid()
+    file_paths = []
+    for index in range(n_slices):
+        meta = FileMetaDataset()
+        meta.TransferSyntaxUID = ExplicitVRLittleEndian
+        meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.2'  # CT Image Storage
+        meta.MediaStorageSOPInstanceUID = generate_uid()
+        ds = FileDataset(None, {}, file_meta=meta, preamble=b'\0' * 128)
+        ds.SOPClassUID = meta.MediaStorageSOPClassUID
+        ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+        ds.SeriesInstanceUID = series_uid
+        ds.Modality = 'CT'
+        ds.PatientID = os.path.basename(folder)
+        ds.ImagePositionPatient = [0.0, 0.0, index * spacing[2]]
+        ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+        ds.PixelSpacing = [spacing[1], spacing[0]]
+        ds.SliceThickness = spacing[2]
+        ds.Rows, ds.Columns = shape
+        ds.BitsAllocated = 16
+        ds.BitsStored = 16
+        ds.HighBit = 15
+        ds.PixelRepresentation = 1
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = 'MONOCHROME2'
+        ds.RescaleSlope = 1
+        ds.RescaleIntercept = -1024
+        ds.PixelData = rng.integers(0, 3000, size=shape, dtype=np.int16).tobytes()
+        file_path = os.path.join(folder, f'slice_{index:04d}.dcm')
+        if PYDICOM_3:
+            ds.save_as(file_path, enforce_file_format=True)
+        else:
+            ds.is_little_endian = True
+            ds.is_implicit_VR = False
+            ds.save_as(file_path, write_like_original=False)
+        file_paths.append(file_path)
+    return file_paths
+
+def write_synthetic_nrrd(file_path, shape=(512, 512, 300), spacing=(0.9, 0.9, 2.5)):
+    """
+    Write a synthetic PET-like NRRD volume.
+    
+    Args:
+        file_path (str): Output path.
+        shape (tuple): Volume shape (x, y, z).
+        spacing (tuple): Voxel spacing (x, y, z) in mm.
+    """
+    rng = np.random.default_rng(0)
+    data = rng.random(size=tuple(shape)[::-1], dtype=np.float32)
+    image = sitk.GetImageFromArray(data)
+    image.SetSpacing(spacing)
+    sitk.WriteImage(image, file_path)
+
+def write_synthetic_clinical(file_path, n_rows=1000, n_columns=20):
+    """
+    Write a synthetic clinical spreadsheet with numeric columns, missing values and a text column.
+    
+    Args:
+        file_path (str): Output path (.xlsx, .csv or .parquet, see save_table).
+        n_rows (int): Number of rows.
+        n_columns (int): Number of numeric columns.
+    """
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=(n_rows, n_columns))
+    values[rng.random(size=values.shape) < 0.05] = np.nan
+    data = pd.DataFrame(values, columns=[f'feature_{i}' for i in range(n_columns)])
+    data.insert(0, 'patient_id', [f'P{i:06d}' for i in range(n_rows)])
+    save_table(data, file_path)
+
+def build_synthetic_dataset(directory, n_patients=2, n_slices=32, slice_shape=(256, 256),
+                            volume_shape=(128, 128, 32), clinical_rows=1000, clinical_columns=20):
+    """
+    Write a synthetic Data directory in the layout load_all_data expects: one folder per
+    patient holding a DICOM series, a NIfTI volume, an NRRD volume and a clinical spreadsheet.
+    
+    Returns:
+        dict: {patient_id: {'ct': [slice paths], 'mri': path, 'pet': path, 'clinical': path}}.
+    """
+    dataset = {}
+    for index in range(n_patients):
+        patient_id = f'patient_{index:03d}'
+        folder = os.path.join(directory, patient_id)
+        dataset[patient_id] = {
+            'ct': write_synthetic_dicom_series(folder, n_slices, slice_shape),
+            'mri': os.path.join(folder, 'mri.nii.gz'),
+            'pet': os.path.join(folder, 'pet.nrrd'),
+            'clinical': os.path.join(folder, 'clinical.xlsx')
+        }
+        write_synthetic_nifti(dataset[patient_id]['mri'], volume_shape)
+        write_synthetic_nrrd(dataset[patient_id]['pet'], volume_shape)
+        write_synthetic_clinical(dataset[patient_id]['clinical'], clinical_rows, clinical_columns)
+    return dataset
+
+def _stage_dicom_series(series):
+    for file_paths in series:
+        load_dicom_series(file_paths)
+
+def _stage_load_data(file_paths):
+    for file_path in file_paths:
+        load_data(file_path)
+
+def _stage_load_all_data(directory, max_workers):
+    load_all_data(directory, max_workers=max_workers)
+
+def _stage_normalize_image(images, method):
+    for image in images:
+        normalize_image(image, method)
+
+def _stage_preprocess(images, target_size, method, max_workers):
+    if max_workers is None:
+        preprocess_image_data(images, target_size=target_size, normalization_method=method)
+    else:
+        preprocess_image_batch(images, target_size=target_size, normalization_method=method,
+                               max_workers=max_workers)
+
+def _file_bytes(file_paths):
+    return sum(os.path.getsize(i) for i in file_paths)
+
+def _with_throughput(result, items, n_bytes=None):
+    result['items'] = items
+    result['items_per_second'] = items / result['seconds'] if result['seconds'] else None
+    if n_bytes is not None:
+        result['bytes'] = n_bytes
+        result['megabytes_per_second'] = n_bytes / 1024 ** 2 / result['seconds'] if result['seconds'] else None
+    return result
+
+def run_suite(size='small', output_dir=None, max_workers=4):
+    """
+    Generate a synthetic dataset and measure every pipeline stage on it.
+    
+    Each stage runs in its own process (see measure_isolated), so timings and peak RSS
+    are independent of the other stages.
+    
+    Args:
+        size (str): Key of SUITE_SIZES.
+        output_dir (str): Directory for the synthetic data. Defaults to a temporary directory.
+        max_workers (int): Workers for the parallel stages.
+    
+    Returns:
+        dict: 'metadata' (size, configuration, platform) and 'results' ({stage: measurements}).
+    """
+    config = SUITE_SIZES[size]
+    with tempfile.TemporaryDirectory(dir=output_dir) as tmp_dir:
+        dataset = build_synthetic_dataset(tmp_dir, **config)
+        series = [paths['ct'] for paths in dataset.values()]
+        niftis = [paths['mri'] for paths in dataset.values()]
+        nrrds = [paths['pet'] for paths in dataset.values()]
+        clinicals = [paths['clinical'] for paths in dataset.values()]
+        dicom_files = [i for paths in series for i in paths]
+        all_files = dicom_files + niftis + nrrds + clinicals
+        n_slices = config['n_slices'] * config['n_patients']
+        slices = (_synthetic_slices, (n_slices, config['slice_shape']))
+        
+        results = {
+            'load_dicom_series': _with_throughput(
+                measure_isolated(_stage_dicom_series, series), len(series), _file_bytes(dicom_files)),
+            'load_data_nifti': _with_throughput(
+                measure_isolated(_stage_load_data, niftis), len(niftis), _file_bytes(niftis)),
+            'load_data_nrrd': _with_throughput(
+                measure_isolated(_stage_load_data, nrrds), len(nrrds), _file_bytes(nrrds)),
+            'load_data_clinical': _with_throughput(
+                measure_isolated(_stage_load_data, clinicals), len(clinicals), _file_bytes(clinicals)),
+            'load_all_data_serial': _with_throughput(
+                measure_isolated(_stage_load_all_data, tmp_dir, None), len(dataset), _file_bytes(all_files)),
+            f'load_all_data_{max_workers}_workers': _with_throughput(
+                measure_isolated(_stage_load_all_data, tmp_dir, max_workers), len(dataset), _file_bytes(all_files)),
+            'normalize_image': _with_throughput(
+                measure_isolated(_stage_normalize_image, 'z-score', setup=slices), n_slices),
+            'preprocess_image_data': _with_throughput(
+                measure_isolated(_stage_preprocess, (256, 256), 'z-score', None, setup=slices), n_slices),
+            f'preprocess_image_batch_{max_workers}_threads': _with_throughput(
+                measure_isolated(_stage_preprocess, (256, 256), 'z-score', max_workers, setup=slices), n_slices)
+        }
+    return {
+        'metadata': {
+            'size': size,
+            'config': config,
+            'max_workers': max_workers,
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()
+        },
+        'results': results
+    }
+
+def compare_results(results, baseline, time_tolerance=0.2, memory_tolerance=0.2):
+    """
+    Compare a run_suite result with a baseline result.
+    
+    Args:
+        results (dict): Current run_suite output.
+        baseline (dict): Baseline run_suite output, e.g. from load_json.
+        time_tolerance (float): Allowed relative increase of wall time.
+        memory_tolerance (float): Allowed relative increase of peak RSS growth.
+    
+    Returns:
+        list: One dict per stage present in both runs with 'stage', 'seconds_ratio',
+            'memory_ratio' and 'regression' (True if a tolerance is exceeded).
+    """
+    if baseline.get('metadata', {}).get('size') != results['metadata']['size']:
+        print("Warning: baseline was run with a different suite size.")
+    comparison = []
+    for stage, current in results['results'].items():
+        previous = baseline.get('results', {}).get(stage)
+        if previous is None:
+            continue
+        seconds_ratio = current['seconds'] / previous['seconds'] if previous['seconds'] else None
+        memory_ratio = None
+        if current['peak_rss_delta_bytes'] is not None and previous.get('peak_rss_delta_bytes'):
+            memory_ratio = current['peak_rss_delta_bytes'] / previous['peak_rss_delta_bytes']
+        comparison.append({
+            'stage': stage,
+            'seconds_ratio': seconds_ratio,
+            'memory_ratio': memory_ratio,
+            'regression': bool((seconds_ratio is not None and seconds_ratio > 1 + time_tolerance) or
+                               (memory_ratio is not None and memory_ratio > 1 + memory_tolerance))
+        })
+    return comparison
+
+def print_results(results, comparison=None):
+    ratios = {i['stage']: i for i in comparison or []}
+    for stage, result in results['results'].items():
+        rss = result['peak_rss_delta_bytes']
+        rss = f"{rss / 1024 ** 2:.0f} MB" if rss is not None else "n/a"
+        line = f"{stage:>32}: {result['seconds']:.3f} s, {result['items_per_second']:.1f} items/s, peak RSS +{rss}"
+        if stage in ratios:
+            ratio = ratios[stage]
+            line += f", x{ratio['seconds_ratio']:.2f} time"
+            if ratio['memory_ratio'] is not None:
+                line += f", x{ratio['memory_ratio']:.2f} memory"
+            if ratio['regression']:
+                line += "  REGRESSION"
+        print(line)
+
+def main(argv=None):
+    """
+    Command line entry point. Returns 1 if any stage regressed against the baseline.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the common data pipeline on synthetic data.")
+    parser.add_argument('--size', choices=sorted(SUITE_SIZES), default='small')
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON file for the results.")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare against.")
+    parser.add_argument('--time-tolerance', type=float, default=0.2)
+    parser.add_argument('--memory-tolerance', type=float, default=0.2)
+    parser.add_argument('--max-workers', type=int, default=4)
+    parser.add_argument('--data-dir', help="Directory for the synthetic data (defaults to the system temp).")
+    args = parser.parse_args(argv)
+    
+    results = run_suite(args.size, output_dir=args.data_dir, max_workers=args.max_workers)
+    comparison = None
+    if args.baseline:
+        comparison = compare_results(results, load_json(args.baseline),
+                                     args.time_tolerance, args.memory_tolerance)
+        results['comparison'] = {'baseline': args.baseline, 'stages': comparison}
+    save_json(results, args.output, atomic=True)
+    print_results(results, comparison)
+    print(f"Results written to {args.output}")
+    return 1 if comparison and any(i['regression'] for i in comparison) else 0
+
+# Example usage: python -m src.common.benchmarks --size small --baseline benchmark_results.json
+if __name__ == "__main__":
+    sys.exit(main())
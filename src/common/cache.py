@@ -0,0 +1,231 @@
+import os
+import pickle
+import hashlib
+import threading
+import functools
+import numpy as np
+from src.common.utils import file_fingerprint, atomic_write, is_temp_file
+
+class VolumeCache:
+    """
+    On-disk cache of decoded volumes.
+    
+    Arrays are stored as uncompressed .npy files next to a pickled metadata file and
+    are returned memory-mapped on a hit, so warm loads cost almost nothing. Entries
+    are keyed by the loader and the path, size and mtime of every input file, and the
+    least recently used entries are evicted once the cache grows past max_bytes.
+    """
+    _COUNTERS = ('hits', 'misses', 'uncacheable', 'evictions')
+    
+    def __init__(self, cache_dir, max_bytes=20 * 1024 ** 3):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+    
+    def key(self, loader, file_paths, *args, **kwargs):
+        """
+        Build the cache key for a loader call.
+        
+        Args:
+            loader (callable): Loader that decodes the file(s).
+            file_paths (str or list): Path, or list of paths, passed to the loader.
+        
+        Returns:
+            str: Hex digest identifying the decoded result.
+        """
+        paths = [file_paths] if isinstance(file_paths, (str, os.PathLike)) else list(file_paths)
+        digest = hashlib.sha1()
+        digest.update(f"{loader.__module__}.{loader.__qualname__}{args!r}{sorted(kwargs.items())!r}".encode())
+        for file_path in paths:
+            digest.update(repr(file_fingerprint(file_path)).encode())
+        return digest.hexdigest()
+    
+    def _paths(self, key):
+        return os.path.join(self.cache_dir, key + '.npy'), os.path.join(self.cache_dir, key + '.pkl')
+    
+    def _read(self, key):
+        array_path, metadata_path = self._paths(key)
+        try:
+            with open(metadata_path, 'rb') as metadata_file:
+                metadata = pickle.load(metadata_file)
+            array = np.load(array_path, mmap_mode='r')
+            # Access time drives the LRU eviction
+            os.utime(array_path)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+            return None
+        return array, metadata
+    
+    def _count(self, counter, n=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + n)
+    
+    def get(self, key, count=True):
+        """
+        Look up a cached entry.
+        
+        Args:
+            key (str): Cache key.
+            count (bool): Record the lookup in the hit/miss counters.
+        
+        Returns:
+            tuple: (np.memmap: array, metadata) or None on a miss.
+        """
+        cached = self._read(key)
+        if count:
+            self._count('misses' if cached is None else 'hits')
+        return cached
+    
+    def put(self, key, array, metadata):
+        """
+        Store a decoded array and its metadata.
+        
+        Metadata that cannot be pickled is not cached.
+        
+        Args:
+            key (str): Cache key.
+            array (np.array): Decoded array.
+            metadata: Metadata returned alongside the array.
+        """
+        array_path, metadata_path = self._paths(key)
+        try:
+            metadata_bytes = pickle.dumps(metadata, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return
+        # The metadata file is the commit marker, so it is moved last
+        with atomic_write(metadata_path) as metadata_temp_path, atomic_write(array_path) as array_temp_path:
+            with open(array_temp_path, 'wb') as array_file:
+                np.save(array_file, np.ascontiguousarray(array))
+            with open(metadata_temp_path, 'wb') as metadata_file:
+                metadata_file.write(metadata_bytes)
+        self.evict()
+    
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits in max_bytes.
+        """
+        entries = []
+        for file in os.listdir(self.cache_dir):
+            if not file.endswith('.npy'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, file))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, file[:-len('.npy')]))
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            for path in self._paths(key)[::-1]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+            self._count('evictions')
+    
+    def load(self, loader, file_paths, *args, **kwargs):
+        """
+        Call a loader through the cache.
+        
+        Only (np.array, metadata) results are cached; anything else is returned as is
+        and counted as uncacheable rather than as a miss.
+        
+        Args:
+            loader (callable): Loader such as load_nifti or load_dicom_series.
+            file_paths (str or list): Path, or list of paths, passed to the loader.
+        
+        Returns:
+            Data: Cached or freshly decoded Data.
+        """
+        key = self.key(loader, file_paths, *args, **kwargs)
+        cached = self._read(key)
+        if cached is not None:
+            self._count('hits')
+            return cached
+        data = loader(file_paths, *args, **kwargs)
+        if isinstance(data, tuple) and len(data) == 2 and isinstance(data[0], np.ndarray):
+            self._count('misses')
+            self.put(key, data[0], data[1])
+        else:
+            self._count('uncacheable')
+        return data
+    
+    def cached(self, loader):
+        """
+        Wrap a loader so every call goes through the cache.
+        
+        Args:
+            loader (callable): Loader taking a path (or list of paths) first.
+        
+        Returns:
+            callable: Cached loader.
+        """
+        @functools.wraps(loader)
+        def wrapper(file_paths, *args, **kwargs):
+            return self.load(loader, file_paths, *args, **kwargs)
+        return wrapper
+    
+    def counters(self):
+        """
+        Returns:
+            dict: Current hit, miss, uncacheable and eviction counts.
+        """
+        with self._lock:
+            return {counter: getattr(self, counter) for counter in self._COUNTERS}
+    
+    def add_counts(self, counts):
+        """
+        Add counts recorded elsewhere, e.g. by a worker process's copy of this cache,
+        which are otherwise lost with the worker.
+        
+        Args:
+            counts (dict): Counter name to count, as returned by counters().
+        """
+        with self._lock:
+            for counter in self._COUNTERS:
+                setattr(self, counter, getattr(self, counter) + counts.get(counter, 0))
+    
+    def stats(self):
+        """
+        Hit/miss counters and current size of the cache.
+        
+        Returns:
+            dict: Cache statistics.
+        """
+        sizes = [os.path.getsize(os.path.join(self.cache_dir, f))
+                 for f in os.listdir(self.cache_dir) if f.endswith('.npy')]
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'uncacheable': self.uncacheable,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': len(sizes),
+            'bytes': sum(sizes)
+        }
+
+# Example usage
+if __name__ == "__main__":
+    from src.common.data_loader import load_data
+    
+    cache = VolumeCache(os.path.join('data', 'cache'), max_bytes=2 * 1024 ** 3)
+    cached_load_data = cache.cached(load_data)
+    for _ in range(2):
+        image, metadata = cached_load_data('path/to/image.nii.gz')
+    print(cache.stats())
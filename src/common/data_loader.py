@@ -6,37 +6,114 @@ from PIL import Image
 import SimpleITK as sitk
 import nibabel as nib
 import pydicom
+from pydicom.errors import InvalidDicomError
 import cv2
 from dicomrt import DicomReader  # Assuming DICOM RT Tool by Brian Anderson
 import requests
 import zipfile
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from src.common.utils import save_table
+from src.common import metrics
+from src.common.mask_storage import load_rtmask
+from src.common.volume_store import (RTVolume, load_rtvol, RTVOL_EXTENSION,
+                                     INDEX_FILE as STORE_INDEX_FILE)
+from src.common.staging import FolderStager
 
-def load_data(file_path):
+# Modality key used in patients_data for each supported file extension
+MODALITY_BY_EXTENSION = {
+    '.dcm': 'ct',
+    '.nii': 'mri',
+    '.nii.gz': 'mri',
+    '.nrrd': 'pet',
+    '.xlsx': 'clinical',
+    '.xls': 'clinical',
+    '.xml': 'clinical',
+    '.rtmask': 'mask'
+}
+
+# CPU-bound decoders, dispatched to a process pool by load_many
+PROCESS_EXTENSIONS = {'.dcm', '.nii', '.nii.gz', '.nrrd', '.rtmask'}
+
+
+def get_extension(file_path):
+    """
+    Get the lower-case extension of a file, treating '.nii.gz' as a single extension.
+    
+    Args:
+        file_path (str): Path to the file.
+    
+    Returns:
+        str: File extension including the leading dot.
+    """
+    lower_path = file_path.lower()
+    if lower_path.endswith('.nii.gz'):
+        return '.nii.gz'
+    return os.path.splitext(lower_path)[1]
+
+def get_modality(file_path):
+    """
+    Get the modality key of a Data file.
+    
+    Volumes from a volume store (see src/common/volume_store.py) are named after their
+    modality, e.g. 'ct.rtvol'.
+    
+    Args:
+        file_path (str): Path to the file or .rtvol directory.
+    
+    Returns:
+        str: Modality key, or None for unsupported files.
+    """
+    extension = get_extension(file_path)
+    if extension == RTVOL_EXTENSION:
+        return os.path.basename(os.path.normpath(file_path))[:-len(RTVOL_EXTENSION)]
+    return MODALITY_BY_EXTENSION.get(extension)
+
+def load_data(file_path, cache=None, window=None):
     """
     Load Data based on file extension.
     
     Args:
         file_path (str): Path to the Data file.
+        cache (VolumeCache): Optional decoded-volume cache (see src/common/cache.py).
+            Not used for .rtvol volumes, which are read chunk by chunk.
+        window (tuple): Slices selecting the region to read, e.g. np.s_[100:110]
+            (.rtvol volumes only; only the chunks it touches are decompressed).
     
     Returns:
         Data: Loaded Data.
     """
-    extension = os.path.splitext(file_path)[1].lower()
-    
-    if extension in ['.dcm']:
-        return load_dicom(file_path)
-    elif extension in ['.nii', '.nii.gz']:
-        return load_nifti(file_path)
-    elif extension in ['.jpg', '.jpeg', '.png', '.bmp']:
-        return load_image(file_path)
-    elif extension in ['.nrrd']:
-        return load_nrrd(file_path)
-    elif extension in ['.xlsx', '.xls']:
-        return load_excel(file_path)
-    elif extension in ['.xml']:
-        return load_xml(file_path)
-    else:
-        raise ValueError(f"Unsupported file extension: {extension}")
+    extension = get_extension(file_path)
+    if window is not None and extension != RTVOL_EXTENSION:
+        raise ValueError(f"Windowed reads are not supported for {extension} files.")
+    if cache is not None and extension != RTVOL_EXTENSION:
+        return cache.load(load_data, file_path)
+    
+    if metrics.is_enabled() and os.path.isfile(file_path):
+        metrics.count('bytes_read', os.path.getsize(file_path))
+    
+    with metrics.timed('load_data', extension=extension, path=file_path):
+        if extension in ['.dcm']:
+            data = load_dicom(file_path)
+        elif extension in ['.nii', '.nii.gz']:
+            data = load_nifti(file_path)
+        elif extension in ['.jpg', '.jpeg', '.png', '.bmp']:
+            data = load_image(file_path)
+        elif extension in ['.nrrd']:
+            data = load_nrrd(file_path)
+        elif extension in ['.rtmask']:
+            data = load_rtmask(file_path)
+        elif extension in [RTVOL_EXTENSION]:
+            data = load_rtvol(file_path, window)
+        elif extension in ['.xlsx', '.xls']:
+            data = load_excel(file_path)
+        elif extension in ['.xml']:
+            data = load_xml(file_path)
+        else:
+            raise ValueError(f"Unsupported file extension: {extension}")
+    metrics.count_array(data[0] if isinstance(data, tuple) else data)
+    return data
 
 def load_dicom(file_path):
     """
@@ -51,6 +128,100 @@ def load_dicom(file_path):
     dicom_reader = DicomReader(file_path)
     return dicom_reader.get_image(), dicom_reader.get_metadata()
 
+def group_dicom_series(file_paths):
+    """
+    Group DICOM files by SeriesInstanceUID using header-only reads.
+    
+    Files without image geometry (RTSTRUCT, RTPLAN, ...) are skipped. Each series is
+    sorted along the slice normal using ImagePositionPatient.
+    
+    Args:
+        file_paths (list): Paths to DICOM files.
+    
+    Returns:
+        dict: {series_instance_uid: [(file_path, header), ...]} sorted by slice position.
+    """
+    series = {}
+    for file_path in file_paths:
+        try:
+            header = pydicom.dcmread(file_path, stop_before_pixels=True)
+        except InvalidDicomError:
+            continue
+        if 'ImagePositionPatient' not in header or 'Rows' not in header:
+            continue
+        series.setdefault(header.SeriesInstanceUID, []).append((file_path, header))
+    
+    for slices in series.values():
+        orientation = np.array(slices[0][1].ImageOrientationPatient, dtype=float)
+        normal = np.cross(orientation[:3], orientation[3:])
+        slices.sort(key=lambda item: float(np.dot(normal, np.array(item[1].ImagePositionPatient, dtype=float))))
+    return series
+
+def load_dicom_series(file_paths, series_uid=None):
+    """
+    Assemble a DICOM series into a single 3D volume.
+    
+    Headers are read without pixel Data to group and sort the slices, then each
+    slice is decoded once into a preallocated array. Rescale slope/intercept are
+    applied when present, in which case the volume is float32.
+    
+    Args:
+        file_paths (list): Paths to DICOM files, possibly from several series.
+        series_uid (str): Series to load. Defaults to the series with the most slices.
+    
+    Returns:
+        tuple: (np.array: volume ordered (slice, row, column), dict: metadata with
+            'spacing' and 'origin' in (x, y, z) order, 'direction', 'modality',
+            'series_instance_uid' and the sorted 'file_paths').
+    """
+    with metrics.timed('group_dicom_series', n_files=len(file_paths)):
+        series = group_dicom_series(file_paths)
+    if not series:
+        raise ValueError("No DICOM image series found.")
+    if series_uid is None:
+        series_uid = max(series, key=lambda uid: len(series[uid]))
+    slices = series[series_uid]
+    
+    first_header = slices[0][1]
+    rescale = any(float(getattr(header, 'RescaleSlope', 1)) != 1 or
+                  float(getattr(header, 'RescaleIntercept', 0)) != 0 for _, header in slices)
+    
+    if metrics.is_enabled():
+        metrics.count('bytes_read', sum(os.path.getsize(file_path) for file_path, _ in slices))
+    volume = None
+    with metrics.timed('decode_dicom_series', series_instance_uid=series_uid, n_slices=len(slices)):
+        for index, (file_path, header) in enumerate(slices):
+            pixels = pydicom.dcmread(file_path).pixel_array
+            if volume is None:
+                dtype = np.float32 if rescale else pixels.dtype
+                volume = np.empty((len(slices),) + pixels.shape, dtype=dtype)
+            if rescale:
+                np.multiply(pixels, float(getattr(header, 'RescaleSlope', 1)), out=volume[index], casting='unsafe')
+                volume[index] += float(getattr(header, 'RescaleIntercept', 0))
+            else:
+                volume[index] = pixels
+    metrics.count_array(volume)
+    
+    orientation = np.array(first_header.ImageOrientationPatient, dtype=float)
+    normal = np.cross(orientation[:3], orientation[3:])
+    positions = np.array([header.ImagePositionPatient for _, header in slices], dtype=float)
+    if len(slices) > 1:
+        slice_spacing = float(np.median(np.diff(positions @ normal)))
+    else:
+        slice_spacing = float(getattr(first_header, 'SliceThickness', 1.0) or 1.0)
+    row_spacing, column_spacing = [float(i) for i in first_header.PixelSpacing]
+    
+    metadata = {
+        'series_instance_uid': series_uid,
+        'modality': getattr(first_header, 'Modality', None),
+        'patient_id': getattr(first_header, 'PatientID', None),
+        'spacing': (column_spacing, row_spacing, slice_spacing),
+        'origin': tuple(positions[0]),
+        'direction': tuple(np.concatenate([orientation, normal])),
+        'file_paths': [file_path for file_path, _ in slices]
+    }
+    return volume, metadata
+
 def load_nifti(file_path):
     """
     Load a NIfTI file.
@@ -64,6 +235,62 @@ def load_nifti(file_path):
     img = nib.load(file_path)
     return img.get_fdata(), img.header
 
+def load_nifti_mmap(file_path, window=None, scale=False):
+    """
+    Load a NIfTI file without inflating it to float64.
+    
+    Uncompressed files are memory-mapped, so only the voxels that are actually
+    touched (or selected by window) are read from disk.
+    
+    Args:
+        file_path (str): Path to the NIfTI file.
+        window (tuple): Optional tuple of slices selecting the region to read,
+            e.g. np.s_[:, :, 100:110] or np.s_[64:192, 64:192, :].
+        scale (bool): Apply scl_slope/scl_inter and return float32. When False the
+            stored values are returned in their native dtype.
+    
+    Returns:
+        tuple: (np.array: NIfTI image Data, dict: metadata).
+    """
+    img = nib.load(file_path, mmap=True)
+    proxy = img.dataobj
+    slope = float(proxy.slope)
+    inter = float(proxy.inter)
+    if slope == 1 and inter == 0:
+        # No scaling, so slicing the proxy keeps the native dtype
+        data = proxy[window] if window is not None else np.asanyarray(proxy)
+        if scale:
+            data = data.astype(np.float32)
+    elif scale:
+        # The proxy scales only the voxels of the window
+        data = proxy[window] if window is not None else np.asanyarray(proxy)
+        data = data.astype(np.float32, copy=False)
+    else:
+        # Memory-mapped for uncompressed files, so the window is still the only part read
+        data = proxy.get_unscaled()
+        if window is not None:
+            data = data[window]
+    return data, img.header
+
+def iter_nifti_slabs(file_path, axis=2, slab_size=1, scale=False):
+    """
+    Stream a NIfTI volume slab by slab along one axis.
+    
+    Args:
+        file_path (str): Path to the NIfTI file.
+        axis (int): Axis to iterate over.
+        slab_size (int): Number of slices per slab.
+        scale (bool): Apply header scaling and return float32.
+    
+    Yields:
+        tuple: (int: index of the first slice, np.array: slab Data).
+    """
+    shape = nib.load(file_path, mmap=True).shape
+    for start in range(0, shape[axis], slab_size):
+        window = [slice(None)] * len(shape)
+        window[axis] = slice(start, min(start + slab_size, shape[axis]))
+        yield start, load_nifti_mmap(file_path, window=tuple(window), scale=scale)[0]
+
 def load_image(file_path):
     """
     Load an image file.
@@ -77,18 +304,49 @@ def load_image(file_path):
     image = Image.open(file_path)
     return np.array(image)
 
-def load_nrrd(file_path):
+def read_image_header(file_path):
+    """
+    Read only the header of an image file supported by SimpleITK (NRRD, NIfTI, MHA, ...).
+    
+    Args:
+        file_path (str): Path to the image file.
+    
+    Returns:
+        tuple: (sitk.ImageFileReader: reader ready to Execute(), dict: metadata with
+            'size', 'spacing', 'origin' and 'direction' in (x, y, z) order, 'pixel_type',
+            'number_of_components' and the raw header 'fields').
+    """
+    reader = sitk.ImageFileReader()
+    reader.SetFileName(file_path)
+    reader.ReadImageInformation()
+    metadata = {
+        'size': reader.GetSize(),
+        'spacing': reader.GetSpacing(),
+        'origin': reader.GetOrigin(),
+        'direction': reader.GetDirection(),
+        'pixel_type': sitk.GetPixelIDValueAsString(reader.GetPixelID()),
+        'number_of_components': reader.GetNumberOfComponents(),
+        'fields': {key: reader.GetMetaData(key) for key in reader.GetMetaDataKeys()}
+    }
+    return reader, metadata
+
+def load_nrrd(file_path, header_only=False):
     """
     Load an NRRD file.
     
+    The file is parsed once; with header_only the voxel Data is not read at all.
+    
     Args:
         file_path (str): Path to the NRRD file.
+        header_only (bool): Only read the header and return None for the image.
     
     Returns:
-        tuple: (np.array: NRRD image Data, dict: metadata).
+        tuple: (np.array: NRRD image Data, dict: metadata, see read_image_header).
     """
-    img = sitk.ReadImage(file_path)
-    return sitk.GetArrayFromImage(img), sitk.ReadImage(file_path)
+    reader, metadata = read_image_header(file_path)
+    if header_only:
+        return None, metadata
+    return sitk.GetArrayFromImage(reader.Execute()), metadata
 
 def load_excel(file_path):
     """
@@ -173,17 +431,23 @@ def create_feature_vector(patient_data):
     # Add clinical Data
     if 'clinical' in patient_data:
         clinical_data = patient_data['clinical']
+        if isinstance(clinical_data, LazyData):
+            clinical_data = clinical_data.get()
         feature_vector['clinical'] = clinical_data
     
     return feature_vector
 
 def export_data_availability(patients_data, output_path):
     """
-    Export an Excel sheet indicating Data availability for each patient.
+    Export a table indicating Data availability for each patient.
+    
+    Only the modality keys are inspected, so this runs on the output of
+    build_manifest or on lazily loaded Data without decoding any images.
     
     Args:
-        patients_data (dict): Dictionary containing Data for all patients.
-        output_path (str): Path to save the Excel sheet.
+        patients_data (dict): Dictionary containing Data (or manifest entries) for all patients.
+        output_path (str): Path to save the table; the format follows the extension
+            (.parquet, .feather, .csv or .xlsx).
     """
     records = []
     for patient_id, data in patients_data.items():
@@ -197,7 +461,7 @@ def export_data_availability(patients_data, output_path):
         records.append(record)
     
     df = pd.DataFrame(records)
-    df.to_excel(output_path, index=False)
+    save_table(df, output_path)
 
 def split_data(patients_data, test_size=0.2):
     """
@@ -221,13 +485,406 @@ def split_data(patients_data, test_size=0.2):
     
     return training_set, testing_set
 
-def load_all_data(directory, use_sample_data=False):
+class LazyData:
+    """
+    Handle to a Data file that is only decoded on first access.
+    
+    The handle unpacks like the tuple returned by the loader, so
+    `image, metadata = patients_data[patient_id]['ct']` keeps working.
+    
+    Args:
+        loader (callable): Loader decoding the Data.
+        *args: Arguments passed to the loader.
+        cache (VolumeCache): Cache the loader goes through, if any. Its counters collect
+            the hits and misses of decodes run in a process pool.
+    """
+    def __init__(self, loader, *args, cache=None):
+        self.loader = loader
+        self.args = args
+        self.cache = cache
+        self._data = None
+        self._loaded = False
+        self._future = None
+        self._counted = False
+        self._lock = threading.Lock()
+    
+    @property
+    def loaded(self):
+        return self._loaded
+    
+    def submit(self, executor):
+        """
+        Schedule decoding on an executor so a later get() does not block on it.
+        
+        Args:
+            executor (concurrent.futures.Executor): Pool used to run the loader.
+        """
+        with self._lock:
+            if not self._loaded and self._future is None:
+                self._counted = self.cache is not None and isinstance(executor, ProcessPoolExecutor)
+                if self._counted:
+                    self._future = executor.submit(_count_in_worker, self.cache, self.loader, *self.args)
+                else:
+                    self._future = executor.submit(self.loader, *self.args)
+    
+    def get(self):
+        """
+        Decode the Data if needed and return it.
+        
+        Returns:
+            Data: Whatever the loader returns.
+        """
+        with self._lock:
+            if not self._loaded:
+                if self._future is not None:
+                    self._data = self._future.result()
+                    if self._counted:
+                        self._data, counts = self._data
+                        self.cache.add_counts(counts)
+                    self._future = None
+                else:
+                    self._data = self.loader(*self.args)
+                self._loaded = True
+        return self._data
+    
+    def __iter__(self):
+        return iter(self.get())
+    
+    def __getitem__(self, index):
+        return self.get()[index]
+    
+    def __len__(self):
+        return len(self.get())
+
+def build_manifest(directory, read_headers=False):
+    """
+    Build a lightweight per-patient manifest of the Data files in a directory.
+    
+    Only file system metadata (and optionally image headers) is read; no voxel
+    Data is decoded.
+    
+    Args:
+        directory (str): Path to the directory containing Data files.
+        read_headers (bool): Add the 'header' of NIfTI, NRRD and .rtvol volumes (size,
+            spacing, origin, ...) from a header-only read.
+    
+    Returns:
+        dict: {patient_id: {modality: [entry, ...]}} where each entry is a dict
+            with 'path', 'modality', 'size' and 'mtime'.
+    """
+    manifest = {}
+    for root, directories, files in os.walk(directory):
+        patient_id = os.path.basename(root)
+        volumes = sorted(i for i in directories if i.lower().endswith(RTVOL_EXTENSION))
+        # A .rtvol directory is one volume; its chunks are not walked
+        directories[:] = [i for i in directories if i not in volumes]
+        for file in volumes + sorted(files):
+            modality = get_modality(file)
+            if modality is None:
+                continue
+            file_path = os.path.join(root, file)
+            stat = os.stat(file_path)
+            entry = {
+                'path': file_path,
+                'modality': modality,
+                'size': stat.st_size,
+                'mtime': stat.st_mtime
+            }
+            if read_headers and get_extension(file) == RTVOL_EXTENSION:
+                entry['header'] = RTVolume(file_path).meta
+            elif read_headers and modality in ('mri', 'pet'):
+                entry['header'] = read_image_header(file_path)[1]
+            manifest.setdefault(patient_id, {}).setdefault(modality, []).append(entry)
+    return manifest
+
+def lazy_patients_data(manifest, cache=None):
+    """
+    Turn a manifest into patients_data made of LazyData handles.
+    
+    Args:
+        manifest (dict): Output of build_manifest.
+        cache (VolumeCache): Optional decoded-volume cache.
+    
+    Returns:
+        dict: Dictionary of patients' Data organized by patient ID.
+    """
+    patients_data = {}
+    for patient_id, modalities in manifest.items():
+        patients_data[patient_id] = {}
+        for modality, entries in modalities.items():
+            file_paths = [entry['path'] for entry in entries if get_extension(entry['path']) == '.dcm']
+            if file_paths:
+                # DICOM slices are assembled into one series volume
+                if cache is not None:
+                    handle = LazyData(cache.load, load_dicom_series, file_paths, cache=cache)
+                else:
+                    handle = LazyData(load_dicom_series, file_paths)
+            else:
+                # Same as the eager loader: the last file of a modality wins
+                handle = LazyData(load_data, entries[-1]['path'], cache, cache=cache)
+            patients_data[patient_id][modality] = handle
+    return patients_data
+
+def prefetch_data(patients_data, max_workers=None, use_processes=False):
+    """
+    Decode every LazyData handle in parallel in the background.
+    
+    Args:
+        patients_data (dict): Dictionary of patients' Data with LazyData handles.
+        max_workers (int): Number of workers in the pool.
+        use_processes (bool): Use a process pool instead of a thread pool.
+    """
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    executor = executor_class(max_workers=max_workers)
+    for data in patients_data.values():
+        for handle in data.values():
+            if isinstance(handle, LazyData):
+                handle.submit(executor)
+    # Queued work still runs, we just do not wait for it here
+    executor.shutdown(wait=False)
+
+class LoadReport:
+    """
+    Structured record of the files loaded, and the errors hit, by a loading run.
+    
+    Args:
+        verbose (bool): Also print every error as it is recorded.
+    """
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.loaded = []
+        self.errors = []
+        self._lock = threading.Lock()
+    
+    def add_loaded(self, item):
+        with self._lock:
+            self.loaded.append(item)
+    
+    def add_error(self, item, error_type, message, details=''):
+        with self._lock:
+            self.errors.append({
+                'path': item,
+                'error_type': error_type,
+                'message': message,
+                'traceback': details
+            })
+        if self.verbose:
+            print(f"Error loading {item}: {message}")
+    
+    def summary(self):
+        """
+        Returns:
+            dict: Number of loaded files and errors, with error counts per type.
+        """
+        error_types = {}
+        for error in self.errors:
+            error_types[error['error_type']] = error_types.get(error['error_type'], 0) + 1
+        return {'loaded': len(self.loaded), 'errors': len(self.errors), 'error_types': error_types}
+
+def _load_item(item, cache=None):
+    # A list of paths is a DICOM series, anything else a single file
+    if isinstance(item, (list, tuple)):
+        if cache is not None:
+            return cache.load(load_dicom_series, list(item))
+        return load_dicom_series(list(item))
+    return load_data(item, cache=cache)
+
+def _cache_key(item, cache):
+    # Same key as the cache.load call made by _load_item
+    if isinstance(item, (list, tuple)):
+        return cache.key(load_dicom_series, list(item))
+    return cache.key(load_data, item)
+
+def _count_in_worker(cache, function, *args):
+    # The worker decodes through its own copy of the cache, so the counts it records are
+    # returned for the parent to add to the caller's cache
+    before = cache.counters()
+    result = function(*args)
+    after = cache.counters()
+    return result, {counter: after[counter] - before[counter] for counter in after}
+
+def _load_worker(item, cache=None):
+    """
+    Decode an item in a worker process, returning the error details instead of raising.
+    
+    A result stored in the cache is returned as its cache key, so the parent memory-maps
+    the entry instead of receiving a pickled copy of the array.
+    """
+    try:
+        data = _load_item(item, cache)
+        if cache is not None:
+            key = _cache_key(item, cache)
+            if cache.get(key, count=False) is not None:
+                return 'cached', key
+        return 'value', data
+    except Exception as e:
+        return 'error', type(e).__name__, str(e), traceback.format_exc()
+
+def load_many(items, max_workers=None, thread_workers=None, report=None, cache=None):
+    """
+    Load many files concurrently, yielding results as they complete.
+    
+    CPU-bound formats (DICOM, NIfTI, NRRD) are decoded in a process pool; I/O-bound
+    formats (Excel, XML, images) are loaded in a thread pool. Closing the generator
+    early cancels the items not started yet and waits for the running ones.
+    
+    With a cache, cached volumes are memory-mapped here without going through the pool,
+    and the volumes the workers decode come back through the cache as memory maps too.
+    Without one, decoded arrays are pickled back from the workers.
+    
+    Args:
+        items (list): File paths. A list of paths is loaded as one DICOM series.
+        max_workers (int): Number of worker processes.
+        thread_workers (int): Number of worker threads.
+        report (LoadReport): Collects loaded items and errors. Defaults to a verbose report.
+        cache (VolumeCache): Optional decoded-volume cache.
+    
+    Yields:
+        tuple: (item, Data) for every item that loaded successfully.
+    """
+    if report is None:
+        report = LoadReport(verbose=True)
+    process_items = [i for i in items if isinstance(i, (list, tuple)) or get_extension(i) in PROCESS_EXTENSIONS]
+    thread_items = [i for i in items if not isinstance(i, (list, tuple)) and get_extension(i) not in PROCESS_EXTENSIONS]
+    if cache is not None:
+        uncached_items = []
+        for item in process_items:
+            try:
+                cached = cache.get(_cache_key(item, cache), count=False)
+            except OSError:
+                # Missing inputs are reported by the worker
+                cached = None
+            if cached is None:
+                uncached_items.append(item)
+                continue
+            cache.add_counts({'hits': 1})
+            report.add_loaded(item)
+            yield item, cached
+        process_items = uncached_items
+    with ProcessPoolExecutor(max_workers=max_workers) as process_pool, \
+            ThreadPoolExecutor(max_workers=thread_workers) as thread_pool:
+        if cache is not None:
+            futures = {process_pool.submit(_count_in_worker, cache, _load_worker, item, cache): (item, True)
+                       for item in process_items}
+        else:
+            futures = {process_pool.submit(_load_worker, item): (item, True) for item in process_items}
+        futures.update({thread_pool.submit(_load_item, item, cache): (item, False) for item in thread_items})
+        try:
+            for future in as_completed(futures):
+                item, in_process = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    report.add_error(item, type(e).__name__, str(e), traceback.format_exc())
+                    continue
+                if in_process:
+                    if cache is not None:
+                        result, counts = result
+                        cache.add_counts(counts)
+                    if result[0] == 'error':
+                        report.add_error(item, *result[1:])
+                        continue
+                    if result[0] == 'cached':
+                        key = result[1]
+                        result = cache.get(key, count=False)
+                        if result is None:
+                            # Evicted since the worker stored it
+                            try:
+                                result = _load_item(item)
+                            except Exception as e:
+                                report.add_error(item, type(e).__name__, str(e), traceback.format_exc())
+                                continue
+                    else:
+                        result = result[1]
+                report.add_loaded(item)
+                yield item, result
+        finally:
+            # Nothing is decoded for a consumer that stopped early
+            for future in futures:
+                future.cancel()
+
+def load_staged(items, stage_dir, report=None, read_ahead=4, max_bytes=20 * 1024 ** 3):
+    """
+    Load items folder by folder from local copies, so the next folders are copied from
+    the share (see src/common/staging.py) while the current one is decoded. Each copy is
+    deleted once its items are decoded.
+    
+    .rtvol volumes, which are already read a chunk at a time, and DICOM series spread over
+    several folders are loaded from where they are.
+    
+    Args:
+        items (list): File paths. A list of paths is loaded as one DICOM series.
+        stage_dir (str): Local scratch directory.
+        report (LoadReport): Collects loaded items and errors. Defaults to a verbose report.
+        read_ahead (int): Folders staged ahead of the one being decoded.
+        max_bytes (int): Disk budget of the staged folders.
+    
+    Yields:
+        tuple: (item, Data) for every item that loaded successfully, items keep their
+            original paths.
+    """
+    if report is None:
+        report = LoadReport(verbose=True)
+    items_by_folder = {}
+    direct_items = []
+    for item in items:
+        paths = list(item) if isinstance(item, (list, tuple)) else [item]
+        folders = {os.path.dirname(i) for i in paths}
+        if len(folders) == 1 and get_extension(paths[0]) != RTVOL_EXTENSION:
+            items_by_folder.setdefault(folders.pop(), []).append(item)
+        else:
+            direct_items.append(item)
+    
+    def load(item, local_item):
+        try:
+            data = _load_item(local_item)
+        except Exception as e:
+            report.add_error(item, type(e).__name__, str(e), traceback.format_exc())
+            return False, None
+        report.add_loaded(item)
+        return True, data
+    
+    for item in direct_items:
+        loaded, data = load(item, item)
+        if loaded:
+            yield item, data
+    sources = [(folder, sorted({os.path.basename(i) for item in folder_items
+                                for i in (item if isinstance(item, (list, tuple)) else [item])}))
+               for folder, folder_items in items_by_folder.items()]
+    with FolderStager(stage_dir, read_ahead=read_ahead, max_bytes=max_bytes) as stager:
+        for staged in stager.stage(sources):
+            for item in items_by_folder[staged.source]:
+                if staged.error is not None:
+                    report.add_error(item, type(staged.error).__name__, str(staged.error))
+                    continue
+                if isinstance(item, (list, tuple)):
+                    local_item = [os.path.join(staged.path, os.path.basename(i)) for i in item]
+                else:
+                    local_item = os.path.join(staged.path, os.path.basename(item))
+                loaded, data = load(item, local_item)
+                if loaded:
+                    yield item, data
+            stager.release(staged)
+
+@metrics.instrument('load_all_data')
+def load_all_data(directory, use_sample_data=False, lazy=False, max_workers=None, use_processes=False, prefetch=False, cache=None, report=None,
+                  stage_dir=None):
     """
     Load all Data files from a directory and organize by patient ID.
     
     Args:
         directory (str): Path to the directory containing Data files.
         use_sample_data (bool): Whether to use sample Data if actual Data is not available.
+        lazy (bool): Return LazyData handles built from a manifest instead of decoded Data.
+        max_workers (int): Number of workers used to decode (through load_many in eager
+            mode, through prefetch_data in lazy mode). None decodes serially in eager mode.
+        use_processes (bool): Decode in a process pool instead of a thread pool.
+        prefetch (bool): Start decoding all handles in the background (lazy mode only).
+        cache (VolumeCache): Optional decoded-volume cache shared by all loaders.
+        report (LoadReport): Collects loading errors. Defaults to a report printing them.
+        stage_dir (str): Copy the folders to this local directory ahead of decoding them
+            (eager mode only, see load_staged). Files are then decoded serially and not
+            cached, since the local copies are temporary.
     
     Returns:
         dict: Dictionary of patients' Data organized by patient ID.
@@ -236,36 +893,66 @@ def load_all_data(directory, use_sample_data=False):
         print("Using sample Data...")
         download_sample_data(directory)
     
-    patients_data = {}
+    if lazy:
+        patients_data = lazy_patients_data(build_manifest(directory), cache=cache)
+        if prefetch:
+            prefetch_data(patients_data, max_workers=max_workers, use_processes=use_processes)
+        return patients_data
     
-    for root, _, files in os.walk(directory):
-        for file in files:
+    if report is None:
+        report = LoadReport(verbose=True)
+    
+    patients_data = {}
+    items = []
+    dicom_files = {}
+    
+    for root, directories, files in os.walk(directory):
+        volumes = [i for i in directories if i.lower().endswith(RTVOL_EXTENSION)]
+        # A .rtvol directory is one volume; its chunks are not walked
+        directories[:] = [i for i in directories if i not in volumes]
+        if volumes:
+            # The volume store's per-patient index is not a Data file
+            files = [i for i in files if i != STORE_INDEX_FILE]
+        for file in volumes + files:
             file_path = os.path.join(root, file)
             patient_id = os.path.basename(root)
             
             if patient_id not in patients_data:
                 patients_data[patient_id] = {}
             
-            try:
-                data = load_data(file_path)
-                
-                if isinstance(data, tuple):
-                    # Handle different types of medical images and metadata
-                    if file.endswith('.dcm'):
-                        patients_data[patient_id]['ct'] = data
-                    elif file.endswith(('.nii', '.nii.gz')):
-                        patients_data[patient_id]['mri'] = data
-                    elif file.endswith('.nrrd'):
-                        patients_data[patient_id]['pet'] = data
-                else:
-                    # Handle clinical Data
-                    if file.endswith(('.xlsx', '.xls')):
-                        patients_data[patient_id]['clinical'] = data
-                    elif file.endswith('.xml'):
-                        patients_data[patient_id]['clinical'] = data
-            
-            except Exception as e:
-                print(f"Error loading file {file_path}: {e}")
+            if file.lower().endswith('.dcm'):
+                # Slices are collected and assembled per series below
+                dicom_files.setdefault(patient_id, []).append(file_path)
+            else:
+                items.append((patient_id, file_path))
+    items += list(dicom_files.items())
+    
+    if stage_dir is not None:
+        results = load_staged([item for _, item in items], stage_dir, report=report)
+    elif max_workers is None:
+        def load_serially():
+            for _, item in items:
+                try:
+                    yield item, _load_item(item, cache)
+                except Exception as e:
+                    report.add_error(item, type(e).__name__, str(e), traceback.format_exc())
+                    continue
+                report.add_loaded(item)
+        results = load_serially()
+    else:
+        results = load_many([item for _, item in items], max_workers=max_workers, report=report, cache=cache)
+    
+    # DICOM series are lists, so they are keyed by their tuple of paths
+    patient_ids = {(tuple(item) if isinstance(item, list) else item): patient_id for patient_id, item in items}
+    for item, data in results:
+        if isinstance(item, list):
+            patients_data[patient_ids[tuple(item)]]['ct'] = data
+            continue
+        patient_id = patient_ids[item]
+        # Handle different types of medical images and clinical Data
+        modality = get_modality(item)
+        if modality is not None and (modality != 'ct' or get_extension(item) == RTVOL_EXTENSION):
+            patients_data[patient_id][modality] = data
     
     return patients_data
 
@@ -273,7 +960,7 @@ def load_all_data(directory, use_sample_data=False):
 if __name__ == "__main__":
     raw_data_directory = r'C:\Users\foste\Documents\_Dev\Github\Academia\RTPlanAI\data\raw'
     processed_data_directory = r'C:\Users\foste\Documents\_Dev\Github\Academia\RTPlanAI\data\processed'
-    output_availability_file = os.path.join(processed_data_directory, 'data_availability.xlsx')
+    output_availability_file = os.path.join(processed_data_directory, 'data_availability.parquet')
     
     # Load all Data from the raw Data directory
     patients_data = load_all_data(raw_data_directory, use_sample_data=True)
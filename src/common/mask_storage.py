@@ -0,0 +1,266 @@
+import os
+import json
+import zlib
+import struct
+import numpy as np
+import SimpleITK as sitk
+from src.common.utils import atomic_write
+
+# File layout: magic, uint32 header length, JSON header, then one payload per ROI
+RTMASK_MAGIC = b'RTMASK1\n'
+RTMASK_EXTENSION = '.rtmask'
+
+def image_metadata(image):
+    """
+    Grid of a SimpleITK image in the form stored in .rtmask headers.
+    
+    Args:
+        image (sitk.Image): Image or mask.
+    
+    Returns:
+        dict: 'shape' in array (z, y, x) order, 'spacing', 'origin' and 'direction' in (x, y, z) order.
+    """
+    return {
+        'shape': list(image.GetSize()[::-1]),
+        'spacing': list(image.GetSpacing()),
+        'origin': list(image.GetOrigin()),
+        'direction': list(image.GetDirection())
+    }
+
+def encode_mask(mask, compress=True):
+    """
+    Encode one ROI as its bounding box and the bit-packed voxels inside it.
+    
+    Args:
+        mask (np.array): Mask ordered (z, y, x); non-zero voxels are foreground.
+        compress (bool): Deflate the packed bits. Runs of identical bytes inside the box
+            compress well, so this is usually several times smaller again.
+    
+    Returns:
+        tuple: (dict: 'box' as [start, stop] per axis (None if empty), 'voxels' and
+            'encoding', bytes: payload).
+    """
+    mask = np.asarray(mask) != 0
+    box = []
+    for axis in range(mask.ndim):
+        occupied = np.flatnonzero(mask.any(axis=tuple(i for i in range(mask.ndim) if i != axis)))
+        if occupied.size == 0:
+            return {'box': None, 'voxels': 0, 'encoding': 'empty'}, b''
+        box.append([int(occupied[0]), int(occupied[-1]) + 1])
+    crop = mask[tuple(slice(start, stop) for start, stop in box)]
+    payload = np.packbits(crop, axis=None).tobytes()
+    encoding = 'packbits'
+    if compress:
+        payload = zlib.compress(payload, 1)
+        encoding = 'packbits+zlib'
+    return {'box': box, 'voxels': int(np.count_nonzero(crop)), 'encoding': encoding}, payload
+
+def _decode_box(entry, payload):
+    box = tuple(slice(start, stop) for start, stop in entry['box'])
+    box_shape = tuple(stop - start for start, stop in entry['box'])
+    if entry['encoding'] == 'packbits+zlib':
+        payload = zlib.decompress(payload)
+    bits = np.unpackbits(np.frombuffer(payload, dtype=np.uint8), count=int(np.prod(box_shape)))
+    return box, bits.reshape(box_shape).view(bool)
+
+def decode_mask(entry, payload, shape):
+    """
+    Inverse of encode_mask.
+    
+    Args:
+        entry (dict): ROI entry of the header.
+        payload (bytes): ROI payload.
+        shape (tuple): Full grid shape (z, y, x).
+    
+    Returns:
+        np.array: Boolean mask of the full grid.
+    """
+    mask = np.zeros(shape, dtype=bool)
+    if entry['box'] is None:
+        return mask
+    box, crop = _decode_box(entry, payload)
+    mask[box] = crop
+    return mask
+
+def save_masks(file_path, masks, metadata, compress=True):
+    """
+    Write ROI masks to a .rtmask file.
+    
+    Each ROI is stored separately, so overlapping ROIs are kept as they are. masks may be
+    a generator of (name, mask) pairs; every ROI is encoded as soon as it is produced, so
+    only the compact payloads are held in memory. The file is written to a temporary name
+    and renamed into place.
+    
+    Args:
+        file_path (str): Output path, normally ending in .rtmask.
+        masks (dict or iterable): {name: mask} or (name, mask) pairs on the grid of metadata.
+            Labels are assigned 1, 2, ... in this order.
+        metadata (dict): Grid, see image_metadata.
+        compress (bool): Deflate the packed bits.
+    
+    Returns:
+        dict: The header written.
+    """
+    if isinstance(masks, dict):
+        masks = masks.items()
+    shape = tuple(metadata['shape'])
+    rois = []
+    payloads = []
+    offset = 0
+    for label, (name, mask) in enumerate(masks, start=1):
+        if tuple(mask.shape) != shape:
+            raise ValueError(f"ROI {name} has shape {mask.shape}, expected {shape}")
+        entry, payload = encode_mask(mask, compress)
+        entry.update({'name': name, 'label': label, 'offset': offset, 'length': len(payload)})
+        rois.append(entry)
+        payloads.append(payload)
+        offset += len(payload)
+    header = dict(metadata, shape=list(shape), rois=rois)
+    header_bytes = json.dumps(header).encode()
+    with atomic_write(file_path) as temp_path, open(temp_path, 'wb') as mask_file:
+        mask_file.write(RTMASK_MAGIC)
+        mask_file.write(struct.pack('<I', len(header_bytes)))
+        mask_file.write(header_bytes)
+        for payload in payloads:
+            mask_file.write(payload)
+    return header
+
+def _read_header(mask_file):
+    if mask_file.read(len(RTMASK_MAGIC)) != RTMASK_MAGIC:
+        raise ValueError(f"{mask_file.name} is not an .rtmask file")
+    header_length, = struct.unpack('<I', mask_file.read(4))
+    header = json.loads(mask_file.read(header_length))
+    return header, mask_file.tell()
+
+def read_mask_header(file_path):
+    """
+    Read only the header of a .rtmask file: grid and, per ROI, name, label, bounding box
+    and voxel count. No voxel is decoded.
+    
+    Args:
+        file_path (str): Path to the .rtmask file.
+    
+    Returns:
+        dict: Header.
+    """
+    with open(file_path, 'rb') as mask_file:
+        return _read_header(mask_file)[0]
+
+def load_masks(file_path, names=None):
+    """
+    Decode ROIs of a .rtmask file. Only the payloads of the requested ROIs are read.
+    
+    Args:
+        file_path (str): Path to the .rtmask file.
+        names (list): ROI names to decode. None decodes all of them.
+    
+    Returns:
+        tuple: (dict: {name: boolean mask ordered (z, y, x)}, dict: header).
+    """
+    with open(file_path, 'rb') as mask_file:
+        header, data_start = _read_header(mask_file)
+        shape = tuple(header['shape'])
+        wanted = set(names) if names is not None else None
+        masks = {}
+        for entry in header['rois']:
+            if wanted is not None and entry['name'] not in wanted:
+                continue
+            mask_file.seek(data_start + entry['offset'])
+            masks[entry['name']] = decode_mask(entry, mask_file.read(entry['length']), shape)
+    if wanted is not None and len(masks) != len(wanted):
+        raise KeyError(f"ROIs not in {file_path}: {sorted(wanted - set(masks))}")
+    return masks, header
+
+def load_rtmask(file_path):
+    """
+    Load a .rtmask file as a label map, like a multi-label Mask.nii.gz with its
+    Mask_Labels.json. Where ROIs overlap the later label wins; use load_masks to get
+    the ROIs separately.
+    
+    Args:
+        file_path (str): Path to the .rtmask file.
+    
+    Returns:
+        tuple: (np.array: uint8 or uint16 label map ordered (z, y, x), dict: header with
+            'labels' as {label: name}).
+    """
+    with open(file_path, 'rb') as mask_file:
+        header, data_start = _read_header(mask_file)
+        dtype = np.uint8 if len(header['rois']) < 256 else np.uint16
+        label_map = np.zeros(tuple(header['shape']), dtype=dtype)
+        for entry in header['rois']:
+            if entry['box'] is None:
+                continue
+            mask_file.seek(data_start + entry['offset'])
+            box, crop = _decode_box(entry, mask_file.read(entry['length']))
+            # Only the box is touched, never the full grid
+            label_map[box][crop] = entry['label']
+    header['labels'] = {entry['label']: entry['name'] for entry in header['rois']}
+    return label_map, header
+
+def mask_to_sitk(mask, metadata):
+    """
+    Wrap a mask in a uint8 SimpleITK image on the grid of metadata.
+    
+    Args:
+        mask (np.array): Mask or label map ordered (z, y, x).
+        metadata (dict): Grid, see image_metadata.
+    
+    Returns:
+        sitk.Image: Image with spacing, origin and direction set.
+    """
+    image = sitk.GetImageFromArray(mask.astype(np.uint8) if mask.dtype == bool else mask)
+    image.SetSpacing(metadata['spacing'])
+    image.SetOrigin(metadata['origin'])
+    image.SetDirection(metadata['direction'])
+    return image
+
+def load_masks_sitk(file_path, names=None):
+    """
+    load_masks returning SimpleITK images.
+    
+    Returns:
+        dict: {name: sitk.Image}.
+    """
+    masks, header = load_masks(file_path, names)
+    return {name: mask_to_sitk(mask, header) for name, mask in masks.items()}
+
+def save_sitk_masks(file_path, images, compress=True):
+    """
+    Write SimpleITK masks (e.g. ROI .mhd files) to a .rtmask file. All images must share
+    the grid of the first one.
+    
+    Args:
+        file_path (str): Output path.
+        images (dict or iterable): {name: sitk.Image} or (name, sitk.Image) pairs; may be a generator.
+        compress (bool): Deflate the packed bits.
+    
+    Returns:
+        dict: The header written.
+    """
+    if isinstance(images, dict):
+        images = images.items()
+    images = iter(images)
+    first = next(images, None)
+    if first is None:
+        raise ValueError("No masks to write.")
+    metadata = image_metadata(first[1])
+    
+    def arrays():
+        for name, image in [first]:
+            yield name, sitk.GetArrayViewFromImage(image)
+        for name, image in images:
+            if list(image.GetSize()[::-1]) != metadata['shape']:
+                raise ValueError(f"ROI {name} is not on the grid of {first[0]}")
+            yield name, sitk.GetArrayViewFromImage(image)
+    
+    return save_masks(file_path, arrays(), metadata, compress)
+
+# Example usage
+if __name__ == "__main__":
+    grid = {'shape': [100, 512, 512], 'spacing': [0.98, 0.98, 2.5], 'origin': [0, 0, 0],
+            'direction': [1, 0, 0, 0, 1, 0, 0, 0, 1]}
+    roi = np.zeros(grid['shape'], dtype=bool)
+    roi[40:60, 200:260, 220:300] = True
+    header = save_masks('example.rtmask', {'Prostate': roi}, grid)
+    print(header['rois'], os.path.getsize('example.rtmask'), 'bytes')
@@ -0,0 +1,63 @@
+import os
+import json
+import numpy as np
+from scipy import ndimage
+
+# Face-connected neighbourhood used to extract mask surfaces
+_SURFACE_STRUCTURE = ndimage.generate_binary_structure(3, 1)
+
+def read_mask_labels(folder):
+    """
+    Read the label names written next to a multi-label Mask.nii.gz by DicomToNifti.
+    
+    Args:
+        folder (str): Patient folder.
+    
+    Returns:
+        dict: {ROI name: label}, empty if the folder has no Mask_Labels.json.
+    """
+    labels_path = os.path.join(folder, 'Mask_Labels.json')
+    if not os.path.exists(labels_path):
+        return {}
+    with open(labels_path) as labels_file:
+        return {name: int(label) for label, name in json.load(labels_file).items()}
+
+def bounding_box(*masks, margin=1):
+    """
+    Smallest box holding the foreground of all masks, grown by a margin.
+    
+    Args:
+        *masks (np.array): Boolean masks of the same shape.
+        margin (int): Voxels added on every side, clipped to the array.
+    
+    Returns:
+        tuple: Slices selecting the box, or None if all masks are empty.
+    """
+    union = np.logical_or.reduce(masks) if len(masks) > 1 else masks[0]
+    box = []
+    for axis in range(union.ndim):
+        # Project onto one axis at a time instead of listing every foreground voxel
+        occupied = np.flatnonzero(union.any(axis=tuple(i for i in range(union.ndim) if i != axis)))
+        if occupied.size == 0:
+            return None
+        box.append(slice(max(occupied[0] - margin, 0), min(occupied[-1] + margin + 1, union.shape[axis])))
+    return tuple(box)
+
+def mask_surface(mask):
+    """
+    Surface voxels of a mask: foreground voxels with a background face neighbour.
+    
+    Args:
+        mask (np.array): Boolean mask.
+    
+    Returns:
+        np.array: Boolean surface mask.
+    """
+    return mask & ~ndimage.binary_erosion(mask, structure=_SURFACE_STRUCTURE, border_value=0)
+
+# Example usage
+if __name__ == "__main__":
+    roi = np.zeros((40, 128, 128), dtype=bool)
+    roi[10:20, 40:80, 50:90] = True
+    box = bounding_box(roi, margin=2)
+    print(box, np.count_nonzero(mask_surface(roi[box])))
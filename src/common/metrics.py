@@ -0,0 +1,308 @@
+import os
+import json
+import time
+import cProfile
+import logging
+import threading
+import functools
+import tracemalloc
+from multiprocessing import util
+from src.common.utils import save_json
+
+# Setting this environment variable to a file path enables metrics at import, which is
+# how worker processes started by load_many or convert_all join the parent's log
+METRICS_ENV_VAR = 'RTDS_METRICS'
+
+# Events only go to the handlers attached here (the JSON lines file, and the log file of
+# setup_logging), never to whatever handlers the root logger has, e.g. stderr
+logger = logging.getLogger('rtds.metrics')
+logger.propagate = False
+
+class _MetricsState:
+    def __init__(self):
+        self.enabled = False
+        self.output_path = None
+        self.profile_dir = None
+        self.trace_memory = False
+        self.started_tracemalloc = False
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.timers = {}
+        self.handler = None
+
+_state = _MetricsState()
+
+def is_enabled():
+    """
+    Check whether metrics are being collected.
+    
+    Returns:
+        bool: True between enable_metrics and disable_metrics.
+    """
+    return _state.enabled
+
+def enable_metrics(output_path=None, profile_dir=None, trace_memory=False):
+    """
+    Start collecting metrics.
+    
+    Events are written as JSON lines to output_path (appended, so several processes can
+    share one file) through the 'rtds.metrics' logger, so they also reach the log file
+    configured by setup_logging.
+    
+    Args:
+        output_path (str): JSON lines file for the events. None only aggregates in memory.
+        profile_dir (str): Directory for cProfile dumps of profiled() blocks. None disables profiling.
+        trace_memory (bool): Record Python heap allocations of timed blocks with tracemalloc.
+    """
+    disable_metrics()
+    with _state.lock:
+        _state.output_path = output_path
+        _state.profile_dir = profile_dir
+        _state.trace_memory = trace_memory
+        if output_path is not None:
+            handler = logging.FileHandler(output_path, mode='a')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            handler.setLevel(logging.INFO)
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+            _state.handler = handler
+            os.environ[METRICS_ENV_VAR] = output_path
+        if profile_dir is not None:
+            os.makedirs(profile_dir, exist_ok=True)
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _state.started_tracemalloc = True
+        _state.enabled = True
+
+def disable_metrics():
+    """
+    Stop collecting metrics and close the event file. Aggregates are kept until reset_metrics.
+    """
+    with _state.lock:
+        _state.enabled = False
+        if _state.handler is not None:
+            logger.removeHandler(_state.handler)
+            _state.handler.close()
+            _state.handler = None
+        os.environ.pop(METRICS_ENV_VAR, None)
+        if _state.started_tracemalloc:
+            tracemalloc.stop()
+            _state.started_tracemalloc = False
+        _state.trace_memory = False
+
+def reset_metrics():
+    """
+    Clear the aggregated counters and timers.
+    """
+    with _state.lock:
+        _state.counters = {}
+        _state.timers = {}
+
+def emit(event, **fields):
+    """
+    Write one structured event.
+    
+    Args:
+        event (str): Event type, e.g. 'timer' or 'profile'.
+        **fields: JSON serializable fields of the event.
+    """
+    if not _state.enabled:
+        return
+    record = {'event': event, 'time': time.time(), 'pid': os.getpid(), 'thread': threading.get_ident()}
+    record.update(fields)
+    logger.info(json.dumps(record, default=str))
+
+def count(name, value=1):
+    """
+    Add to a counter, e.g. count('bytes_read', size).
+    
+    Args:
+        name (str): Counter name.
+        value (int or float): Amount to add.
+    """
+    if not _state.enabled:
+        return
+    with _state.lock:
+        _state.counters[name] = _state.counters.get(name, 0) + value
+
+def count_array(array, prefix='arrays'):
+    """
+    Count an allocated array in '<prefix>_allocated' and '<prefix>_bytes'.
+    
+    Args:
+        array: Array-like with an nbytes attribute; other objects are ignored.
+        prefix (str): Counter name prefix.
+    """
+    if not _state.enabled or not hasattr(array, 'nbytes'):
+        return
+    with _state.lock:
+        _state.counters[f'{prefix}_allocated'] = _state.counters.get(f'{prefix}_allocated', 0) + 1
+        _state.counters[f'{prefix}_bytes'] = _state.counters.get(f'{prefix}_bytes', 0) + array.nbytes
+
+def _record_time(name, seconds):
+    with _state.lock:
+        timer = _state.timers.get(name)
+        if timer is None:
+            timer = _state.timers[name] = {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0}
+        timer['count'] += 1
+        timer['seconds'] += seconds
+        timer['max_seconds'] = max(timer['max_seconds'], seconds)
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+    
+    def add_fields(self, **fields):
+        pass
+    
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+class _Timer:
+    def __init__(self, name, emit_event, fields):
+        self.name = name
+        self.emit_event = emit_event
+        self.fields = fields
+    
+    def __enter__(self):
+        if _state.trace_memory:
+            self.start_traced = tracemalloc.get_traced_memory()[0]
+        self.start = time.perf_counter()
+        return self
+    
+    def add_fields(self, **fields):
+        """
+        Add event fields only known inside the block, e.g. the number of items processed.
+        """
+        self.fields.update(fields)
+    
+    def __exit__(self, exc_type, exc_value, tb):
+        seconds = time.perf_counter() - self.start
+        _record_time(self.name, seconds)
+        if self.emit_event:
+            fields = dict(self.fields)
+            if _state.trace_memory and tracemalloc.is_tracing():
+                current, peak = tracemalloc.get_traced_memory()
+                fields['traced_delta_bytes'] = current - self.start_traced
+                fields['traced_peak_bytes'] = peak
+            if exc_type is not None:
+                fields['error'] = exc_type.__name__
+            emit('timer', name=self.name, seconds=seconds, **fields)
+        return False
+
+def timed(name, emit_event=True, **fields):
+    """
+    Time a block: with timed('decode', path=file_path): ...
+    
+    The time is added to the aggregate of name and, if emit_event, written as an event
+    with the extra fields, to which the block can add with timer.add_fields(...). Per-item timers inside hot loops should pass emit_event=False
+    and rely on the aggregates. When metrics are disabled a shared no-op context is returned.
+    
+    Args:
+        name (str): Timer name.
+        emit_event (bool): Write an event for this block.
+        **fields: Extra JSON serializable event fields.
+    
+    Returns:
+        Context manager.
+    """
+    if not _state.enabled:
+        return _NULL_TIMER
+    return _Timer(name, emit_event, fields)
+
+def instrument(name=None, emit_event=True):
+    """
+    Decorator timing every call of a function with timed().
+    
+    Args:
+        name (str): Timer name. Defaults to the qualified function name.
+        emit_event (bool): Write an event per call.
+    """
+    def decorator(function):
+        timer_name = name or f'{function.__module__}.{function.__qualname__}'
+        
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _state.enabled:
+                return function(*args, **kwargs)
+            with _Timer(timer_name, emit_event, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class profiled:
+    """
+    Context manager capturing a cProfile dump of a block when metrics were enabled
+    with a profile_dir; otherwise it does nothing.
+    
+    The dump is written to <profile_dir>/<name>.<pid>.prof (readable with pstats or
+    snakeviz) and announced with a 'profile' event.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.profiler = None
+    
+    def __enter__(self):
+        if _state.enabled and _state.profile_dir is not None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, tb):
+        if self.profiler is not None:
+            self.profiler.disable()
+            file_path = os.path.join(_state.profile_dir, f'{self.name}.{os.getpid()}.prof')
+            self.profiler.dump_stats(file_path)
+            emit('profile', name=self.name, path=file_path)
+            self.profiler = None
+        return False
+
+def summary():
+    """
+    Aggregated counters and timers of this process.
+    
+    Returns:
+        dict: {'counters': {name: value}, 'timers': {name: {'count', 'seconds', 'max_seconds'}}}.
+    """
+    with _state.lock:
+        return {
+            'counters': dict(_state.counters),
+            'timers': {name: dict(timer) for name, timer in _state.timers.items()}
+        }
+
+def write_summary(file_path):
+    """
+    Save summary() to a JSON file and emit it as a 'summary' event.
+    
+    Args:
+        file_path (str): Path to the JSON file.
+    """
+    data = summary()
+    save_json(data, file_path, atomic=True)
+    emit('summary', **data)
+
+def _emit_summary_at_exit():
+    if _state.enabled and (_state.counters or _state.timers):
+        emit('summary', **summary())
+
+def _register_exit_summary(*_):
+    util.Finalize(None, _emit_summary_at_exit, exitpriority=0)
+
+# Every process reports its aggregates when it exits. multiprocessing runs its finalizers
+# at interpreter exit and at the end of worker processes, which skip atexit handlers;
+# forked workers start with an empty registry, so the finalizer is registered again
+_register_exit_summary()
+util.register_after_fork(_state, _register_exit_summary)
+
+if os.environ.get(METRICS_ENV_VAR):
+    enable_metrics(os.environ[METRICS_ENV_VAR])
+
+# Example usage
+if __name__ == "__main__":
+    enable_metrics('metrics.jsonl')
+    with timed('example', size=3):
+        count('items', 3)
+    print(summary())
+    disable_metrics()
@@ -0,0 +1,261 @@
+import time
+import queue
+import threading
+import numpy as np
+from src.common.data_loader import build_manifest, lazy_patients_data
+from src.common.preprocessing import preprocess_image_batch
+
+# Marks the end of a stream in the queues between stages
+_END = object()
+
+class _Failure:
+    def __init__(self, exception):
+        self.exception = exception
+
+class StageStats:
+    """
+    Counters for one pipeline stage.
+    """
+    def __init__(self, name, input_queue):
+        self.name = name
+        self.input_queue = input_queue
+        self.items_in = 0
+        self.items_out = 0
+        self.busy_seconds = 0.0
+        self.max_queue_depth = 0
+        self._lock = threading.Lock()
+    
+    def record(self, items_out, seconds):
+        with self._lock:
+            self.items_in += 1
+            self.items_out += items_out
+            self.busy_seconds += seconds
+    
+    def as_dict(self):
+        return {
+            'items_in': self.items_in,
+            'items_out': self.items_out,
+            'busy_seconds': self.busy_seconds,
+            'items_per_second': self.items_in / self.busy_seconds if self.busy_seconds else 0.0,
+            'queue_depth': self.input_queue.qsize(),
+            'max_queue_depth': self.max_queue_depth
+        }
+
+class StreamPipeline:
+    """
+    Chain of stages connected by bounded queues, each stage running in its own threads.
+    
+    Every stage function takes one item and returns an iterable of output items, so a
+    stage can drop, pass through or split items. Bounded queues keep memory constant
+    and let I/O in one stage overlap with CPU work in the next.
+    
+    Args:
+        source (callable or iterable): Callable returning a fresh iterable of input items,
+            called every time the pipeline is iterated. A plain iterable can only be
+            iterated once if it is an iterator, e.g. a started generator.
+        queue_size (int): Maximum number of items waiting between two stages.
+    """
+    def __init__(self, source, queue_size=2):
+        self.source = source
+        self.queue_size = queue_size
+        self.stages = []
+        self._stats = {}
+    
+    def add_stage(self, name, function, workers=1, flush=None):
+        """
+        Append a stage.
+        
+        Args:
+            name (str): Stage name used in stats().
+            function (callable): item -> iterable of output items.
+            workers (int): Number of threads running this stage.
+            flush (callable): Optional callable returning the final items once the input
+                is exhausted (only for single-worker stages, e.g. batching).
+        
+        Returns:
+            StreamPipeline: self, so stages can be chained.
+        """
+        if flush is not None and workers != 1:
+            raise ValueError("A stage with a flush function must have a single worker.")
+        self.stages.append((name, function, workers, flush))
+        return self
+    
+    def stats(self):
+        """
+        Per-stage throughput and queue depth.
+        
+        Returns:
+            dict: {stage name: counters}.
+        """
+        return {name: stage_stats.as_dict() for name, stage_stats in self._stats.items()}
+    
+    def _put(self, output_queue, item, stop):
+        while not stop.is_set():
+            try:
+                output_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def _run_source(self, output_queue, stop):
+        try:
+            source = self.source() if callable(self.source) else self.source
+            for item in source:
+                if not self._put(output_queue, item, stop):
+                    return
+        except Exception as e:
+            self._put(output_queue, _Failure(e), stop)
+        self._put(output_queue, _END, stop)
+    
+    def _run_stage(self, function, flush, input_queue, output_queue, stage_stats, remaining, stop):
+        item = None
+        while not stop.is_set():
+            try:
+                item = input_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            stage_stats.max_queue_depth = max(stage_stats.max_queue_depth, input_queue.qsize() + 1)
+            if item is _END or isinstance(item, _Failure):
+                # Let the other workers of this stage see the end of the stream as well
+                input_queue.put(item)
+                break
+            start = time.perf_counter()
+            try:
+                outputs = list(function(item))
+            except Exception as e:
+                self._put(output_queue, _Failure(e), stop)
+                return
+            stage_stats.record(len(outputs), time.perf_counter() - start)
+            for output in outputs:
+                if not self._put(output_queue, output, stop):
+                    return
+        if stop.is_set():
+            return
+        with remaining['lock']:
+            remaining['workers'] -= 1
+            last_worker = remaining['workers'] == 0
+        if last_worker:
+            if isinstance(item, _Failure):
+                self._put(output_queue, item, stop)
+                return
+            if flush is not None:
+                try:
+                    outputs = list(flush())
+                except Exception as e:
+                    self._put(output_queue, _Failure(e), stop)
+                    return
+                for output in outputs:
+                    if not self._put(output_queue, output, stop):
+                        return
+            self._put(output_queue, _END, stop)
+    
+    def __iter__(self):
+        stop = threading.Event()
+        threads = []
+        input_queue = queue.Queue(maxsize=self.queue_size)
+        threads.append(threading.Thread(target=self._run_source, args=(input_queue, stop), daemon=True))
+        self._stats = {}
+        for name, function, workers, flush in self.stages:
+            output_queue = queue.Queue(maxsize=self.queue_size)
+            stage_stats = StageStats(name, input_queue)
+            self._stats[name] = stage_stats
+            remaining = {'workers': workers, 'lock': threading.Lock()}
+            for _ in range(workers):
+                threads.append(threading.Thread(target=self._run_stage, daemon=True,
+                                                args=(function, flush, input_queue, output_queue,
+                                                      stage_stats, remaining, stop)))
+            input_queue = output_queue
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = input_queue.get()
+                if item is _END:
+                    break
+                if isinstance(item, _Failure):
+                    raise item.exception
+                yield item
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+def image_batch_pipeline(directory, modality='ct', batch_size=32, target_size=(256, 256),
+                         normalization_method='z-score', slice_axis=0, queue_size=2,
+                         decode_workers=2, preprocess_workers=1, cache=None):
+    """
+    Stream fixed-size preprocessed slice batches from a Data directory.
+    
+    Stages: manifest -> decode (load_data/load_dicom_series) -> resize/normalize
+    (preprocess_image_batch) -> batch. Volumes are decoded inside the decode stage and
+    never cached on a handle, so at most a few volumes are in flight at any time
+    regardless of cohort size. Every iteration of the pipeline rebuilds the manifest.
+    
+    Args:
+        directory (str): Path to the directory containing Data files.
+        modality (str): Modality key to stream ('ct', 'mri', 'pet').
+        batch_size (int): Number of slices per batch. The last batch may be smaller.
+        target_size (tuple): Target size passed to cv2.resize, i.e. (width, height).
+        normalization_method (str): Method for normalizing images ('z-score', 'min-max').
+        slice_axis (int): Axis of the decoded volume to slice along (0 for DICOM series,
+            2 for NIfTI/NRRD volumes in (x, y, z) order).
+        queue_size (int): Maximum number of items waiting between two stages.
+        decode_workers (int): Threads decoding volumes.
+        preprocess_workers (int): Threads resizing and normalizing volumes.
+        cache (VolumeCache): Optional decoded-volume cache.
+    
+    Returns:
+        StreamPipeline: Iterable of float32 batches of shape (batch_size, height, width),
+            with per-stage counters available from stats().
+    """
+    pending = []
+    
+    def manifest_source():
+        # Slices left over from an iteration that was stopped early
+        pending.clear()
+        manifest = build_manifest(directory)
+        for patient_id, modalities in manifest.items():
+            if modality not in modalities:
+                continue
+            # A handle of its own per patient, only used for its loader and arguments
+            handle = lazy_patients_data({patient_id: {modality: modalities[modality]}},
+                                        cache=cache)[patient_id][modality]
+            yield patient_id, handle.loader, handle.args
+    
+    def decode(item):
+        patient_id, loader, args = item
+        image, _ = loader(*args)
+        return [(patient_id, np.moveaxis(image, slice_axis, 0))]
+    
+    def preprocess(item):
+        _, volume = item
+        return [preprocess_image_batch(volume, target_size=target_size,
+                                       normalization_method=normalization_method)]
+    
+    def to_batches(slices):
+        pending.append(slices)
+        if sum(len(i) for i in pending) < batch_size:
+            return []
+        stacked = np.concatenate(pending)
+        pending.clear()
+        cut = len(stacked) - len(stacked) % batch_size
+        if cut < len(stacked):
+            pending.append(stacked[cut:])
+        return [stacked[start:start + batch_size] for start in range(0, cut, batch_size)]
+    
+    def flush_batches():
+        return [np.concatenate(pending)] if pending else []
+    
+    pipeline = StreamPipeline(manifest_source, queue_size=queue_size)
+    pipeline.add_stage('decode', decode, workers=decode_workers)
+    pipeline.add_stage('preprocess', preprocess, workers=preprocess_workers)
+    pipeline.add_stage('batch', to_batches, flush=flush_batches)
+    return pipeline
+
+# Example usage
+if __name__ == "__main__":
+    pipeline = image_batch_pipeline('path/to/data/raw', modality='ct', batch_size=32)
+    for batch in pipeline:
+        print(batch.shape)
+    print(pipeline.stats())
@@ -1,7 +1,14 @@
+import os
 import numpy as np
 import cv2
+import SimpleITK as sitk
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from sklearn.preprocessing import StandardScaler, MinMaxScaler
+from src.common.utils import save_json, load_json
+from src.common import metrics
 
 def normalize_image(image, method='z-score'):
     """
@@ -37,6 +44,66 @@ def resize_image(image, target_size):
     """
     return cv2.resize(image, target_size)
 
+def resample_volume(image, target_spacing, spacing=None, origin=None, is_mask=False,
+                    default_value=0, num_threads=None):
+    """
+    Resample a whole 3D volume to a target voxel spacing.
+    
+    Images are resampled in float32 with linear interpolation, masks with
+    nearest-neighbour interpolation so labels are preserved. SimpleITK runs the
+    resampling multi-threaded over the whole volume.
+    
+    Args:
+        image (np.array or sitk.Image): Volume to resample. Arrays are in (z, y, x)
+            order, as returned by sitk.GetArrayFromImage or load_dicom_series.
+        target_spacing (tuple): Target spacing (x, y, z) in mm.
+        spacing (tuple): Spacing (x, y, z) of an array input. Ignored for sitk.Image.
+        origin (tuple): Origin (x, y, z) of an array input. Ignored for sitk.Image.
+        is_mask (bool): Use nearest-neighbour interpolation and keep the pixel type.
+        default_value (float): Value for voxels outside the input volume.
+        num_threads (int): Number of threads. Defaults to SimpleITK's global setting.
+    
+    Returns:
+        np.array or sitk.Image: Resampled volume, of the same kind as the input.
+    """
+    return_array = not isinstance(image, sitk.Image)
+    is_bool = False
+    if return_array:
+        if spacing is None:
+            raise ValueError("spacing is required when resampling an array.")
+        image = np.asarray(image)
+        # SimpleITK has no boolean pixel type, so bool masks go through uint8
+        is_bool = image.dtype == bool
+        input_image = sitk.GetImageFromArray(image.view(np.uint8) if is_bool else image)
+        input_image.SetSpacing([float(i) for i in spacing])
+        if origin is not None:
+            input_image.SetOrigin([float(i) for i in origin])
+    else:
+        input_image = image
+    if not is_mask and input_image.GetPixelID() != sitk.sitkFloat32:
+        input_image = sitk.Cast(input_image, sitk.sitkFloat32)
+    
+    input_spacing = input_image.GetSpacing()
+    output_size = [max(1, int(round(size * old / new)))
+                   for size, old, new in zip(input_image.GetSize(), input_spacing, target_spacing)]
+    
+    resampler = sitk.ResampleImageFilter()
+    resampler.SetOutputSpacing([float(i) for i in target_spacing])
+    resampler.SetSize(output_size)
+    resampler.SetOutputOrigin(input_image.GetOrigin())
+    resampler.SetOutputDirection(input_image.GetDirection())
+    resampler.SetOutputPixelType(input_image.GetPixelID())
+    resampler.SetDefaultPixelValue(default_value)
+    resampler.SetInterpolator(sitk.sitkNearestNeighbor if is_mask else sitk.sitkLinear)
+    if num_threads is not None:
+        resampler.SetNumberOfThreads(num_threads)
+    output_image = resampler.Execute(input_image)
+    
+    if return_array:
+        output = sitk.GetArrayFromImage(output_image)
+        return output.astype(bool) if is_bool and is_mask else output
+    return output_image
+
 def preprocess_clinical_data(clinical_data):
     """
     Preprocess clinical Data.
@@ -48,17 +115,212 @@ def preprocess_clinical_data(clinical_data):
         pd.DataFrame: Preprocessed clinical Data.
     """
     # Example: Fill missing values and standardize numerical columns
-    clinical_data = clinical_data.fillna(clinical_data.mean())
+    numeric_columns = clinical_data.select_dtypes(include='number').columns
+    clinical_data = clinical_data.copy()
+    clinical_data[numeric_columns] = clinical_data[numeric_columns].fillna(clinical_data[numeric_columns].mean())
     scaler = StandardScaler()
-    clinical_data[clinical_data.columns] = scaler.fit_transform(clinical_data)
+    clinical_data[numeric_columns] = scaler.fit_transform(clinical_data[numeric_columns])
     return clinical_data
 
+def iter_table_chunks(source, chunksize=100000):
+    """
+    Iterate over a table in chunks without loading it whole.
+    
+    Args:
+        source (str or pd.DataFrame): Path to a .csv or .parquet file, or a DataFrame.
+        chunksize (int): Number of rows per chunk.
+    
+    Yields:
+        pd.DataFrame: Consecutive chunks of rows.
+    """
+    if isinstance(source, pd.DataFrame):
+        for start in range(0, len(source), chunksize):
+            yield source.iloc[start:start + chunksize]
+        return
+    extension = os.path.splitext(source)[1].lower()
+    if extension == '.parquet':
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    elif extension == '.csv':
+        for chunk in pd.read_csv(source, chunksize=chunksize):
+            yield chunk
+    else:
+        raise ValueError(f"Unsupported table extension: {extension}")
+
+def fit_clinical_statistics(source, chunksize=100000, columns=None):
+    """
+    Compute per-column mean and standard deviation in a single pass over chunks.
+    
+    Chunk statistics are merged with the parallel form of Welford's algorithm, so the
+    result matches a whole-table fit without holding the table in memory. Missing
+    values are ignored for the mean; the standard deviation is that of the mean-filled
+    column, matching preprocess_clinical_data.
+    
+    Args:
+        source (str or pd.DataFrame): Path to a .csv or .parquet file, or a DataFrame.
+        chunksize (int): Number of rows per chunk.
+        columns (list): Columns to fit. Defaults to the columns whose non-missing values
+            are numeric in every chunk; a chunk where a column is all missing does not
+            decide its type.
+    
+    Returns:
+        dict: 'columns', 'rows', 'count' (non-missing), 'mean' and 'std' (population, as StandardScaler), JSON serializable.
+    """
+    count = mean = m2 = None
+    rows = 0
+    select = columns is None
+    for chunk in iter_table_chunks(source, chunksize):
+        if columns is None:
+            columns = list(chunk.columns)
+            numeric = np.zeros(len(columns), dtype=bool)
+            text = np.zeros(len(columns), dtype=bool)
+        values = np.full((len(chunk), len(columns)), np.nan)
+        for i, column in enumerate(columns):
+            if select:
+                if text[i] or not chunk[column].notna().any():
+                    continue
+                if pd.api.types.is_numeric_dtype(chunk[column]) and not pd.api.types.is_bool_dtype(chunk[column]):
+                    numeric[i] = True
+                else:
+                    text[i] = True
+                    continue
+            values[:, i] = pd.to_numeric(chunk[column], errors='coerce').to_numpy(dtype=np.float64)
+        valid = ~np.isnan(values)
+        chunk_count = valid.sum(axis=0)
+        chunk_mean = np.where(valid, values, 0).sum(axis=0) / np.maximum(chunk_count, 1)
+        chunk_m2 = np.where(valid, values - chunk_mean, 0) ** 2
+        chunk_m2 = chunk_m2.sum(axis=0)
+        rows += len(values)
+        if count is None:
+            count, mean, m2 = chunk_count, chunk_mean, chunk_m2
+            continue
+        total = count + chunk_count
+        delta = chunk_mean - mean
+        safe_total = np.maximum(total, 1)
+        mean = mean + delta * chunk_count / safe_total
+        m2 = m2 + chunk_m2 + delta ** 2 * count * chunk_count / safe_total
+        count = total
+    if count is None:
+        raise ValueError("No rows to fit.")
+    if select:
+        keep = numeric & ~text
+        columns = [column for column, kept in zip(columns, keep) if kept]
+        count, mean, m2 = count[keep], mean[keep], m2[keep]
+    # Filled values sit on the mean, so they add rows but nothing to M2
+    std = np.sqrt(m2 / max(rows, 1))
+    return {
+        'columns': list(columns),
+        'rows': rows,
+        'count': count.tolist(),
+        'mean': mean.tolist(),
+        'std': std.tolist()
+    }
+
+def transform_clinical_chunks(source, statistics, chunksize=100000):
+    """
+    Fill missing values with the fitted means and standardize, chunk by chunk.
+    
+    Args:
+        source (str or pd.DataFrame): Path to a .csv or .parquet file, or a DataFrame.
+        statistics (dict): Output of fit_clinical_statistics.
+        chunksize (int): Number of rows per chunk.
+    
+    Yields:
+        pd.DataFrame: Transformed chunks; fitted columns are float32, other columns are unchanged.
+    """
+    columns = statistics['columns']
+    mean = np.asarray(statistics['mean'], dtype=np.float32)
+    std = np.asarray(statistics['std'], dtype=np.float32)
+    std[std == 0] = 1
+    for chunk in iter_table_chunks(source, chunksize):
+        values = chunk[columns].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float32)
+        values = np.where(np.isnan(values), mean, values)
+        values -= mean
+        values /= std
+        chunk = chunk.copy()
+        chunk[columns] = pd.DataFrame(values, columns=columns, index=chunk.index)
+        yield chunk
+
+def _clinical_output_schema(source, statistics, first_chunk):
+    """
+    Arrow schema of the transformed table, fixed for all chunks.
+    
+    Fitted columns are float32. Other columns keep the type declared by the source
+    (DataFrame dtypes or Parquet schema); CSV has no declared types, so they take the
+    type of the first chunk, with text and all-missing columns read as strings.
+    """
+    if isinstance(source, pd.DataFrame):
+        declared = pa.Schema.from_pandas(source, preserve_index=False)
+    elif os.path.splitext(source)[1].lower() == '.parquet':
+        declared = pq.ParquetFile(source).schema_arrow
+    else:
+        declared = None
+    first_table = pa.Table.from_pandas(first_chunk, preserve_index=False)
+    fitted = set(statistics['columns'])
+    fields = []
+    for field in first_table.schema:
+        if field.name in fitted:
+            field_type = pa.float32()
+        elif declared is not None and declared.get_field_index(field.name) >= 0:
+            field_type = declared.field(field.name).type
+        elif pa.types.is_null(field.type) or first_chunk[field.name].isna().all() or \
+                first_chunk[field.name].dtype == object:
+            field_type = pa.string()
+        else:
+            field_type = field.type
+        fields.append(pa.field(field.name, field_type))
+    return pa.schema(fields)
+
+def preprocess_clinical_data_streaming(source, output_path, statistics_path, chunksize=100000, refit=False):
+    """
+    Streaming version of preprocess_clinical_data for tables too large for memory.
+    
+    The statistics are fitted once and saved to statistics_path; later calls (e.g. on a
+    test set) reuse them instead of refitting. Parquet output has one schema for all
+    chunks (see _clinical_output_schema), so a column that is missing in a whole chunk
+    keeps its type.
+    
+    Args:
+        source (str or pd.DataFrame): Path to a .csv or .parquet file, or a DataFrame.
+        output_path (str): Path of the transformed table (.parquet or .csv).
+        statistics_path (str): JSON file holding the fitted statistics.
+        chunksize (int): Number of rows per chunk.
+        refit (bool): Fit and overwrite the statistics even if statistics_path exists.
+    
+    Returns:
+        dict: The statistics used.
+    """
+    if os.path.exists(statistics_path) and not refit:
+        statistics = load_json(statistics_path)
+    else:
+        statistics = fit_clinical_statistics(source, chunksize)
+        save_json(statistics, statistics_path)
+    
+    extension = os.path.splitext(output_path)[1].lower()
+    if extension not in ('.parquet', '.csv'):
+        raise ValueError(f"Unsupported table extension: {extension}")
+    writer = None
+    try:
+        for index, chunk in enumerate(transform_clinical_chunks(source, statistics, chunksize)):
+            if extension == '.parquet':
+                if writer is None:
+                    schema = _clinical_output_schema(source, statistics, chunk)
+                    writer = pq.ParquetWriter(output_path, schema)
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                writer.write_table(table.select(schema.names).cast(schema))
+            else:
+                chunk.to_csv(output_path, mode='w' if index == 0 else 'a', header=index == 0, index=False)
+    finally:
+        if writer is not None:
+            writer.close()
+    return statistics
+
 def preprocess_image_data(image_data, target_size=(256, 256), normalization_method='z-score'):
     """
     Preprocess image Data.
     
     Args:
-        image_data (np.array): Image Data to be preprocessed.
+        image_data (iterable): Images to be preprocessed, e.g. an array or a generator.
         target_size (tuple): Target size for resizing images.
         normalization_method (str): Method for normalizing images.
     
@@ -66,11 +328,93 @@ def preprocess_image_data(image_data, target_size=(256, 256), normalization_meth
         np.array: Preprocessed image Data.
     """
     preprocessed_images = []
-    for image in image_data:
-        resized_image = resize_image(image, target_size)
-        normalized_image = normalize_image(resized_image, normalization_method)
-        preprocessed_images.append(normalized_image)
-    return np.array(preprocessed_images)
+    with metrics.timed('preprocess_image_data', method=normalization_method) as timer:
+        for image in image_data:
+            # Per-image timers only feed the aggregates, see metrics.summary()
+            with metrics.timed('resize_image', emit_event=False):
+                resized_image = resize_image(image, target_size)
+            with metrics.timed('normalize_image', emit_event=False):
+                normalized_image = normalize_image(resized_image, normalization_method)
+            preprocessed_images.append(normalized_image)
+        preprocessed_images = np.array(preprocessed_images)
+        # image_data may be a generator, so it is only counted once consumed
+        timer.add_fields(n_images=len(preprocessed_images))
+    metrics.count_array(preprocessed_images)
+    return preprocessed_images
+
+def normalize_batch(images, method='z-score'):
+    """
+    Normalize each image of a float32 batch in place.
+    
+    Statistics are computed per image with NumPy reductions over the image axes.
+    Constant images are mapped to 0 instead of producing NaNs.
+    
+    Args:
+        images (np.array): Float batch of shape (N, H, W), modified in place.
+        method (str): Normalization method ('z-score', 'min-max').
+    
+    Returns:
+        np.array: The normalized batch.
+    """
+    axes = tuple(range(1, images.ndim))
+    if method == 'z-score':
+        images -= images.mean(axis=axes, keepdims=True)
+        std = np.sqrt(np.square(images).mean(axis=axes, keepdims=True))
+        std[std == 0] = 1
+        images /= std
+    elif method == 'min-max':
+        minimum = images.min(axis=axes, keepdims=True)
+        value_range = images.max(axis=axes, keepdims=True) - minimum
+        value_range[value_range == 0] = 1
+        images -= minimum
+        images /= value_range
+    else:
+        raise ValueError("Unsupported normalization method.")
+    return images
+
+@metrics.instrument('preprocess_image_batch')
+def preprocess_image_batch(image_data, target_size=(256, 256), normalization_method='z-score',
+                           max_workers=None, chunk_size=64):
+    """
+    Batched version of preprocess_image_data.
+    
+    The float32 output is allocated once and filled chunk by chunk; resizing and
+    normalization of different chunks can run in a thread pool since cv2 and the
+    NumPy reductions release the GIL.
+    
+    Args:
+        image_data (np.array): Images of shape (N, H, W), a 3D volume, or a list of 2D images.
+        target_size (tuple): Target size passed to cv2.resize, i.e. (width, height).
+        normalization_method (str): Method for normalizing images ('z-score', 'min-max').
+        max_workers (int): Number of threads. None or 1 runs in the calling thread.
+        chunk_size (int): Number of images handled per task.
+    
+    Returns:
+        np.array: Preprocessed images of shape (N, height, width), float32.
+    """
+    if normalization_method not in ('z-score', 'min-max'):
+        raise ValueError("Unsupported normalization method.")
+    num_images = len(image_data)
+    output = np.empty((num_images, target_size[1], target_size[0]), dtype=np.float32)
+    
+    def process_chunk(start):
+        stop = min(start + chunk_size, num_images)
+        for index in range(start, stop):
+            image = np.asarray(image_data[index], dtype=np.float32)
+            if image.shape == output.shape[1:]:
+                output[index] = image
+            else:
+                output[index] = cv2.resize(image, target_size)
+        normalize_batch(output[start:stop], normalization_method)
+    
+    starts = range(0, num_images, chunk_size)
+    if max_workers is None or max_workers <= 1:
+        for start in starts:
+            process_chunk(start)
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(process_chunk, starts))
+    return output
 
 # Example usage
 if __name__ == "__main__":
@@ -0,0 +1,106 @@
+import re
+from collections import Counter
+
+# Bump whenever normalize_roi_name changes, so results stored with the old names are rebuilt
+NORMALIZATION_VERSION = 1
+
+def normalize_roi_name(name):
+    """
+    Normalize an ROI name for matching: lower case with runs of whitespace collapsed.
+    
+    Args:
+        name (str): ROI name as stored in the planning system.
+    
+    Returns:
+        str: Normalized ROI name.
+    """
+    return ' '.join(name.lower().split())
+
+def _compile_terms(terms):
+    if not terms:
+        return None
+    # Longest terms first so the alternation prefers the most specific match
+    terms = sorted({normalize_roi_name(term) for term in terms}, key=len, reverse=True)
+    return re.compile('|'.join(re.escape(term) for term in terms))
+
+def count_roi_names(names):
+    """
+    Count ROI names after normalization.
+    
+    Args:
+        names (iterable): ROI names.
+    
+    Returns:
+        Counter: {normalized name: number of occurrences}.
+    """
+    return Counter(normalize_roi_name(name) for name in names)
+
+class ROINameClassifier:
+    """
+    Match ROI names against include/exclude vocabularies.
+    
+    Substring vocabularies are compiled into a single regular expression, so each
+    name is scanned once instead of once per term, and results are cached per
+    distinct name.
+    
+    Args:
+        names (iterable): Exact names to accept. None accepts any name.
+        include_terms (iterable): Accept only names containing one of these terms.
+        exclude_terms (iterable): Reject names containing any of these terms.
+        min_length (int): Reject names shorter than this.
+    """
+    def __init__(self, names=None, include_terms=None, exclude_terms=None, min_length=0):
+        self.names = {normalize_roi_name(name) for name in names} if names is not None else None
+        self.include_pattern = _compile_terms(include_terms)
+        self.exclude_pattern = _compile_terms(exclude_terms)
+        self.min_length = min_length
+        self._cache = {}
+    
+    def matches(self, name):
+        """
+        Check whether a single ROI name is accepted.
+        
+        Args:
+            name (str): ROI name, in any case.
+        
+        Returns:
+            bool: True if the name passes every criterion.
+        """
+        result = self._cache.get(name)
+        if result is None:
+            normalized = normalize_roi_name(name)
+            result = (len(normalized) >= self.min_length and
+                      (self.names is None or normalized in self.names) and
+                      (self.include_pattern is None or self.include_pattern.search(normalized) is not None) and
+                      (self.exclude_pattern is None or self.exclude_pattern.search(normalized) is None))
+            self._cache[name] = result
+        return result
+    
+    def select(self, name_counts):
+        """
+        Keep the accepted entries of a name count mapping.
+        
+        Args:
+            name_counts (dict): {name: count}, e.g. from count_roi_names.
+        
+        Returns:
+            Counter: Accepted names with their counts.
+        """
+        return Counter({name: count for name, count in name_counts.items() if self.matches(name)})
+    
+    def count(self, names):
+        """
+        Count the accepted names.
+        
+        Args:
+            names (iterable): ROI names.
+        
+        Returns:
+            Counter: {normalized name: number of occurrences} for accepted names.
+        """
+        return self.select(count_roi_names(names))
+
+# Example usage
+if __name__ == "__main__":
+    classifier = ROINameClassifier(include_terms=['nodes', 'prost'], exclude_terms=['ptv', 'opt'])
+    print(classifier.count(['Prostate', 'prostate ', 'PTV_Prostate', 'Pelvic Nodes', 'Bladder']))
@@ -0,0 +1,251 @@
+import os
+import time
+import queue
+import shutil
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+class StagedFolder:
+    """
+    A source folder and its local copy.
+    
+    Attributes:
+        source (str): Folder on the share.
+        path (str): Local copy, or None if staging failed.
+        size (int): Bytes copied.
+        seconds (float): Time spent staging.
+        error (Exception): Staging error, if any.
+    """
+    def __init__(self, source, path=None, size=0, seconds=0.0, error=None):
+        self.source = source
+        self.path = path
+        self.size = size
+        self.seconds = seconds
+        self.error = error
+    
+    def __repr__(self):
+        return f"StagedFolder({self.source!r}, path={self.path!r}, size={self.size}, error={self.error!r})"
+
+class FolderStager:
+    """
+    Copies upcoming folders from a slow share to local scratch ahead of the code using them.
+    
+    An asyncio loop in a background thread stages folders in the order given, copying up
+    to max_concurrency files at a time, while the caller works on folders already staged.
+    At most read_ahead folders and max_bytes are held locally; a folder leaves scratch when
+    the caller releases it, which lets the next one be staged. A folder larger than
+    max_bytes is still staged, alone.
+    
+    Use it as a context manager so scratch is cleaned up:
+    
+        with FolderStager(scratch_dir) as stager:
+            for staged in stager.stage(folders):
+                process(staged.path)
+                stager.release(staged)
+    
+    Args:
+        scratch_dir (str): Local directory for the copies.
+        read_ahead (int): Maximum number of staged folders not yet released.
+        max_concurrency (int): Maximum number of files copied at the same time.
+        max_bytes (int): Disk budget for staged folders.
+        latency (float): Seconds of delay injected before every file copy, to test
+            against a local directory as if it were the share.
+    """
+    def __init__(self, scratch_dir, read_ahead=4, max_concurrency=8, max_bytes=20 * 1024 ** 3, latency=0.0):
+        self.scratch_dir = scratch_dir
+        self.read_ahead = read_ahead
+        self.max_concurrency = max_concurrency
+        self.max_bytes = max_bytes
+        self.latency = latency
+        self.staged_bytes = 0
+        self.peak_bytes = 0
+        self._loop = None
+        self._thread = None
+        self._executor = None
+        self._stop = None
+        self._run_future = None
+        self._released = set()
+        self._paths = set()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+    
+    async def _copy_file(self, source_path, destination_path, semaphore):
+        async with semaphore:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            await self._loop.run_in_executor(self._executor, shutil.copy2, source_path, destination_path)
+    
+    async def _stage_folder(self, index, source, names, semaphore):
+        start = time.perf_counter()
+        files = await self._loop.run_in_executor(self._executor, _list_files, source, names)
+        size = sum(file_size for _, file_size in files)
+        async with self._budget:
+            await self._budget.wait_for(lambda: self._stop.is_set() or self.staged_bytes == 0 or
+                                        self.staged_bytes + size <= self.max_bytes)
+            if self._stop.is_set():
+                raise RuntimeError("Staging was stopped")
+            self.staged_bytes += size
+            self.peak_bytes = max(self.peak_bytes, self.staged_bytes)
+        # The index keeps copies of folders with the same name apart
+        destination = os.path.join(self.scratch_dir, f"{index:05d}_{os.path.basename(os.path.normpath(source))}")
+        temp_destination = destination + '.partial'
+        self._paths.update((destination, temp_destination))
+        try:
+            for rel_path, _ in files:
+                os.makedirs(os.path.dirname(os.path.join(temp_destination, rel_path)), exist_ok=True)
+            await asyncio.gather(*[self._copy_file(os.path.join(source, rel_path),
+                                                   os.path.join(temp_destination, rel_path), semaphore)
+                                   for rel_path, _ in files])
+            os.replace(temp_destination, destination)
+        except Exception:
+            shutil.rmtree(temp_destination, ignore_errors=True)
+            await self._free(size)
+            raise
+        return destination, size, time.perf_counter() - start
+    
+    async def _free(self, size):
+        async with self._budget:
+            self.staged_bytes -= size
+            self._budget.notify_all()
+    
+    async def _run(self, folders, output_queue):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._budget = asyncio.Condition()
+        self._slots = asyncio.Semaphore(self.read_ahead)
+        tasks = asyncio.Queue()
+        
+        async def start_tasks():
+            for index, folder in enumerate(folders):
+                source, names = folder if isinstance(folder, tuple) else (folder, None)
+                await self._slots.acquire()
+                if self._stop.is_set():
+                    break
+                await tasks.put((source, asyncio.ensure_future(self._stage_folder(index, source, names,
+                                                                                  semaphore))))
+            await tasks.put(None)
+        
+        starter = asyncio.ensure_future(start_tasks())
+        # Deliver in the order given, whichever folder finishes copying first
+        while True:
+            item = await tasks.get()
+            if item is None:
+                break
+            source, task = item
+            try:
+                path, size, seconds = await task
+                output_queue.put(StagedFolder(source, path, size, seconds))
+            except Exception as e:
+                self._slots.release()
+                output_queue.put(StagedFolder(source, error=e))
+        await starter
+        output_queue.put(None)
+    
+    def stage(self, folders, timeout=None):
+        """
+        Start staging folders and yield them as they become available locally.
+        
+        Staging stops once read_ahead folders or max_bytes are held, until the caller
+        releases some. A caller that releases folders only when other work finishes
+        should pass a timeout and release what it can whenever None is yielded.
+        
+        Args:
+            folders (iterable): Folders to stage, in processing order. An item may also be
+                a (folder, file names) tuple to stage only those files (paths relative to
+                the folder).
+            timeout (float): Seconds to wait for the next folder before yielding None.
+                None waits as long as it takes.
+        
+        Yields:
+            StagedFolder: Staged folders in the order given, or None when timeout expired.
+                Folders that failed to stage have path None and the error set; they need
+                no release.
+        """
+        os.makedirs(self.scratch_dir, exist_ok=True)
+        output_queue = queue.Queue()
+        self._stop = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        self._loop = asyncio.new_event_loop()
+        # The loop keeps running after the last folder is staged, so releases are still served
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self._run_future = asyncio.run_coroutine_threadsafe(self._run(folders, output_queue), self._loop)
+        waited = 0.0
+        while True:
+            try:
+                staged = output_queue.get(timeout=0.5 if timeout is None else min(timeout, 0.5))
+            except queue.Empty:
+                if self._run_future.done():
+                    # Raises whatever stopped the staging loop
+                    self._run_future.result()
+                waited += 0.5 if timeout is None else min(timeout, 0.5)
+                if timeout is not None and waited >= timeout:
+                    waited = 0.0
+                    yield None
+                continue
+            if staged is None:
+                break
+            waited = 0.0
+            yield staged
+    
+    def release(self, staged):
+        """
+        Delete a staged folder from scratch and let the next folder be staged.
+        
+        Args:
+            staged (StagedFolder): Folder yielded by stage().
+        """
+        if staged.path is None or staged.path in self._released:
+            return
+        self._released.add(staged.path)
+        shutil.rmtree(staged.path, ignore_errors=True)
+        asyncio.run_coroutine_threadsafe(self._free(staged.size), self._loop).result()
+        self._loop.call_soon_threadsafe(self._slots.release)
+    
+    def close(self):
+        """
+        Stop staging and remove everything left in scratch by this stager.
+        """
+        if self._thread is not None:
+            self._stop.set()
+            # Wake up the starter waiting for a slot and any folder waiting for disk budget
+            for _ in range(self.read_ahead + 1):
+                self._loop.call_soon_threadsafe(self._slots.release)
+            asyncio.run_coroutine_threadsafe(self._free(0), self._loop).result()
+            try:
+                self._run_future.result()
+            finally:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._thread.join()
+            self._loop.close()
+            self._executor.shutdown()
+            self._thread = None
+        for path in self._paths:
+            shutil.rmtree(path, ignore_errors=True)
+        self._paths = set()
+
+def _list_files(folder, names=None):
+    if not os.path.isdir(folder):
+        raise FileNotFoundError(f"No such folder: {folder}")
+    if names is not None:
+        return [(name, os.path.getsize(os.path.join(folder, name))) for name in names]
+    files = []
+    for root, _, file_names in os.walk(folder):
+        for name in file_names:
+            file_path = os.path.join(root, name)
+            files.append((os.path.relpath(file_path, folder), os.path.getsize(file_path)))
+    return files
+
+# Example usage
+if __name__ == "__main__":
+    share = r'\\vscifs1\PhysicsQAdata\BMA\Prostate_Nodes'
+    patient_folders = [os.path.join(share, i) for i in sorted(os.listdir(share))]
+    with FolderStager(os.path.join('.', 'scratch'), read_ahead=4) as stager:
+        for staged in stager.stage(patient_folders):
+            print(staged, len(os.listdir(staged.path)) if staged.path else None)
+            stager.release(staged)
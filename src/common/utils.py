@@ -1,8 +1,17 @@
 import os
+import re
 import logging
 import json
+import shutil
+import hashlib
+import threading
+import contextlib
 import pandas as pd
 
+# Marker of the temporary files and directories of atomic_write and atomic_directory,
+# e.g. data.json.tmp1234-5678
+TEMP_FILE_PATTERN = re.compile(r'\.tmp\d+-\d+(\.|$)')
+
 def setup_logging(log_file='app.log'):
     """
     Setup logging configuration.
@@ -12,18 +21,27 @@ def setup_logging(log_file='app.log'):
     """
     logging.basicConfig(filename=log_file, level=logging.INFO,
                         format='%(asctime)s %(levelname)s:%(message)s')
+    # Metrics events do not propagate to the root logger (see src/common/metrics.py), so
+    # the log file is attached to them explicitly
+    metrics_logger = logging.getLogger('rtds.metrics')
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, logging.FileHandler) and handler not in metrics_logger.handlers:
+            metrics_logger.addHandler(handler)
     logging.info("Logging setup complete.")
 
-def save_json(data, file_path):
+def save_json(data, file_path, atomic=False):
     """
     Save Data to a JSON file.
     
     Args:
         data (dict): Data to be saved.
         file_path (str): Path to the JSON file.
+        atomic (bool): Write to a temporary file and rename it over file_path, so
+            readers never see a partially written file.
     """
-    with open(file_path, 'w') as json_file:
-        json.dump(data, json_file, indent=4)
+    with atomic_write(file_path) if atomic else contextlib.nullcontext(file_path) as write_path:
+        with open(write_path, 'w') as json_file:
+            json.dump(data, json_file, indent=4)
     logging.info(f"Data saved to {file_path}")
 
 def load_json(file_path):
@@ -52,6 +70,116 @@ def save_to_csv(data, file_path):
     data.to_csv(file_path, index=False)
     logging.info(f"Data saved to {file_path}")
 
+def file_fingerprint(file_path):
+    """
+    Cheap fingerprint of a file based on its path, size and modification time.
+    
+    Args:
+        file_path (str): Path to the file.
+    
+    Returns:
+        tuple: (absolute path, size in bytes, mtime in nanoseconds).
+    """
+    stat = os.stat(file_path)
+    return os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns
+
+def files_fingerprint(file_paths, root=None):
+    """
+    Cheap fingerprint of a set of files, combining the file_fingerprint of each.
+    
+    Args:
+        file_paths (list): Paths of the files.
+        root (str): Identify the files by their path relative to root instead of their
+            absolute path, so the fingerprint does not change when the folder is moved.
+    
+    Returns:
+        str: Hex digest.
+    """
+    digest = hashlib.sha1()
+    for file_path in sorted(file_paths):
+        path, size, mtime_ns = file_fingerprint(file_path)
+        if root is not None:
+            path = os.path.relpath(path, os.path.abspath(root))
+        digest.update(f"{path}|{size}|{mtime_ns}".encode())
+    return digest.hexdigest()
+
+@contextlib.contextmanager
+def atomic_write(file_path, keep_extension=False):
+    """
+    Context manager giving a temporary path to write instead of file_path. The file is
+    renamed over file_path when the block completes, so readers never see a partially
+    written file, and removed if the block raises.
+    
+    Args:
+        file_path (str): Final path of the file.
+        keep_extension (bool): Put the temporary marker before the extension instead of
+            after it, for writers that choose the format from the extension.
+    
+    Yields:
+        str: Temporary path next to file_path (see is_temp_file).
+    """
+    marker = f".tmp{os.getpid()}-{threading.get_ident()}"
+    if keep_extension:
+        folder, file_name = os.path.split(file_path)
+        stem = file_name.split('.')[0]
+        temp_path = os.path.join(folder, stem + marker + file_name[len(stem):])
+    else:
+        temp_path = file_path + marker
+    try:
+        yield temp_path
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+@contextlib.contextmanager
+def atomic_directory(path):
+    """
+    Context manager giving a temporary directory to fill instead of path. When the block
+    completes, an existing directory at path is renamed aside, the new one renamed into
+    place and only then the old one deleted, so path always holds a complete directory.
+    The temporary directory is deleted if the block raises.
+    
+    Args:
+        path (str): Final path of the directory.
+    
+    Yields:
+        str: Empty temporary directory next to path (see is_temp_file).
+    """
+    path = os.path.normpath(path)
+    temp_path = f"{path}.tmp{os.getpid()}-{threading.get_ident()}"
+    old_path = temp_path + '.old'
+    if os.path.exists(temp_path):
+        shutil.rmtree(temp_path)
+    os.makedirs(temp_path)
+    try:
+        yield temp_path
+        if os.path.exists(path):
+            os.replace(path, old_path)
+            try:
+                os.replace(temp_path, path)
+            except OSError:
+                os.replace(old_path, path)
+                raise
+            shutil.rmtree(old_path, ignore_errors=True)
+        else:
+            os.replace(temp_path, path)
+    except BaseException:
+        shutil.rmtree(temp_path, ignore_errors=True)
+        raise
+
+def is_temp_file(file_path):
+    """
+    Args:
+        file_path (str): Path or name of a file.
+    
+    Returns:
+        bool: Whether the file is a temporary file of atomic_write or atomic_directory,
+            e.g. one left behind by an interrupted process.
+    """
+    return TEMP_FILE_PATTERN.search(os.path.basename(file_path)) is not None
+
 def load_from_csv(file_path):
     """
     Load Data from a CSV file.
@@ -66,6 +194,57 @@ def load_from_csv(file_path):
     logging.info(f"Data loaded from {file_path}")
     return data
 
+def save_table(data, file_path, sheet_name='Sheet1'):
+    """
+    Save a table, choosing the format from the file extension.
+    
+    Parquet and Feather are columnar and much faster to write and read back than
+    Excel, which should only be used as an export view for people.
+    
+    Args:
+        data (pd.DataFrame): Data to be saved.
+        file_path (str): Path ending in .parquet, .feather, .csv or .xlsx.
+        sheet_name (str): Sheet name used for Excel files.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == '.parquet':
+        data.to_parquet(file_path, index=False)
+    elif extension == '.feather':
+        data.reset_index(drop=True).to_feather(file_path)
+    elif extension == '.csv':
+        data.to_csv(file_path, index=False)
+    elif extension in ['.xlsx', '.xls']:
+        data.to_excel(file_path, sheet_name=sheet_name, index=False)
+    else:
+        raise ValueError(f"Unsupported table extension: {extension}")
+    logging.info(f"Data saved to {file_path}")
+
+def load_table(file_path, columns=None, sheet_name=0):
+    """
+    Load a table, choosing the format from the file extension.
+    
+    Args:
+        file_path (str): Path ending in .parquet, .feather, .csv or .xlsx.
+        columns (list): Only read these columns.
+        sheet_name (str or int): Sheet to read from Excel files.
+    
+    Returns:
+        pd.DataFrame: Loaded Data.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == '.parquet':
+        data = pd.read_parquet(file_path, columns=columns)
+    elif extension == '.feather':
+        data = pd.read_feather(file_path, columns=columns)
+    elif extension == '.csv':
+        data = pd.read_csv(file_path, usecols=columns)
+    elif extension in ['.xlsx', '.xls']:
+        data = pd.read_excel(file_path, sheet_name=sheet_name, usecols=columns)
+    else:
+        raise ValueError(f"Unsupported table extension: {extension}")
+    logging.info(f"Data loaded from {file_path}")
+    return data
+
 # Example usage
 if __name__ == "__main__":
     setup_logging()
@@ -0,0 +1,267 @@
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from src.common.utils import save_json, load_json, atomic_directory
+
+# Optional codecs, faster than zlib at a similar ratio
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+RTVOL_EXTENSION = '.rtvol'
+META_FILE = 'meta.json'
+INDEX_FILE = 'index.json'
+
+def available_codecs():
+    """
+    Codecs usable in this environment, fastest first.
+    
+    Returns:
+        list: Codec names among 'zstd', 'lz4' and 'zlib'.
+    """
+    codecs = []
+    if zstandard is not None:
+        codecs.append('zstd')
+    if lz4_frame is not None:
+        codecs.append('lz4')
+    codecs.append('zlib')
+    return codecs
+
+def _compress(data, codec, level):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=level if level is not None else 3).compress(data)
+    if codec == 'lz4':
+        return lz4_frame.compress(data, compression_level=level if level is not None else 0)
+    if codec == 'zlib':
+        return zlib.compress(data, level if level is not None else 1)
+    if codec == 'raw':
+        return data
+    raise ValueError(f"Unknown codec: {codec}")
+
+def _decompress(data, codec):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ImportError("This volume is zstd-compressed; install zstandard to read it.")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == 'lz4':
+        if lz4_frame is None:
+            raise ImportError("This volume is lz4-compressed; install lz4 to read it.")
+        return lz4_frame.decompress(data)
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    if codec == 'raw':
+        return data
+    raise ValueError(f"Unknown codec: {codec}")
+
+def _chunk_path(path, index):
+    return os.path.join(path, f'chunk_{index:05d}.bin')
+
+def write_volume(path, array, metadata=None, chunk_slices=8, codec=None, level=None, max_workers=4):
+    """
+    Write a volume as a .rtvol directory: meta.json plus one compressed chunk per slab of
+    chunk_slices slices along the first axis.
+    
+    Chunks are compressed in a thread pool (the codecs release the GIL). The directory is
+    written under a temporary name and swapped into place with utils.atomic_directory, so
+    readers never see a partial volume.
+    
+    Args:
+        path (str): Output directory, normally ending in .rtvol.
+        array (np.array): Volume, e.g. (z, y, x) as returned by load_dicom_series.
+        metadata (dict): JSON serializable metadata (spacing, origin, ...) kept in meta.json.
+        chunk_slices (int): Slices per chunk.
+        codec (str): 'zstd', 'lz4', 'zlib' or 'raw'. Defaults to the fastest available.
+        level (int): Codec compression level. Defaults to a fast level of the codec.
+        max_workers (int): Threads compressing chunks.
+    
+    Returns:
+        dict: The meta.json content.
+    """
+    array = np.ascontiguousarray(array)
+    if codec is None:
+        codec = available_codecs()[0]
+    starts = list(range(0, array.shape[0], chunk_slices))
+    meta = {
+        'shape': list(array.shape),
+        'dtype': array.dtype.str,
+        'chunk_slices': chunk_slices,
+        'n_chunks': len(starts),
+        'codec': codec,
+        'metadata': metadata or {}
+    }
+    
+    def write_chunk(directory, index):
+        start = starts[index]
+        with open(_chunk_path(directory, index), 'wb') as chunk_file:
+            chunk_file.write(_compress(array[start:start + chunk_slices].tobytes(), codec, level))
+    
+    with atomic_directory(path) as temp_path:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(write_chunk, [temp_path] * len(starts), range(len(starts))))
+        save_json(meta, os.path.join(temp_path, META_FILE))
+    return meta
+
+class RTVolume:
+    """
+    Read access to a .rtvol directory.
+    
+    Indexing reads and decompresses only the chunks covering the requested slices of the
+    first axis, e.g. volume[100:110] or volume[120, 64:192, 64:192].
+    
+    Args:
+        path (str): Path to the .rtvol directory.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.meta = load_json(os.path.join(path, META_FILE))
+        self.shape = tuple(self.meta['shape'])
+        self.dtype = np.dtype(self.meta['dtype'])
+        self.chunk_slices = self.meta['chunk_slices']
+        self.metadata = self.meta['metadata']
+    
+    def __len__(self):
+        return self.shape[0]
+    
+    def read_chunk(self, index):
+        """
+        Decode one chunk.
+        
+        Args:
+            index (int): Chunk number.
+        
+        Returns:
+            np.array: The slabs of the chunk.
+        """
+        with open(_chunk_path(self.path, index), 'rb') as chunk_file:
+            data = _decompress(chunk_file.read(), self.meta['codec'])
+        start = index * self.chunk_slices
+        n_slices = min(self.chunk_slices, self.shape[0] - start)
+        return np.frombuffer(data, dtype=self.dtype).reshape((n_slices,) + self.shape[1:])
+    
+    def read_slices(self, start, stop):
+        """
+        Read slices [start, stop) of the first axis.
+        
+        Returns:
+            np.array: Array of shape (stop - start,) + shape[1:].
+        """
+        start, stop = max(start, 0), min(stop, self.shape[0])
+        out = np.empty((max(stop - start, 0),) + self.shape[1:], dtype=self.dtype)
+        if stop <= start:
+            return out
+        for index in range(start // self.chunk_slices, (stop - 1) // self.chunk_slices + 1):
+            chunk_start = index * self.chunk_slices
+            chunk = self.read_chunk(index)
+            low = max(start, chunk_start)
+            high = min(stop, chunk_start + len(chunk))
+            out[low - start:high - start] = chunk[low - chunk_start:high - chunk_start]
+        return out
+    
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        first, rest = key[0], key[1:]
+        if isinstance(first, (int, np.integer)):
+            index = first + self.shape[0] if first < 0 else first
+            if not 0 <= index < self.shape[0]:
+                raise IndexError(f"Index {first} out of range for axis 0 of size {self.shape[0]}")
+            return self.read_slices(index, index + 1)[(0,) + rest]
+        if isinstance(first, slice):
+            start, stop, step = first.indices(self.shape[0])
+            if step < 0:
+                # Read the covered range in order and let numpy reverse it
+                data = self.read_slices(stop + 1, start + 1)
+                return data[(slice(None, None, step),) + rest]
+            return self.read_slices(start, stop)[(slice(None, None, step),) + rest]
+        raise TypeError(f"Unsupported index for axis 0: {first!r}")
+    
+    def read(self, window=None):
+        """
+        Read the whole volume, or a window given as a tuple of slices.
+        
+        Returns:
+            np.array: Volume Data.
+        """
+        if window is None:
+            return self.read_slices(0, self.shape[0])
+        return self[window]
+
+def load_rtvol(path, window=None):
+    """
+    Load a .rtvol volume.
+    
+    Args:
+        path (str): Path to the .rtvol directory.
+        window (tuple): Optional slices selecting a region, e.g. np.s_[100:110]. Only the
+            chunks it touches are read.
+    
+    Returns:
+        tuple: (np.array: volume Data, dict: metadata stored with the volume).
+    """
+    volume = RTVolume(path)
+    return volume.read(window), volume.metadata
+
+def volume_path(root, patient_id, modality):
+    """
+    Location of a patient volume in a store: <root>/<patient_id>/<modality>.rtvol.
+    """
+    return os.path.join(root, str(patient_id), f'{modality}{RTVOL_EXTENSION}')
+
+def write_patient_volume(root, patient_id, modality, array, metadata=None, **kwargs):
+    """
+    Write a patient volume into a store and record it in the patient's index.json.
+    
+    Every patient has its own index, so writers working on different patients never
+    touch the same file.
+    
+    Args:
+        root (str): Store directory, e.g. data/processed.
+        patient_id (str): Patient identifier.
+        modality (str): Modality key, e.g. 'ct' or 'mri'.
+        array (np.array): Volume.
+        metadata (dict): JSON serializable metadata.
+        **kwargs: Passed to write_volume (chunk_slices, codec, level, max_workers).
+    
+    Returns:
+        str: Path of the written volume.
+    """
+    path = volume_path(root, patient_id, modality)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    meta = write_volume(path, array, metadata, **kwargs)
+    index_path = os.path.join(root, str(patient_id), INDEX_FILE)
+    index = load_json(index_path) if os.path.exists(index_path) else {}
+    index[modality] = {'path': os.path.basename(path), 'shape': meta['shape'], 'dtype': meta['dtype']}
+    save_json(index, index_path, atomic=True)
+    return path
+
+def read_store_index(root):
+    """
+    Collect the per-patient indexes of a store.
+    
+    Args:
+        root (str): Store directory.
+    
+    Returns:
+        dict: {patient_id: {modality: absolute path of the .rtvol directory}}.
+    """
+    index = {}
+    for patient_id in sorted(os.listdir(root)):
+        index_path = os.path.join(root, patient_id, INDEX_FILE)
+        if os.path.exists(index_path):
+            index[patient_id] = {modality: os.path.join(root, patient_id, entry['path'])
+                                 for modality, entry in load_json(index_path).items()}
+    return index
+
+# Example usage
+if __name__ == "__main__":
+    volume = np.random.default_rng(0).integers(-1000, 2000, size=(120, 512, 512), dtype=np.int16)
+    path = write_patient_volume('processed_example', 'patient_001', 'ct', volume,
+                                {'spacing': [0.98, 0.98, 2.5]})
+    print(available_codecs(), read_store_index('processed_example'))
+    print(load_rtvol(path, window=np.s_[60:62])[0].shape)
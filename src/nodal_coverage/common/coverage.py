@@ -0,0 +1,234 @@
+import os
+import csv
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import SimpleITK as sitk
+from scipy import ndimage
+from src.common.roi_names import normalize_roi_name
+from src.common.mask_utils import bounding_box, mask_surface, read_mask_labels
+
+# Expansions of the covering ROI, in mm, at which target coverage is reported
+DEFAULT_EXPANSIONS_MM = (0, 3, 5, 7, 10)
+
+COVERAGE_COLUMNS = ['folder', 'target_roi', 'covering_roi', 'target_volume_cc', 'covering_volume_cc',
+                    'coverage', 'uncovered_volume_cc', 'max_distance_outside_mm', 'min_margin_mm',
+                    'margin_p05_mm', 'mean_margin_mm', 'target_mean_intensity', 'error']
+
+def find_roi_mask(folder, names, mask_cache=None):
+    """
+    Find an ROI in a patient folder written by DicomToNifti and return its mask.
+    
+    The ROI is looked up by name (any of names, case-insensitive) in Mask_Labels.json of a
+    multi-label Mask.nii.gz first, then among the exported <ROI name>.mhd files.
+    
+    Args:
+        folder (str): Patient folder.
+        names (list): Accepted names of the ROI, e.g. roi_associations['nodes'].
+        mask_cache (dict): Optional {path: array} so Mask.nii.gz is read once per folder.
+    
+    Returns:
+        tuple: (str: ROI name found, np.array: boolean mask ordered (z, y, x)).
+    """
+    wanted = {normalize_roi_name(name) for name in names}
+    if mask_cache is None:
+        mask_cache = {}
+    for name, label in read_mask_labels(folder).items():
+        if normalize_roi_name(name) in wanted:
+            mask_path = os.path.join(folder, 'Mask.nii.gz')
+            if mask_path not in mask_cache:
+                mask_cache[mask_path] = sitk.GetArrayFromImage(sitk.ReadImage(mask_path))
+            return name, mask_cache[mask_path] == label
+    for file in sorted(os.listdir(folder)):
+        name, extension = os.path.splitext(file)
+        if extension.lower() == '.mhd' and normalize_roi_name(name) in wanted:
+            return name, sitk.GetArrayViewFromImage(sitk.ReadImage(os.path.join(folder, file))) > 0
+    raise KeyError(f"None of {sorted(wanted)} found in {folder}")
+
+class CoverageScorer:
+    """
+    Scores how well a covering ROI (e.g. the nodal CTV) covers a target ROI.
+    
+    Distances are computed on the box around both ROIs grown by the largest expansion,
+    not on the full CT grid. The working buffers (uint8 masks, float32 image crop and
+    the distance maps) are allocated once and grown as needed, so scoring a cohort in one
+    process does not reallocate per patient. scipy's distance_transform_edt only writes
+    into float64 arrays, so the distance buffers are float64.
+    
+    Args:
+        expansions_mm (tuple): Expansions of the covering ROI at which coverage is reported.
+    """
+    def __init__(self, expansions_mm=DEFAULT_EXPANSIONS_MM):
+        self.expansions_mm = tuple(expansions_mm)
+        self._buffers = {}
+    
+    def _buffer(self, name, shape, dtype):
+        size = int(np.prod(shape))
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.size < size:
+            buffer = self._buffers[name] = np.empty(size, dtype=dtype)
+        return buffer[:size].reshape(shape)
+    
+    def crop_box(self, target, covering, spacing):
+        """
+        Box around both ROIs with room for the largest expansion on every side.
+        """
+        margin = max(self.expansions_mm + (0,))
+        box = bounding_box(target, covering, margin=0)
+        if box is None:
+            return None
+        # spacing is (x, y, z), the arrays are (z, y, x)
+        padding = [int(np.ceil(margin / step)) + 1 for step in tuple(spacing)[::-1]]
+        return tuple(slice(max(i.start - pad, 0), min(i.stop + pad, size))
+                     for i, pad, size in zip(box, padding, target.shape))
+    
+    def signed_distance(self, covering, spacing):
+        """
+        Signed distance in mm to the covering ROI boundary on a cropped grid: positive
+        outside the ROI, negative inside.
+        """
+        sampling = tuple(spacing)[::-1]
+        outside = self._buffer('outside', covering.shape, np.float64)
+        inside = self._buffer('inside', covering.shape, np.float64)
+        ndimage.distance_transform_edt(~covering, sampling=sampling, distances=outside)
+        ndimage.distance_transform_edt(covering, sampling=sampling, distances=inside)
+        np.subtract(outside, inside, out=outside)
+        return outside
+    
+    def score(self, target, covering, spacing, image=None):
+        """
+        Coverage and margin statistics of target by covering.
+        
+        Args:
+            target (np.array): Boolean target mask ordered (z, y, x).
+            covering (np.array): Boolean covering mask on the same grid.
+            spacing (tuple): Voxel spacing in (x, y, z) order.
+            image (np.array): Optional image on the same grid for intensity statistics.
+        
+        Returns:
+            dict: Volumes in cc, 'coverage' (fraction of target inside covering),
+                'coverage_<n>mm' for every expansion, the largest distance of target voxels
+                outside the covering ROI, and margins (distance from target surface voxels
+                to the covering boundary, negative where the target sticks out).
+        """
+        if target.shape != covering.shape:
+            raise ValueError(f"Mask shapes differ: {target.shape} and {covering.shape}")
+        voxel_cc = float(np.prod(spacing)) / 1000
+        results = {'target_volume_cc': int(np.count_nonzero(target)) * voxel_cc,
+                   'covering_volume_cc': int(np.count_nonzero(covering)) * voxel_cc}
+        box = self.crop_box(target, covering, spacing)
+        if box is None or not target.any() or not covering.any():
+            results['error'] = 'empty ROI'
+            return results
+        cropped_shape = tuple(i.stop - i.start for i in box)
+        target_crop = self._buffer('target', cropped_shape, np.uint8)
+        covering_crop = self._buffer('covering', cropped_shape, np.uint8)
+        np.copyto(target_crop, target[box])
+        np.copyto(covering_crop, covering[box])
+        target_crop = target_crop.view(bool)
+        covering_crop = covering_crop.view(bool)
+        
+        distance = self.signed_distance(covering_crop, spacing)
+        target_distance = distance[target_crop]
+        results['coverage'] = float(np.count_nonzero(target_distance <= 0) / target_distance.size)
+        results['uncovered_volume_cc'] = int(np.count_nonzero(target_distance > 0)) * voxel_cc
+        for expansion in self.expansions_mm:
+            results[f'coverage_{expansion}mm'] = float(np.count_nonzero(target_distance <= expansion) /
+                                                       target_distance.size)
+        results['max_distance_outside_mm'] = float(max(target_distance.max(), 0))
+        margins = -distance[mask_surface(target_crop)]
+        results['min_margin_mm'] = float(margins.min())
+        results['margin_p05_mm'] = float(np.percentile(margins, 5))
+        results['mean_margin_mm'] = float(margins.mean())
+        if image is not None:
+            image_crop = self._buffer('image', cropped_shape, np.float32)
+            np.copyto(image_crop, image[box], casting='unsafe')
+            results['target_mean_intensity'] = float(image_crop[target_crop].mean(dtype=np.float64))
+        return results
+    
+    def score_folder(self, folder, target_names, covering_names):
+        """
+        Score a patient folder with Image.nii.gz and Mask.nii.gz (or exported ROI .mhd files).
+        
+        Args:
+            folder (str): Patient folder.
+            target_names (list): Accepted names of the target ROI.
+            covering_names (list): Accepted names of the covering ROI.
+        
+        Returns:
+            dict: 'folder', the ROI names found and the score() results.
+        """
+        image_handle = sitk.ReadImage(os.path.join(folder, 'Image.nii.gz'))
+        mask_cache = {}
+        target_roi, target = find_roi_mask(folder, target_names, mask_cache)
+        covering_roi, covering = find_roi_mask(folder, covering_names, mask_cache)
+        results = {'folder': folder, 'target_roi': target_roi, 'covering_roi': covering_roi}
+        results.update(self.score(target, covering, image_handle.GetSpacing(),
+                                  sitk.GetArrayViewFromImage(image_handle)))
+        return results
+
+# One scorer per worker process, so its buffers are reused across the folders it scores
+_worker_scorer = None
+
+def _init_worker(expansions_mm):
+    global _worker_scorer
+    _worker_scorer = CoverageScorer(expansions_mm)
+
+def _score_folder_worker(folder, target_names, covering_names):
+    try:
+        return _worker_scorer.score_folder(folder, target_names, covering_names)
+    except Exception as e:
+        return {'folder': folder, 'error': repr(e)}
+
+def find_scorable_folders(base_path):
+    for root, directories, files in os.walk(base_path):
+        if 'Image.nii.gz' in files and ('Mask.nii.gz' in files or any(i.endswith('.mhd') for i in files)):
+            yield root
+
+def score_cohort(base_path, target_names, covering_names, output_path, max_workers=4,
+                 expansions_mm=DEFAULT_EXPANSIONS_MM, resume=True):
+    """
+    Score every patient folder under base_path in a process pool and stream one row per
+    folder to a CSV file as results come in.
+    
+    Args:
+        base_path (str): Cohort directory, e.g. the DicomToNifti output.
+        target_names (list): Accepted names of the target ROI.
+        covering_names (list): Accepted names of the covering ROI.
+        output_path (str): CSV file for the results.
+        max_workers (int): Number of worker processes.
+        expansions_mm (tuple): Expansions at which coverage is reported.
+        resume (bool): Keep the rows already in output_path and skip the folders scored
+            without error. Failed folders are scored again and appended, so the last row of
+            a folder is its current result.
+    
+    Returns:
+        int: Number of folders scored in this run.
+    """
+    columns = COVERAGE_COLUMNS + [f'coverage_{i}mm' for i in expansions_mm]
+    done = set()
+    if resume and os.path.exists(output_path):
+        with open(output_path, newline='') as csv_file:
+            done = {row['folder'] for row in csv.DictReader(csv_file) if not row.get('error')}
+    folders = [i for i in find_scorable_folders(base_path) if i not in done]
+    print(f"{len(folders)} folders to score, {len(done)} already scored")
+    
+    write_header = not (resume and os.path.exists(output_path))
+    with open(output_path, 'a' if not write_header else 'w', newline='') as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=columns, extrasaction='ignore')
+        if write_header:
+            writer.writeheader()
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                 initargs=(tuple(expansions_mm),)) as executor:
+            futures = [executor.submit(_score_folder_worker, folder, target_names, covering_names)
+                       for folder in folders]
+            for future in as_completed(futures):
+                writer.writerow(future.result())
+                csv_file.flush()
+    return len(folders)
+
+# Example usage
+if __name__ == "__main__":
+    base_path = r'\\vscifs1\PhysicsQAdata\BMA\Prostate_Nodes'
+    score_cohort(base_path, target_names=['prostate', 'prostate only'],
+                 covering_names=['nodes', 'pelvic nodes', 'lymph nodes', 'lymphnodes', 'pelvicnodes'],
+                 output_path=os.path.join(base_path, 'nodal_coverage.csv'))
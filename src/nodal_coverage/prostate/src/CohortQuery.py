@@ -0,0 +1,167 @@
+from typing import *
+from src.common.roi_names import ROINameClassifier, normalize_roi_name
+
+
+class ROIFilter:
+    """
+    Declarative ROI selection. Criteria that are left as None match every ROI
+
+    Names are compared after normalize_roi_name, like identify_wanted_headers does, so
+    'Pelvic  Nodes ' matches 'pelvic nodes': case and runs of whitespace are ignored.
+
+    Args:
+        names: ROI names to keep (exact match after normalize_roi_name)
+        types: ROI types to keep, e.g. ['ctv', 'ptv']
+        exclude_terms: drop ROIs whose name contains any of these terms
+    """
+    def __init__(self, names: Optional[Iterable[str]] = None, types: Optional[Iterable[str]] = None,
+                 exclude_terms: Optional[Iterable[str]] = None):
+        self.name_classifier = ROINameClassifier(names=names, exclude_terms=exclude_terms)
+        self.names = self.name_classifier.names
+        self.types = {i.lower() for i in types} if types is not None else None
+
+    def matches(self, roi_name: str, roi_type: str):
+        """
+        roi_type is expected in lower case
+        """
+        if self.types is not None and roi_type not in self.types:
+            return False
+        return self.name_classifier.matches(roi_name)
+
+
+class ROIMatch:
+    __slots__ = ('DataBase', 'Patient', 'Case', 'Plan', 'Review', 'Exam', 'ROI', 'BaseROI')
+
+    def __init__(self, database, patient, case, plan, review, exam, roi, base_roi):
+        self.DataBase = database
+        self.Patient = patient
+        self.Case = case
+        self.Plan = plan
+        self.Review = review
+        self.Exam = exam
+        self.ROI = roi
+        self.BaseROI = base_roi
+
+
+class CaseIndex:
+    """
+    Hash maps for one case: RS_Number -> base ROI and exam name -> exams
+    """
+    def __init__(self, case):
+        self.base_rois = {}
+        for base_roi in case.Base_ROIs:
+            # Keep the first base ROI for a number, like the list scan it replaces
+            self.base_rois.setdefault(base_roi.RS_Number, base_roi)
+        self.exams = {}
+        for exam in case.Examinations:
+            self.exams.setdefault(exam.ExamName, []).append(exam)
+
+
+class CohortIndex:
+    """
+    Indexed view over the patient databases returned by return_patient_databases
+
+    Patients are indexed by MRN in the order of db_list, and case/ROI lookups go through
+    hash maps instead of nested list scans, so selecting a cohort is linear in the number
+    of ROIs looked at.
+
+    Args:
+        databases: object with a Databases dict of {name: database with a Patients dict}
+        db_list: database names to index, in priority order. A patient present in several
+            databases is reported from the first one. Defaults to every database
+
+    Raises:
+        KeyError: a name of db_list is not in databases
+    """
+    def __init__(self, databases, db_list: Optional[List[str]] = None):
+        if db_list is None:
+            db_list = list(databases.Databases.keys())
+        missing = [i for i in db_list if i not in databases.Databases]
+        if missing:
+            raise KeyError(f"Databases not found: {missing}")
+        self.db_list = list(db_list)
+        self.patients_by_mrn = {}
+        for db_name in self.db_list:
+            for patient in databases.Databases[db_name].Patients.values():
+                self.patients_by_mrn.setdefault(patient.MRN, []).append((db_name, patient))
+        self._case_indexes = {}
+        self._roi_name_index = None
+
+    def case_index(self, case):
+        key = id(case)
+        if key not in self._case_indexes:
+            self._case_indexes[key] = CaseIndex(case)
+        return self._case_indexes[key]
+
+    @property
+    def roi_name_index(self):
+        """
+        {normalized ROI name: set of MRNs having an ROI with that name in any exam}
+        """
+        if self._roi_name_index is None:
+            self._roi_name_index = {}
+            for mrn, entries in self.patients_by_mrn.items():
+                for _, patient in entries:
+                    for case in patient.Cases:
+                        for exam in case.Examinations:
+                            for roi in exam.ROIs:
+                                self._roi_name_index.setdefault(normalize_roi_name(roi.Name), set()).add(mrn)
+        return self._roi_name_index
+
+    def mrns_with_rois(self, names: Iterable[str]):
+        mrns = set()
+        for name in names:
+            mrns |= self.roi_name_index.get(normalize_roi_name(name), set())
+        return mrns
+
+    def patient(self, mrn: str, databases: Optional[Iterable[str]] = None):
+        """
+        Returns (database name, patient) for an MRN, or None
+        """
+        for db_name, patient in self.patients_by_mrn.get(mrn, []):
+            if databases is None or db_name in databases:
+                return db_name, patient
+        return None
+
+    def query(self, filters: List[ROIFilter], approval_status: Optional[str] = 'Approved',
+              databases: Optional[Iterable[str]] = None, mrns: Optional[Iterable[str]] = None):
+        """
+        Yield an ROIMatch for every ROI of an exam referenced by a reviewed plan that
+        matches any of the filters
+
+        Args:
+            filters: an ROI is kept if any filter matches it
+            approval_status: required plan review status, None to accept any reviewed plan
+            databases: restrict to these databases (defaults to db_list)
+            mrns: restrict to these MRNs
+        """
+        databases = set(databases) if databases is not None else None
+        if mrns is None:
+            candidates = list(self.patients_by_mrn)
+        else:
+            candidates = [i for i in mrns if i in self.patients_by_mrn]
+        if filters and all(f.names is not None for f in filters):
+            # Every filter needs a named ROI, so only patients having one can match
+            with_rois = self.mrns_with_rois(set().union(*[f.names for f in filters]))
+            candidates = [i for i in candidates if i in with_rois]
+        for mrn in candidates:
+            found = self.patient(mrn, databases)
+            if found is None:
+                continue
+            db_name, patient = found
+            for case in patient.Cases:
+                index = self.case_index(case)
+                for plan in case.TreatmentPlans:
+                    review = plan.Review
+                    if review is None:
+                        continue
+                    if approval_status is not None and review.ApprovalStatus != approval_status:
+                        continue
+                    for exam in index.exams.get(plan.Referenced_Exam_Name, []):
+                        for roi in exam.ROIs:
+                            base_roi = index.base_rois.get(roi.RS_Number)
+                            if base_roi is None:
+                                continue
+                            roi_type = base_roi.Type.lower()
+                            if any(f.matches(roi.Name, roi_type) for f in filters):
+                                yield ROIMatch(db_name, patient, case, plan, review, exam, roi, base_roi)
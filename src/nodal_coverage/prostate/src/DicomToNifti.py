@@ -1,37 +1,322 @@
 import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+import numpy as np
 import SimpleITK as sitk
 from PlotScrollNumpyArrays.Plot_Scroll_Images import plot_scroll_Image
 from DicomRTTool.ReaderWriter import DicomReaderWriter, ROIAssociationClass
 from typing import *
+sys.path.append(os.path.join('.', '..', '..', '..', '..'))
+from src.common.utils import save_json, load_json, atomic_write, is_temp_file, files_fingerprint
+from src.common import metrics
+from src.common.mask_storage import save_sitk_masks
+from src.common.volume_store import write_patient_volume
+from src.common.staging import FolderStager
 
 
-def sum_images(image_handles: List[sitk.Image]):
-    # Read the first image
-    sum_image = image_handles[0]
+# Files read by convert_folder; everything else in a patient folder is an output
+CONVERSION_INPUTS = ('.dcm', '.mhd', '.raw')
 
-    # Iterate over the remaining images and add them to the sum_image
-    for image_handle in image_handles[1:]:
-        sum_image = sitk.Add(sum_image, image_handle)
+# Output options of manifest entries written before the options were recorded
+LEGACY_OUTPUT_OPTIONS = {'multi_label': False, 'mask_format': 'nifti', 'volume_store': None}
 
-    return sum_image
+
+def combine_masks(mhd_paths: List[str], multi_label: bool = False):
+    """
+    Combine ROI masks by streaming them into a single preallocated array
+
+    Only one ROI is held in memory at a time. By default the result counts how many ROIs
+    cover each voxel; with multi_label each ROI gets its own label instead (later ROIs win
+    where they overlap).
+
+    Args:
+        mhd_paths: paths of the ROI MetaImage files, all on the same grid
+        multi_label: write label i + 1 for the i-th ROI instead of summing
+
+    Returns:
+        (sitk.Image, {label: ROI name})
+    """
+    reader = sitk.ImageFileReader()
+    reader.SetFileName(mhd_paths[0])
+    reader.ReadImageInformation()
+    size = reader.GetSize()
+    dtype = np.uint8 if len(mhd_paths) < 256 else np.uint16
+    combined = np.zeros(size[::-1], dtype=dtype)
+    labels = {}
+    for label, mhd_path in enumerate(mhd_paths, start=1):
+        roi_handle = sitk.ReadImage(mhd_path)
+        if roi_handle.GetSize() != size:
+            raise ValueError(f"{mhd_path} is not on the same grid as {mhd_paths[0]}")
+        roi = sitk.GetArrayViewFromImage(roi_handle) > 0
+        if multi_label:
+            combined[roi] = label
+        else:
+            np.add(combined, roi, out=combined, casting='unsafe')
+        labels[label] = os.path.splitext(os.path.basename(mhd_path))[0]
+    mask_handle = sitk.GetImageFromArray(combined)
+    mask_handle.SetSpacing(reader.GetSpacing())
+    mask_handle.SetOrigin(reader.GetOrigin())
+    mask_handle.SetDirection(reader.GetDirection())
+    return mask_handle, labels
+
+
+def write_image_atomic(image_handle: sitk.Image, file_path: str):
+    """
+    Write an image to a temporary file next to file_path and rename it into place,
+    so an interrupted write never leaves a file that looks finished
+    """
+    with atomic_write(file_path, keep_extension=True) as temp_path:
+        sitk.WriteImage(image_handle, temp_path)
+
+
+def folder_fingerprint(folder: str, files: List[str]):
+    """
+    Fingerprint of the conversion inputs (.dcm and .mhd/.raw files) of a folder,
+    based on their names, sizes and modification times
+    """
+    return files_fingerprint([os.path.join(folder, file) for file in files
+                              if file.lower().endswith(CONVERSION_INPUTS)], root=folder)
+
+
+def find_dicom_folders(base_path: str):
+    for root, directories, files in os.walk(base_path):
+        if [i for i in files if i.endswith('.dcm')]:
+            yield root, files
+
+
+def write_sparse_masks(root: str, mhd_files: List[str], input_root: Optional[str] = None):
+    """
+    Write Mask.rtmask for the ROI .mhd files of a folder: every ROI is kept separately as
+    its bounding box and bit-packed voxels (see src/common/mask_storage.py), which is far
+    smaller and faster to read than a dense mask. ROIs are read one at a time.
+    """
+    mhd_paths = [os.path.join(input_root or root, f) for f in sorted(mhd_files)]
+    save_sitk_masks(os.path.join(root, "Mask.rtmask"),
+                    ((os.path.splitext(os.path.basename(i))[0], sitk.ReadImage(i)) for i in mhd_paths))
+    return root
+
+
+def write_mask(root: str, mhd_files: List[str], multi_label: bool = False, mask_format: str = 'nifti',
+               input_root: Optional[str] = None):
+    """
+    Write Mask.nii.gz for the ROI .mhd files of a folder, plus Mask_Labels.json with the
+    ROI name of every label when multi_label is set
+
+    mask_format: 'nifti' (Mask.nii.gz), 'rtmask' (Mask.rtmask, see write_sparse_masks) or 'both'
+    input_root: read the .mhd files from this copy of the folder instead of root
+    """
+    if mask_format not in ('nifti', 'rtmask', 'both'):
+        raise ValueError(f"Unknown mask format {mask_format}")
+    # Outputs of an earlier conversion with other options would be read as current
+    stale = []
+    if mask_format == 'nifti':
+        stale.append("Mask.rtmask")
+    if mask_format == 'rtmask':
+        stale.append("Mask.nii.gz")
+    if mask_format == 'rtmask' or not multi_label:
+        stale.append("Mask_Labels.json")
+    for file in stale:
+        if os.path.exists(os.path.join(root, file)):
+            os.remove(os.path.join(root, file))
+    if mask_format in ('rtmask', 'both'):
+        write_sparse_masks(root, mhd_files, input_root)
+    if mask_format == 'rtmask':
+        return root
+    mask_handle, labels = combine_masks([os.path.join(input_root or root, f) for f in sorted(mhd_files)],
+                                        multi_label=multi_label)
+    write_image_atomic(mask_handle, os.path.join(root, "Mask.nii.gz"))
+    if multi_label:
+        save_json({str(label): name for label, name in labels.items()},
+                  os.path.join(root, "Mask_Labels.json"), atomic=True)
+    return root
+
+
+def combine_masks_in_folders(folders: List[str], multi_label: bool = False, max_workers: int = 4):
+    """
+    Write Mask.nii.gz for many folders in parallel
+    """
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(write_mask, root, [f for f in os.listdir(root) if f.endswith('.mhd')],
+                                   multi_label) for root in folders]
+        for future in as_completed(futures):
+            print(f"Wrote mask for {future.result()}")
+
+
+def convert_folder(root: str, files: List[str], multi_label: bool = False, mask_format: str = 'nifti',
+                   volume_store: Optional[str] = None, input_root: Optional[str] = None):
+    """
+    Convert one patient folder to Image.nii.gz (and Mask.nii.gz if ROI .mhd files exist)
+
+    With volume_store, the image is also written as <volume_store>/<folder name>/ct.rtvol,
+    a chunked volume that can be read a few slices at a time (see src/common/volume_store.py)
+
+    With input_root, the DICOM and .mhd files are read from that local copy of the folder
+    (see src/common/staging.py) while the outputs are still written to root
+
+    Returns:
+        dict with the per-step timing of the folder
+    """
+    timing = {}
+    start = time.perf_counter()
+    if input_root is None:
+        input_root = root
+    for file in files:
+        # Left behind by an interrupted write_image_atomic or save_masks
+        if is_temp_file(file):
+            os.remove(os.path.join(root, file))
+    reader = DicomReaderWriter()
+    with metrics.timed('read_dicom_folder', folder=root):
+        reader.down_folder(input_root)
+    for i in reader.series_instances_dictionary.keys():
+        reader.set_index(i)
+        with metrics.timed('decode_dicom', folder=root):
+            reader.get_images()
+        with metrics.timed('write_image', folder=root):
+            write_image_atomic(reader.dicom_handle, os.path.join(root, "Image.nii.gz"))
+        if volume_store is not None:
+            with metrics.timed('write_volume_store', folder=root):
+                handle = reader.dicom_handle
+                write_patient_volume(volume_store, os.path.basename(os.path.normpath(root)), 'ct',
+                                     sitk.GetArrayViewFromImage(handle),
+                                     {'spacing': handle.GetSpacing(), 'origin': handle.GetOrigin(),
+                                      'direction': handle.GetDirection()}, max_workers=1)
+        break
+    timing['image_seconds'] = time.perf_counter() - start
+
+    mhd_files = [i for i in files if i.endswith('.mhd')]
+    if mhd_files:
+        mask_start = time.perf_counter()
+        with metrics.timed('write_mask', folder=root, n_rois=len(mhd_files)):
+            write_mask(root, mhd_files, multi_label=multi_label, mask_format=mask_format,
+                       input_root=input_root)
+        timing['mask_seconds'] = time.perf_counter() - mask_start
+    timing['seconds'] = time.perf_counter() - start
+    if metrics.is_enabled():
+        metrics.count('bytes_read', sum(os.path.getsize(os.path.join(input_root, i)) for i in files
+                                        if i.lower().endswith(CONVERSION_INPUTS)))
+    return timing
+
+
+def convert_all(base_path: str, max_workers: int = 4, manifest_path: Optional[str] = None,
+                force: bool = False, multi_label: bool = False, metrics_path: Optional[str] = None,
+                mask_format: str = 'nifti', volume_store: Optional[str] = None,
+                stage_dir: Optional[str] = None, stage_read_ahead: Optional[int] = None,
+                stage_max_bytes: int = 20 * 1024 ** 3):
+    """
+    Convert every patient folder under base_path across a process pool
+
+    A manifest of input fingerprints is kept in base_path, so folders whose inputs and
+    output options (multi_label, mask_format, volume_store) did not change since their
+    last successful conversion are skipped. The manifest is rewritten atomically after
+    every folder, so an interrupted run resumes where it stopped.
+
+    With stage_dir, the input files of the folders (.dcm, .mhd and .raw) are copied from
+    the share to local scratch a few at a time ahead of the workers (see src/common/staging.py), so the workers read local disk while
+    the next folders are still being fetched. Every copy is deleted once its folder is converted.
+
+    Args:
+        base_path: folder holding one sub-folder of DICOM files per patient
+        max_workers: number of worker processes
+        manifest_path: defaults to conversion_manifest.json in base_path
+        force: reconvert every folder regardless of the manifest
+        multi_label: write a label map instead of a summed mask (see combine_masks)
+        mask_format: 'nifti', 'rtmask' or 'both', see write_mask
+        volume_store: also write every image into this chunked volume store, e.g. data/processed
+        metrics_path: JSON lines file for per-step timings of every worker (see src/common/metrics.py)
+        stage_dir: local scratch folder to stage the inputs in, None reads them from base_path
+        stage_read_ahead: folders staged and not yet converted, defaults to twice max_workers
+        stage_max_bytes: disk budget of the staged folders
+
+    Returns:
+        the manifest, {relative folder: {'fingerprint', 'options', 'status', timings or 'error'}}
+    """
+    if manifest_path is None:
+        manifest_path = os.path.join(base_path, 'conversion_manifest.json')
+    manifest = load_json(manifest_path) if os.path.exists(manifest_path) else {}
+    if metrics_path is not None:
+        # Set before the pool starts, so the workers log to the same file
+        metrics.enable_metrics(metrics_path)
+    # A change of output options reconverts folders whose inputs did not change
+    options = {'multi_label': multi_label, 'mask_format': mask_format,
+               'volume_store': os.path.abspath(volume_store) if volume_store is not None else None}
+
+    pending = {}
+    for root, files in find_dicom_folders(base_path):
+        key = os.path.relpath(root, base_path)
+        fingerprint = folder_fingerprint(root, files)
+        previous = manifest.get(key, {})
+        if (not force and previous.get('status') == 'done' and previous.get('fingerprint') == fingerprint
+                and previous.get('options', LEGACY_OUTPUT_OPTIONS) == options):
+            continue
+        pending[key] = (root, files, fingerprint)
+    print(f"{len(pending)} folders to convert, {len(manifest)} in manifest")
+
+    def record_result(key, result=None, error=None):
+        record = {'fingerprint': pending[key][2], 'options': options}
+        if error is None:
+            record.update(result)
+            record['status'] = 'done'
+            print(f"Converted {key} in {record['seconds']:.1f}s")
+        else:
+            record['status'] = 'failed'
+            record['error'] = repr(error)
+            print(f"Failed {key}: {error!r}")
+        manifest[key] = record
+        save_json(manifest, manifest_path, atomic=True)
+        metrics.emit('convert_folder', folder=key, **record)
+
+    def collect(future):
+        try:
+            record_result(futures[future], future.result())
+        except Exception as e:
+            record_result(futures[future], error=e)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        if stage_dir is None:
+            futures = {executor.submit(convert_folder, root, files, multi_label, mask_format, volume_store): key
+                       for key, (root, files, fingerprint) in pending.items()}
+            for future in as_completed(futures):
+                collect(future)
+            return manifest
+
+        keys = {root: key for key, (root, files, fingerprint) in pending.items()}
+        futures = {}
+        staged_folders = {}
+
+        def release_converted(timeout):
+            done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                collect(future)
+                stager.release(staged_folders.pop(future))
+                del futures[future]
+
+        # Only the conversion inputs are staged, not the outputs of earlier runs
+        sources = [(root, [i for i in files if i.lower().endswith(CONVERSION_INPUTS)])
+                   for root, files, fingerprint in pending.values()]
+        with FolderStager(stage_dir, read_ahead=stage_read_ahead or 2 * max_workers,
+                          max_bytes=stage_max_bytes) as stager:
+            # Staging stops while read_ahead folders or max_bytes are held, so converted folders
+            # are released every time a folder is staged or the poll times out
+            for staged in stager.stage(sources, timeout=0.1):
+                release_converted(timeout=0)
+                if staged is None:
+                    continue
+                key = keys[staged.source]
+                if staged.error is not None:
+                    record_result(key, error=staged.error)
+                    continue
+                root, files, fingerprint = pending[key]
+                future = executor.submit(convert_folder, root, files, multi_label, mask_format, volume_store,
+                                         staged.path)
+                futures[future] = key
+                staged_folders[future] = staged
+            while futures:
+                release_converted(timeout=None)
+    return manifest
 
 
 base_path = r'\\vscifs1\PhysicsQAdata\BMA\Prostate_Nodes'
 associations = [ROIAssociationClass('prostate', ['prostate', 'prostate only'])]
-for root, directories, files in os.walk(base_path):
-    if [i for i in files if i.endswith('.dcm')]:
-        print(f"Running {root}")
-        if 'Image.nii.gz' not in files:
-            reader = DicomReaderWriter()
-            reader.down_folder(root)
-            for i in reader.series_instances_dictionary.keys():
-                reader.set_index(i)
-                reader.get_images()
-                sitk.WriteImage(reader.dicom_handle, os.path.join(root, f"Image.nii.gz"))
-                break
-        if 'Mask.nii.gz' not in files:
-            mhd_files = [i for i in files if i.endswith('.mhd')]
-            if mhd_files:
-                image_handles = [sitk.ReadImage(os.path.join(root, f)) for f in mhd_files]
-                mask_handle = sum_images(image_handles)
-                sitk.WriteImage(mask_handle, os.path.join(root, "Mask.nii.gz"))
\ No newline at end of file
+if __name__ == '__main__':
+    convert_all(base_path)
@@ -1,21 +1,176 @@
 import sys
 import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 sys.path.append(os.path.join('.', '..', '..', '..', '..'))
 from src.InfoStructure.RaystationExportTools import *
+from src.common.utils import save_table, load_table, save_json, load_json
+from src.common import metrics
 import pandas as pd
 
 
-def excel_to_text():
+def read_selected_patients():
+    """
+    Read the selected patients, converting the Excel selection sheet to Parquet once
+    so later reads do not go through openpyxl
+    """
     excel_path = os.path.join('.', "ProstateNodePatients.xlsx")
-    df = pd.read_excel(excel_path, sheet_name="Selected Prostate Patients")
+    parquet_path = os.path.join('.', "SelectedProstatePatients.parquet")
+    if not os.path.exists(parquet_path) or (os.path.exists(excel_path) and
+                                            os.path.getmtime(excel_path) > os.path.getmtime(parquet_path)):
+        df = load_table(excel_path, sheet_name="Selected Prostate Patients")
+        save_table(df, parquet_path)
+    return load_table(parquet_path, columns=['MRN', 'Case', 'Exam', 'ROIName', 'ROIVolume'])
+
+
+def excel_to_text():
+    df = read_selected_patients()
+    df = df[(df['ROIName'].str.lower() == 'prostate') & df['ROIVolume'].between(30, 50)]
+    lines = (df['MRN'].astype(str) + '|' + df['Case'].astype(str) + '|' + df['Exam'].astype(str) + '|' +
+             df['ROIName'] + '\n')
     fid = open(os.path.join('.', 'rs_patients.txt'), 'w+')
-    for i in range(df.shape[0]):
-        if df['ROIName'][i].lower() == 'prostate':
-            if 30 <= df['ROIVolume'][i] <= 50:
-                fid.write(df["MRN"][i] + '|' + df['Case'][i] + '|' + df['Exam'][i] + '|' + df['ROIName'][i] + '\n')
+    fid.writelines(lines)
     fid.close()
 
 
+class PatientNotFound(Exception):
+    pass
+
+
+def export_is_complete(folder: str):
+    """
+    Whether a patient export folder holds both the examination (.dcm files) and the
+    ROI meta images (.mhd files), i.e. an export that finished
+    """
+    has_dicom = has_rois = False
+    for root, directories, files in os.walk(folder):
+        has_dicom = has_dicom or any(i.lower().endswith('.dcm') for i in files)
+        has_rois = has_rois or any(i.lower().endswith('.mhd') for i in files)
+        if has_dicom and has_rois:
+            return True
+    return False
+
+
+class ExportJobQueue:
+    """
+    Persistent queue of patient exports
+
+    Every job is stored in a JSON state file as pending, running, done or failed, with the
+    number of attempts, the last error and the duration summed over all attempts, and the
+    file is rewritten atomically after every change. Jobs that were running when a previous
+    run died go back to pending. Failed attempts are retried with exponential backoff. A
+    patient new to the state file whose export folder is already complete (see
+    export_is_complete), e.g. exported before the queue existed, starts as done. The
+    RayStation scripting backend handles one patient at a time, so max_workers should stay 1
+    unless each worker talks to its own RayStation instance.
+
+    Args:
+        state_path: path of the JSON job-state file
+        exporter_factory: callable returning a new exporter, e.g. ExportBaseClass
+        export_path: folder the patients are exported to
+        max_workers: number of exports running concurrently
+        max_attempts: attempts per job before it is marked failed
+        backoff_seconds: wait before the first retry, doubled after every failed attempt
+    """
+    def __init__(self, state_path: str, exporter_factory, export_path: str, max_workers: int = 1,
+                 max_attempts: int = 3, backoff_seconds: float = 30.0):
+        self.state_path = state_path
+        self.exporter_factory = exporter_factory
+        self.export_path = export_path
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.state = load_json(state_path) if os.path.exists(state_path) else {}
+        for job in self.state.values():
+            if job['status'] == 'running':
+                job['status'] = 'pending'
+        self.patients = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def add(self, patient):
+        self.patients[patient.RS_UID] = patient
+        if patient.RS_UID not in self.state:
+            exported = export_is_complete(os.path.join(self.export_path, patient.RS_UID))
+            self.state[patient.RS_UID] = {'MRN': patient.MRN, 'status': 'done' if exported else 'pending',
+                                          'attempts': 0, 'error': None, 'duration': None}
+
+    def _save(self):
+        with self._lock:
+            save_json(self.state, self.state_path, atomic=True)
+
+    def _exporter(self):
+        # One exporter per worker thread, since exporters keep the current patient
+        if getattr(self._local, 'exporter', None) is None:
+            self._local.exporter = self.exporter_factory()
+            self._local.exporter.set_export_path(self.export_path)
+        return self._local.exporter
+
+    def _export(self, patient):
+        exporter = self._exporter()
+        exporter.set_patient(patient)
+        if exporter.RSPatient is None:
+            raise PatientNotFound(f"{patient.MRN} was not found in RayStation")
+        exporter.export_examinations_and_structures(patient)
+        exporter.export_rois_as_meta_images(patient)
+
+    def _run_job(self, key):
+        job = self.state[key]
+        while True:
+            job['status'] = 'running'
+            job['attempts'] += 1
+            self._save()
+            start = time.perf_counter()
+            try:
+                with metrics.profiled(f"export_{key}"):
+                    self._export(self.patients[key])
+                job['status'] = 'done'
+                job['error'] = None
+            except Exception as e:
+                job['error'] = repr(e)
+                retry = not isinstance(e, PatientNotFound) and job['attempts'] < self.max_attempts
+                job['status'] = 'pending' if retry else 'failed'
+            elapsed = time.perf_counter() - start
+            job['duration'] = (job['duration'] or 0.0) + elapsed
+            metrics.emit('export_job', mrn=job['MRN'], status=job['status'], attempt=job['attempts'],
+                         seconds=elapsed, error=job['error'])
+            self._save()
+            if job['status'] != 'pending':
+                break
+            time.sleep(self.backoff_seconds * 2 ** (job['attempts'] - 1))
+        print(f"{job['MRN']}: {job['status']} after {job['attempts']} attempt(s), {job['duration']:.1f}s")
+        return job['status']
+
+    def run(self, retry_failed: bool = False):
+        """
+        Export every pending job (and failed ones when retry_failed is set)
+
+        Returns:
+            {status: number of jobs}
+        """
+        keys = []
+        for key in self.patients:
+            job = self.state[key]
+            if retry_failed and job['status'] == 'failed':
+                job['status'] = 'pending'
+                job['attempts'] = 0
+                job['duration'] = None
+            if job['status'] == 'pending':
+                keys.append(key)
+        if self.max_workers == 1:
+            for key in keys:
+                self._run_job(key)
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                list(executor.map(self._run_job, keys))
+        self._save()
+        summary = {}
+        for key in self.patients:
+            summary[self.state[key]['status']] = summary.get(self.state[key]['status'], 0) + 1
+        return summary
+
+
 def main():
     if not os.path.exists(os.path.join('.', 'rs_patients.txt')):
         excel_to_text()
@@ -40,20 +195,13 @@ def main():
         case.Examinations.append(exam)
         patient.Cases.append(case)
         pats_to_export.append(patient)
-    export_class = ExportBaseClass()
     base_export_path = r'\\vscifs1\PhysicsQAdata\BMA\Prostate_Nodes'
-    export_class.set_export_path(base_export_path)
+    metrics.enable_metrics(os.path.join('.', 'export_metrics.jsonl'))
+    export_queue = ExportJobQueue(os.path.join('.', 'export_jobs.json'), ExportBaseClass, base_export_path)
     for pat in pats_to_export:
-        if os.path.exists(os.path.join(base_export_path, pat.RS_UID)):
-            continue
-        try:
-            export_class.set_patient(pat)
-        except:
-            continue
-        if export_class.RSPatient is None:
-            continue
-        export_class.export_examinations_and_structures(pat)
-        export_class.export_rois_as_meta_images(pat)
+        export_queue.add(pat)
+    print(export_queue.run())
+    metrics.write_summary(os.path.join('.', 'export_metrics_summary.json'))
 
 
 if __name__ == '__main__':
@@ -1,52 +1,227 @@
 from src.InfoStructure.EvaluationTools import *
+from src.common.roi_names import ROINameClassifier, count_roi_names, NORMALIZATION_VERSION
+from src.common.utils import save_table, save_json, load_json, atomic_write, is_temp_file, files_fingerprint
+from src.common import metrics
+from CohortQuery import CohortIndex, ROIFilter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
+import shutil
+import pickle
+import hashlib
+from datetime import date, datetime
 from tqdm import tqdm
 import pandas as pd
 
+# Bump whenever the snapshot layout or the code building the snapshotted objects changes
+SNAPSHOT_VERSION = 1
+
+# Name fragments of planning helper structures (optimization, rings, couch, ...)
+HELPER_ROI_TERMS = ['ptv', 'opt', 'hot', 'cold', 'avo', 'norm', 'tune', 'ring', 'couch', 'arti', 'max',
+                    'min', 'push', 'shell', 'warm', '0', '1', '2', '3', '4', '5']
+
 
 def return_dataframe_from_class_list(list_classes):
+    if list_classes and hasattr(list_classes[0], '__slots__'):
+        fields = list_classes[0].__slots__
+        return pd.DataFrame({field: [getattr(f, field, None) for f in list_classes] for field in fields})
     return pd.DataFrame([vars(f) for f in list_classes])
 
 
+class ColumnBuffer:
+    """
+    Collects records column by column, so building the DataFrame at the end does not
+    have to go through one dict per record
+    """
+    def __init__(self, fields: Iterable[str]):
+        self.columns = {field: [] for field in fields}
+
+    def append(self, record):
+        for field, column in self.columns.items():
+            column.append(getattr(record, field, None))
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()), []))
+
+    def to_dataframe(self):
+        return pd.DataFrame(self.columns)
+
+
 def write_dataframe_to_excel(excel_path: Union[str, bytes, os.PathLike], dataframe: pd.DataFrame):
     with pd.ExcelWriter(excel_path) as writer:
         dataframe.to_excel(writer, index=False)
     return
 
 
-def update_database(network_path, local_path):
-    today = DateTimeClass()
-    today.from_python_datetime(datetime.today())
-    last_update_date = os.path.join(local_path, "Last_Updated.txt")
-    if not os.path.exists(last_update_date):
+def copy_file_atomic(source_path, destination_path):
+    os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+    with metrics.timed('copy_file', emit_event=False), atomic_write(destination_path) as temp_path:
+        shutil.copy2(source_path, temp_path)
+    metrics.count('bytes_copied', os.path.getsize(destination_path))
+
+
+@metrics.instrument('sync_local_database')
+def sync_local_database(network_path, local_path, max_workers: int = 4, delete_removed: bool = False,
+                        save_every: int = 20):
+    """
+    Incrementally mirror the network database folder into the local one
+
+    The size and mtime of every network file are compared with the values recorded in
+    Sync_Manifest.json when it was last copied, and the local copy is compared with the
+    size and mtime it had after that copy, so only new or changed files, and local copies
+    that were deleted or modified since, are copied, in parallel with at most max_workers
+    copies at a time. Files are copied to a temporary
+    name and renamed into place, and the manifest is written atomically every save_every
+    copied files, so an interrupted sync only redoes the files copied since the last save
+    and those it did not finish.
+
+    Args:
+        network_path: database folder on the share
+        local_path: local copy of the database folder
+        max_workers: maximum number of concurrent copies
+        delete_removed: delete local files that no longer exist on the share
+        save_every: number of copied files between two manifest saves
+
+    Returns:
+        list of the relative paths that were copied
+    """
+    os.makedirs(local_path, exist_ok=True)
+    manifest_path = os.path.join(local_path, "Sync_Manifest.json")
+    manifest = load_json(manifest_path) if os.path.exists(manifest_path) else {}
+    network_files = {}
+    for root, directories, files in os.walk(network_path):
+        for file in files:
+            source_path = os.path.join(root, file)
+            stat = os.stat(source_path)
+            network_files[os.path.relpath(source_path, network_path)] = {'size': stat.st_size,
+                                                                        'mtime_ns': stat.st_mtime_ns}
+
+    def local_copy_changed(rel_path):
+        try:
+            stat = os.stat(os.path.join(local_path, rel_path))
+        except OSError:
+            return True
+        return (stat.st_size, stat.st_mtime_ns) != (manifest[rel_path]['size'], manifest[rel_path].get('local_mtime_ns'))
+
+    changed = [rel_path for rel_path, stat in network_files.items()
+               if rel_path not in manifest or {i: manifest[rel_path].get(i) for i in stat} != stat
+               or local_copy_changed(rel_path)]
+
+    copied = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(copy_file_atomic, os.path.join(network_path, rel_path),
+                                   os.path.join(local_path, rel_path)): rel_path for rel_path in changed}
+        for future in tqdm(as_completed(futures), total=len(futures), desc='Syncing database'):
+            rel_path = futures[future]
+            try:
+                future.result()
+            except OSError as e:
+                print(f"Failed to copy {rel_path}: {e}")
+                manifest.pop(rel_path, None)
+                continue
+            local_mtime_ns = os.stat(os.path.join(local_path, rel_path)).st_mtime_ns
+            manifest[rel_path] = dict(network_files[rel_path], local_mtime_ns=local_mtime_ns)
+            copied.append(rel_path)
+            if len(copied) % save_every == 0:
+                save_json(manifest, manifest_path, atomic=True)
+
+    for rel_path in [i for i in manifest if i not in network_files]:
+        if delete_removed and os.path.exists(os.path.join(local_path, rel_path)):
+            os.remove(os.path.join(local_path, rel_path))
+        del manifest[rel_path]
+    save_json(manifest, manifest_path, atomic=True)
+
+    today = datetime.today()
+    fid = open(os.path.join(local_path, "Last_Updated.txt"), 'w')
+    fid.write(f"{today.year}.{today.month}.{today.day}")
+    fid.close()
+    return copied
+
+
+def database_fingerprint(local_path):
+    """
+    Fingerprint of the local database files (relative path, size and mtime of each),
+    ignoring the files written by sync_local_database
+    """
+    return files_fingerprint([os.path.join(root, file) for root, directories, files in os.walk(local_path)
+                              for file in files
+                              if file not in ("Sync_Manifest.json", "Last_Updated.txt") and not is_temp_file(file)],
+                             root=local_path)
+
+
+@metrics.instrument('load_or_build_snapshot')
+def load_or_build_snapshot(snapshot_path, key, build):
+    """
+    Return the object pickled at snapshot_path if it was stored with the same key and
+    SNAPSHOT_VERSION, otherwise call build() and pickle its result with them. A snapshot
+    that cannot be unpickled, e.g. after the pickled classes changed, is deleted
+
+    Args:
+        snapshot_path: path of the snapshot file
+        key: anything with a stable repr, e.g. the database fingerprint, the query parameters
+            and the version of the code the result depends on
+        build: callable creating the object when the snapshot is missing or stale
+    """
+    key = hashlib.sha1(repr((SNAPSHOT_VERSION, key)).encode()).hexdigest()
+    if os.path.exists(snapshot_path):
+        try:
+            with open(snapshot_path, 'rb') as fid:
+                snapshot = pickle.load(fid)
+            if snapshot['key'] == key:
+                return snapshot['data']
+        except Exception as e:
+            print(f"Deleting unreadable snapshot {snapshot_path}: {e!r}")
+            try:
+                os.remove(snapshot_path)
+            except OSError:
+                pass
+    data = build()
+    os.makedirs(os.path.dirname(snapshot_path) or '.', exist_ok=True)
+    try:
+        with atomic_write(snapshot_path) as temp_path, open(temp_path, 'wb') as fid:
+            pickle.dump({'key': key, 'data': data}, fid, protocol=pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, TypeError, AttributeError, RecursionError) as e:
+        print(f"Could not write snapshot {snapshot_path}: {e!r}")
+    return data
+
+
+def database_updated_today(local_path):
+    """
+    Whether Last_Updated.txt records an update of the local database today
+    """
+    last_update_path = os.path.join(local_path, "Last_Updated.txt")
+    if not os.path.exists(last_update_path):
+        return False
+    fid = open(last_update_path)
+    dates = fid.readline().split('.')
+    fid.close()
+    return (date.today() - date(int(dates[0]), int(dates[1]), int(dates[2]))).days < 1
+
+
+def update_database(network_path, local_path, incremental: bool = True):
+    """
+    Update the local database at most once a day, with sync_local_database or, when
+    incremental is False, with a full update_local_database copy
+    """
+    if database_updated_today(local_path):
+        return
+    if incremental:
+        copied = sync_local_database(network_path, local_path)
+        print(f"Synced {len(copied)} changed database files")
+    else:
         update_local_database(local_database_path=local_path,
                               network_database_path=network_path, tqdm=tqdm)
-    else:
-        last_update = DateTimeClass()
-        fid = open(last_update_date)
-        dates = fid.readline().split('.')
-        fid.close()
-        last_update.year = int(dates[0])
-        last_update.month = int(dates[1])
-        last_update.day = int(dates[2])
-        if (today - last_update).days >= 1:
-            update_local_database(local_database_path=local_path,
-                                  network_database_path=network_path, tqdm=tqdm)
 
 
 def identify_wanted_headers(patient_header_dbs: PatientHeaderDatabases,
                             wanted_roi_list: List[str], wanted_type: List[str]):
     out_header_dbs = PatientHeaderDatabases()
-    wanted_type = [i.lower() for i in wanted_type]
+    roi_classifier = ROINameClassifier(names=wanted_roi_list)
+    wanted_type = {i.lower() for i in wanted_type}
     for pat_header_db in patient_header_dbs.HeaderDatabases.values():
         out_header_db = PatientHeaderDatabase(pat_header_db.DBName)
         for pat in pat_header_db.PatientHeaders.values():
-            has_roi = False
-            for case in pat.Cases:
-                wanted_rois = [r for r in case.ROIS if r.Name.lower() in wanted_roi_list and
-                               r.Type.lower() in wanted_type]
-                if wanted_rois:
-                    has_roi = True
+            has_roi = any(r.Type.lower() in wanted_type and roi_classifier.matches(r.Name)
+                          for case in pat.Cases for r in case.ROIS)
             if has_roi:
                 out_header_db.PatientHeaders[pat.RS_UID] = pat
         out_header_dbs.HeaderDatabases[out_header_db.DBName] = out_header_db
@@ -60,20 +235,19 @@ def find_all_rois(header_databases: PatientHeaderDatabases):
         header_databases:
 
     Returns:
-
+        (counts of ROI names that are not planning helper structures,
+         counts of ROI names that look like nodes or prostate), keyed by normalized name
     """
-    all_rois = []
-    for header_database in header_databases.HeaderDatabases.values():
-        for pat in header_database.PatientHeaders.values():
-            for case in pat.Cases:
-                for roi in case.ROIS:
-                    if roi.Name.lower() not in all_rois:
-                        all_rois.append(roi.Name.lower())
-    reduced_all_rois = [i for i in all_rois if i.find('ptv') == -1 and i.find('0') == -1 and i.find('1') == -1 and i.find('opt') == -1 and i.find('2') == -1 and i.find('3') == -1 and i.find('hot') == -1 and i.find('cold') == -1 and i.find('avo') == -1 and i.find('norm') == -1 and i.find('tune') == -1 and i.find('5') == -1 and len(i) > 2 and i.find('ring') == -1 and i.find('couch') == -1 and i.find('arti') == -1 and i.find('max') == -1 and i.find('min') == -1 and i.find('4') == -1 and i.find('push') == -1 and i.find('shell') == -1 and i.find('warm') == -1]
-    wanted_rois = [i for i in all_rois if i.find('nodes') != -1 or i.find('prost') != -1]
+    all_rois = count_roi_names(roi.Name for header_database in header_databases.HeaderDatabases.values()
+                               for pat in header_database.PatientHeaders.values()
+                               for case in pat.Cases for roi in case.ROIS)
+    reduced_all_rois = ROINameClassifier(exclude_terms=HELPER_ROI_TERMS, min_length=3).select(all_rois)
+    wanted_rois = ROINameClassifier(include_terms=['nodes', 'prost']).select(all_rois)
+    return reduced_all_rois, wanted_rois
 
 
 class RegionOfInterestClass:
+    __slots__ = ('DataBase', 'MRN', 'Physician', 'ROIName', 'ROIVolume', 'ROIType', 'Case', 'Exam')
     DataBase: str
     MRN: str
     Physician: str
@@ -95,19 +269,6 @@ def find_prostate_patients():
     """
     if os.path.exists(network_path):
         update_database(network_path, local_db_path)
-    """
-    Lets first load up just the basic information from all patients in our databases
-    """
-    header_databases: PatientHeaderDatabases
-    header_databases = PatientHeaderDatabases()
-    header_databases.build_from_folder(local_db_path, specific_mrns=MRNs, tqdm=tqdm)
-    """
-    We only want patients who have had approved plans
-    """
-    header_databases.delete_unapproved_patients()
-    """
-    Based on the desired ROIs, send back a subset of patients
-    """
     roi_associations = {}
     roi_associations['prostate'] = ['prostate', 'prostate only']
     roi_associations['nodes'] = ['nodes', 'pelvic nodes', 'lymph nodes',
@@ -115,54 +276,77 @@ def find_prostate_patients():
     wanted_rois = []
     for key in roi_associations.keys():
         wanted_rois += roi_associations[key]
-    header_databases = identify_wanted_headers(header_databases,
-                                               wanted_type=['gtv', 'ctv'],
-                                               wanted_roi_list=wanted_rois)
+
+    database_key = database_fingerprint(local_db_path)
+    snapshot_folder = local_db_path + '_Snapshots'
+
+    def build_header_databases():
+        """
+        Lets first load up just the basic information from all patients in our databases
+        """
+        header_databases: PatientHeaderDatabases
+        header_databases = PatientHeaderDatabases()
+        header_databases.build_from_folder(local_db_path, specific_mrns=MRNs, tqdm=tqdm)
+        """
+        We only want patients who have had approved plans
+        """
+        header_databases.delete_unapproved_patients()
+        return header_databases
+
+    def build_patient_databases():
+        header_databases = load_or_build_snapshot(os.path.join(snapshot_folder, 'header_databases.pkl'),
+                                                  (database_key, MRNs), build_header_databases)
+        """
+        Based on the desired ROIs, send back a subset of patients
+        """
+        header_databases = identify_wanted_headers(header_databases,
+                                                   wanted_type=['gtv', 'ctv'],
+                                                   wanted_roi_list=wanted_rois)
+        """
+        Now, load up all patient info
+        Note that this includes all plans
+        """
+        databases = header_databases.return_patient_databases(tqdm)
+        databases.delete_unapproved_patients()
+        return databases
 
     """
-    Now, load up all patient info
-    Note that this includes all plans
+    Both steps only depend on the local database files and the query, so their results are
+    kept in snapshots and reused until a database file changes
     """
-    databases = header_databases.return_patient_databases(tqdm)
-    databases.delete_unapproved_patients()
-    out_rois: List[RegionOfInterestClass]
-    out_rois = []
-    mrns = []
+    databases = load_or_build_snapshot(os.path.join(snapshot_folder, 'patient_databases.pkl'),
+                                       (database_key, MRNs, wanted_rois, ['gtv', 'ctv'], NORMALIZATION_VERSION),
+                                       build_patient_databases)
+    out_rois = ColumnBuffer(RegionOfInterestClass.__slots__)
     db_list = ['10ASP1', 'Deceased', '2023', '2022', '2021', '2020', '2019', '2018',
                '2017', '2016']
-    for db_name in db_list:
-        db = databases.Databases[db_name]
-        for patient in db.Patients.values():
-            if patient.MRN in mrns:
-                continue
-            mrns.append(patient.MRN)
-            for case in patient.Cases:
-                for plan in case.TreatmentPlans:
-                    if plan.Review is not None:
-                        review: ReviewClass
-                        review = plan.Review
-                        if review.ApprovalStatus == 'Approved':
-                            exams = [e for e in case.Examinations if e.ExamName == plan.Referenced_Exam_Name]
-                            for exam in exams:
-                                for roi in exam.ROIs:
-                                    base_roi = [i for i in case.Base_ROIs if i.RS_Number == roi.RS_Number]
-                                    if not base_roi:
-                                        continue
-                                    if (roi.Name.lower() in wanted_rois or
-                                            (roi.Name.lower().find('opt') == -1 and base_roi[0].Type.lower() == 'ptv')):
-                                        new_roi = RegionOfInterestClass()
-                                        new_roi.DataBase = db_name
-                                        reviewer = review.ReviewerName
-                                        reviewer = reviewer.replace('UNCH','').replace("\\", '')
-                                        new_roi.Physician = reviewer
-                                        new_roi.MRN = patient.MRN
-                                        new_roi.Exam = exam.ExamName
-                                        new_roi.Case = case.CaseName
-                                        new_roi.ROIName = roi.Name
-                                        new_roi.ROIType = base_roi[0].Type
-                                        new_roi.ROIVolume = roi.Volume
-                                        out_rois.append(new_roi)
-    out_dataframe = return_dataframe_from_class_list(out_rois)
+    """
+    Index the databases once (MRN, RS_Number -> base ROI, exam name -> exam) and keep
+    the wanted ROIs, or PTVs that are not optimization structures, from approved plans
+    """
+    with metrics.timed('query_cohort'):
+        cohort_index = CohortIndex(databases, db_list)
+        roi_filters = [ROIFilter(names=wanted_rois),
+                       ROIFilter(types=['ptv'], exclude_terms=['opt'])]
+        for match in cohort_index.query(roi_filters, approval_status='Approved'):
+            new_roi = RegionOfInterestClass()
+            new_roi.DataBase = match.DataBase
+            reviewer = match.Review.ReviewerName
+            reviewer = reviewer.replace('UNCH','').replace("\\", '')
+            new_roi.Physician = reviewer
+            new_roi.MRN = match.Patient.MRN
+            new_roi.Exam = match.Exam.ExamName
+            new_roi.Case = match.Case.CaseName
+            new_roi.ROIName = match.ROI.Name
+            new_roi.ROIType = match.BaseROI.Type
+            new_roi.ROIVolume = match.ROI.Volume
+            out_rois.append(new_roi)
+        metrics.count('rois_selected', len(out_rois.columns['MRN']))
+    out_dataframe = out_rois.to_dataframe()
+    save_table(out_dataframe, os.path.join('.', "ProstateNodePatients.parquet"))
+    """
+    The Excel file is only an export view, used to pick the patients to export
+    """
     write_dataframe_to_excel(os.path.join('.', "ProstateNodePatients.xlsx"), out_dataframe)
 
 
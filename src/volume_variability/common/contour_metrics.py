@@ -0,0 +1,270 @@
+import os
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import SimpleITK as sitk
+from scipy import ndimage
+from src.common.mask_utils import bounding_box, mask_surface, read_mask_labels
+
+def load_mask(file_path, label=None):
+    """
+    Load a mask as a boolean array.
+    
+    Args:
+        file_path (str): Path to a mask readable by SimpleITK (.mhd, .nii.gz, .nrrd).
+        label (int): Keep only voxels with this value (multi-label masks). None keeps all
+            non-zero voxels.
+    
+    Returns:
+        tuple: (np.array: boolean mask ordered (z, y, x), tuple: spacing in (x, y, z) order).
+    """
+    image = sitk.ReadImage(file_path)
+    array = sitk.GetArrayViewFromImage(image)
+    mask = array == label if label is not None else array > 0
+    return mask, image.GetSpacing()
+
+def surface_distances(reference, test, spacing):
+    """
+    Distances in mm from every surface voxel of one mask to the surface of the other.
+    
+    Each direction is a single Euclidean distance transform of the other surface, computed
+    on the box around both masks only.
+    
+    Args:
+        reference (np.array): Boolean mask ordered (z, y, x).
+        test (np.array): Boolean mask on the same grid.
+        spacing (tuple): Voxel spacing in (x, y, z) order.
+    
+    Returns:
+        tuple: (distances from test to reference surface, distances from reference to test
+            surface), both 1D float arrays. Empty if either mask is empty.
+    """
+    box = bounding_box(reference, test)
+    if box is None or not reference.any() or not test.any():
+        return np.empty(0), np.empty(0)
+    reference_surface = mask_surface(reference[box])
+    test_surface = mask_surface(test[box])
+    sampling = tuple(spacing)[::-1]
+    # distance_transform_edt measures the distance to the nearest zero, so invert the surfaces
+    to_reference = ndimage.distance_transform_edt(~reference_surface, sampling=sampling)
+    to_test = ndimage.distance_transform_edt(~test_surface, sampling=sampling)
+    return to_reference[test_surface], to_test[reference_surface]
+
+def compare_masks(reference, test, spacing, tolerance=1.0):
+    """
+    Volume and agreement metrics between two masks.
+    
+    Surface Dice is the fraction of surface voxels of both masks lying within tolerance of
+    the other surface (voxel counts, not surface areas).
+    
+    Args:
+        reference (np.array): Boolean mask ordered (z, y, x).
+        test (np.array): Boolean mask on the same grid.
+        spacing (tuple): Voxel spacing in (x, y, z) order.
+        tolerance (float): Surface Dice tolerance in mm.
+    
+    Returns:
+        dict: 'reference_volume_cc', 'test_volume_cc', 'dice', 'surface_dice',
+            'hausdorff_mm', 'hd95_mm' and 'mean_surface_distance_mm'. Distance metrics are
+            NaN when either mask is empty.
+    """
+    if reference.shape != test.shape:
+        raise ValueError(f"Mask shapes differ: {reference.shape} and {test.shape}")
+    voxel_cc = float(np.prod(spacing)) / 1000
+    reference_voxels = int(np.count_nonzero(reference))
+    test_voxels = int(np.count_nonzero(test))
+    box = bounding_box(reference, test)
+    overlap = int(np.count_nonzero(reference[box] & test[box])) if box is not None else 0
+    total = reference_voxels + test_voxels
+    results = {
+        'reference_volume_cc': reference_voxels * voxel_cc,
+        'test_volume_cc': test_voxels * voxel_cc,
+        'dice': 2 * overlap / total if total else 1.0,
+        'surface_dice': np.nan,
+        'hausdorff_mm': np.nan,
+        'hd95_mm': np.nan,
+        'mean_surface_distance_mm': np.nan
+    }
+    to_reference, to_test = surface_distances(reference, test, spacing)
+    if to_reference.size and to_test.size:
+        results['surface_dice'] = float((np.count_nonzero(to_reference <= tolerance) +
+                                         np.count_nonzero(to_test <= tolerance)) /
+                                        (to_reference.size + to_test.size))
+        results['hausdorff_mm'] = float(max(to_reference.max(), to_test.max()))
+        results['hd95_mm'] = float(max(np.percentile(to_reference, 95), np.percentile(to_test, 95)))
+        results['mean_surface_distance_mm'] = float((to_reference.sum() + to_test.sum()) /
+                                                    (to_reference.size + to_test.size))
+    return results
+
+def compare_mask_files(reference_path, test_path, reference_label=None, test_label=None, tolerance=1.0):
+    """
+    compare_masks for two mask files on the same grid.
+    
+    Args:
+        reference_path (str): Reference mask file.
+        test_path (str): Test mask file.
+        reference_label (int): Label of the reference ROI in a multi-label mask.
+        test_label (int): Label of the test ROI in a multi-label mask.
+        tolerance (float): Surface Dice tolerance in mm.
+    
+    Returns:
+        dict: compare_masks results plus 'reference' and 'test' paths.
+    """
+    reference, spacing = load_mask(reference_path, reference_label)
+    test, test_spacing = load_mask(test_path, test_label)
+    if not np.allclose(spacing, test_spacing):
+        raise ValueError(f"{test_path} is not on the same grid as {reference_path}")
+    results = {'reference': reference_path, 'test': test_path}
+    results.update(compare_masks(reference, test, spacing, tolerance))
+    return results
+
+def crop_mask(mask):
+    """
+    Crop a mask to its bounding box.
+    
+    Args:
+        mask (np.array): Boolean mask.
+    
+    Returns:
+        tuple: (tuple: slices of the box in the full grid, None if the mask is empty,
+            np.array: copy of the mask inside the box).
+    """
+    box = bounding_box(mask, margin=0)
+    if box is None:
+        return None, np.zeros((0,) * mask.ndim, dtype=bool)
+    return box, mask[box].copy()
+
+def load_folder_masks(folder, roi_names=None):
+    """
+    Load the ROI masks of a patient folder, each cropped to its bounding box.
+    
+    The ROIs are the <ROI name>.mhd files exported from RayStation or, in a folder
+    without them, the labels of a multi-label Mask.nii.gz named in Mask_Labels.json
+    (DicomToNifti with multi_label). Only one full-grid mask is held at a time.
+    
+    Args:
+        folder (str): Patient folder.
+        roi_names (list): Only load these ROIs (case-insensitive). None loads all.
+    
+    Returns:
+        tuple: (dict: {ROI name: crop_mask result}, tuple: spacing in (x, y, z) order).
+    """
+    wanted = {name.lower() for name in roi_names} if roi_names is not None else None
+    masks = {}
+    spacing = None
+    for file in sorted(os.listdir(folder)):
+        name, extension = os.path.splitext(file)
+        if extension.lower() != '.mhd' or (wanted is not None and name.lower() not in wanted):
+            continue
+        mask, spacing = load_mask(os.path.join(folder, file))
+        masks[name] = crop_mask(mask)
+    labels = read_mask_labels(folder)
+    mask_path = os.path.join(folder, 'Mask.nii.gz')
+    if not masks and labels and os.path.exists(mask_path):
+        image = sitk.ReadImage(mask_path)
+        label_map = sitk.GetArrayViewFromImage(image)
+        spacing = image.GetSpacing()
+        for name, label in labels.items():
+            if wanted is None or name.lower() in wanted:
+                masks[name] = crop_mask(label_map == label)
+    return masks, spacing
+
+def _on_common_box(first, second):
+    # Paste two cropped masks into the box holding both
+    boxes = [box for box, _ in (first, second) if box is not None]
+    if not boxes:
+        return np.zeros((1, 1, 1), dtype=bool), np.zeros((1, 1, 1), dtype=bool)
+    starts = [min(box[axis].start for box in boxes) for axis in range(len(boxes[0]))]
+    stops = [max(box[axis].stop for box in boxes) for axis in range(len(boxes[0]))]
+    arrays = []
+    for box, crop in (first, second):
+        array = np.zeros([stop - start for start, stop in zip(starts, stops)], dtype=bool)
+        if box is not None:
+            array[tuple(slice(i.start - start, i.stop - start) for i, start in zip(box, starts))] = crop
+        arrays.append(array)
+    return arrays[0], arrays[1]
+
+def compare_folder(folder, roi_names=None, tolerance=1.0):
+    """
+    Compare every pair of ROI masks of a folder (see load_folder_masks).
+    
+    Each mask is read once and kept cropped to its own bounding box, so memory grows with
+    the size of the ROIs rather than with the CT grid. Every pair is compared on the box
+    holding both masks.
+    
+    Args:
+        folder (str): Patient folder holding one <ROI name>.mhd per ROI, or a multi-label
+            Mask.nii.gz with Mask_Labels.json.
+        roi_names (list): Only compare these ROIs (case-insensitive). None compares all.
+        tolerance (float): Surface Dice tolerance in mm.
+    
+    Returns:
+        list: One dict per pair with 'folder', 'reference_roi', 'test_roi' and the
+            compare_masks results.
+    """
+    masks, spacing = load_folder_masks(folder, roi_names)
+    rows = []
+    for reference_roi, test_roi in itertools.combinations(masks, 2):
+        row = {'folder': folder, 'reference_roi': reference_roi, 'test_roi': test_roi}
+        row.update(compare_masks(*_on_common_box(masks[reference_roi], masks[test_roi]), spacing, tolerance))
+        rows.append(row)
+    return rows
+
+def _compare_folder_safe(folder, roi_names, tolerance):
+    try:
+        return compare_folder(folder, roi_names, tolerance)
+    except Exception as e:
+        return [{'folder': folder, 'error': repr(e)}]
+
+def _compare_pair_safe(pair, tolerance):
+    try:
+        return compare_mask_files(*pair, tolerance=tolerance)
+    except Exception as e:
+        return {'reference': pair[0], 'test': pair[1], 'error': repr(e)}
+
+def compare_cohort(folders, roi_names=None, tolerance=1.0, max_workers=None):
+    """
+    Run compare_folder over many patient folders in a process pool.
+    
+    A folder that fails is reported with an 'error' column instead of stopping the run.
+    
+    Args:
+        folders (list): Patient folders.
+        roi_names (list): Only compare these ROIs. None compares all.
+        tolerance (float): Surface Dice tolerance in mm.
+        max_workers (int): Number of worker processes.
+    
+    Returns:
+        pd.DataFrame: One row per ROI pair.
+    """
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(_compare_folder_safe, folders, itertools.repeat(roi_names),
+                               itertools.repeat(tolerance))
+        return pd.DataFrame([row for rows in results for row in rows])
+
+def compare_pairs(pairs, tolerance=1.0, max_workers=None, chunksize=16):
+    """
+    Run compare_mask_files over explicit (reference path, test path) pairs in a process pool.
+    
+    Args:
+        pairs (list): (reference path, test path) tuples, e.g. the same ROI contoured by
+            two physicians.
+        tolerance (float): Surface Dice tolerance in mm.
+        max_workers (int): Number of worker processes.
+        chunksize (int): Pairs sent to a worker at a time.
+    
+    Returns:
+        pd.DataFrame: One row per pair.
+    """
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return pd.DataFrame(list(executor.map(_compare_pair_safe, pairs, itertools.repeat(tolerance),
+                                              chunksize=chunksize)))
+
+# Example usage
+if __name__ == "__main__":
+    base_path = r'\\vscifs1\PhysicsQAdata\BMA\Prostate_Nodes'
+    patient_folders = [os.path.join(base_path, i) for i in os.listdir(base_path)
+                       if os.path.isdir(os.path.join(base_path, i))]
+    metrics = compare_cohort(patient_folders, max_workers=4)
+    print(metrics.describe())
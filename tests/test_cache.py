@@ -0,0 +1,71 @@
+import os
+import numpy as np
+import pandas as pd
+import nibabel as nib
+from src.common.cache import VolumeCache
+from src.common.data_loader import load_many, LoadReport, LazyData, prefetch_data, load_data
+
+def write_nifti(path, value):
+    nib.save(nib.Nifti1Image(np.full((4, 5, 6), value, dtype=np.float32), np.eye(4)), path)
+
+def nib_load(path):
+    image = nib.load(path)
+    return np.asarray(image.dataobj), dict(image.header)
+
+def test_uncacheable_results_are_not_misses(tmp_path):
+    cache = VolumeCache(str(tmp_path / 'cache'))
+    excel_path = str(tmp_path / 'clinical.xlsx')
+    pd.DataFrame({'a': [1, 2]}).to_excel(excel_path, index=False)
+    load_data(excel_path, cache)
+    load_data(excel_path, cache)
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['uncacheable']) == (0, 0, 2)
+
+def test_worker_counts_reach_the_parent_cache(tmp_path):
+    cache = VolumeCache(str(tmp_path / 'cache'))
+    paths = []
+    for i in range(3):
+        paths.append(str(tmp_path / f'image{i}.nii'))
+        write_nifti(paths[-1], i)
+    report = LoadReport()
+    assert len(list(load_many(paths, max_workers=2, report=report, cache=cache))) == 3
+    assert (cache.hits, cache.misses) == (0, 3)
+    list(load_many(paths, max_workers=2, report=report, cache=cache))
+    assert (cache.hits, cache.misses) == (3, 3)
+    
+    handles = [LazyData(load_data, path, cache, cache=cache) for path in paths]
+    prefetch_data({'patient': dict(enumerate(handles))}, max_workers=2, use_processes=True)
+    for i, handle in enumerate(handles):
+        image, _ = handle.get()
+        assert np.all(image == i)
+    assert (cache.hits, cache.misses) == (6, 3)
+
+def test_load_many_returns_cached_volumes_as_memory_maps(tmp_path):
+    cache = VolumeCache(str(tmp_path / 'cache'))
+    path = str(tmp_path / 'image.nii')
+    write_nifti(path, 7)
+    for _ in range(2):
+        [(item, (image, _))] = load_many([path], max_workers=1, report=LoadReport(), cache=cache)
+        assert item == path
+        assert isinstance(image, np.memmap)
+        assert np.all(image == 7)
+
+def test_key_changes_when_an_input_file_changes(tmp_path):
+    cache = VolumeCache(str(tmp_path / 'cache'))
+    path = str(tmp_path / 'image.nii')
+    write_nifti(path, 1)
+    key = cache.key(load_data, path)
+    assert cache.key(load_data, path) == key
+    assert cache.key(load_data, [path]) == key
+    assert cache.key(load_data, path, window=1) != key
+    image, _ = cache.load(nib_load, path)
+    assert np.all(image == 1)
+    
+    write_nifti(path, 2)
+    stat = os.stat(path)
+    # Same size, so only the modification time tells the files apart
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert cache.key(load_data, path) != key
+    image, _ = cache.load(nib_load, path)
+    assert np.all(image == 2)
+    assert (cache.hits, cache.misses) == (0, 2)
@@ -0,0 +1,104 @@
+import random
+from types import SimpleNamespace
+import pytest
+from src.nodal_coverage.prostate.src.CohortQuery import CohortIndex, ROIFilter
+
+def make_patient(mrn, rois, approval_status='Approved'):
+    """
+    One case with one exam and one reviewed plan; rois is a list of (name, type).
+    """
+    base_rois = [SimpleNamespace(RS_Number=i, Type=roi_type) for i, (_, roi_type) in enumerate(rois)]
+    exam = SimpleNamespace(ExamName='CT 1', ROIs=[SimpleNamespace(Name=name, RS_Number=i, Volume=float(i))
+                                                  for i, (name, _) in enumerate(rois)])
+    plan = SimpleNamespace(Referenced_Exam_Name='CT 1', Review=SimpleNamespace(ApprovalStatus=approval_status))
+    case = SimpleNamespace(CaseName='Case 1', Base_ROIs=base_rois, Examinations=[exam], TreatmentPlans=[plan])
+    return SimpleNamespace(MRN=mrn, Cases=[case])
+
+def make_databases(patients_by_db):
+    return SimpleNamespace(Databases={db_name: SimpleNamespace(Patients={p.MRN: p for p in patients})
+                                      for db_name, patients in patients_by_db.items()})
+
+def test_unknown_database_raises():
+    databases = make_databases({'2023': [make_patient('1', [('Prostate', 'CTV')])]})
+    with pytest.raises(KeyError):
+        CohortIndex(databases, ['2023', '2022'])
+
+def test_names_match_ignoring_case_and_whitespace():
+    databases = make_databases({'2023': [make_patient('1', [('Pelvic  Nodes ', 'CTV')]),
+                                         make_patient('2', [('pelvicnodes2', 'CTV')])]})
+    matches = list(CohortIndex(databases).query([ROIFilter(names=['pelvic nodes'])]))
+    assert [(m.Patient.MRN, m.ROI.Name) for m in matches] == [('1', 'Pelvic  Nodes ')]
+
+def baseline_query(databases, db_list, wanted_rois):
+    """
+    The nested-scan loop find_prostate_patients used before CohortIndex.
+    """
+    out_rois = []
+    mrns = []
+    for db_name in db_list:
+        db = databases.Databases[db_name]
+        for patient in db.Patients.values():
+            if patient.MRN in mrns:
+                continue
+            mrns.append(patient.MRN)
+            for case in patient.Cases:
+                for plan in case.TreatmentPlans:
+                    if plan.Review is not None:
+                        review = plan.Review
+                        if review.ApprovalStatus == 'Approved':
+                            exams = [e for e in case.Examinations if e.ExamName == plan.Referenced_Exam_Name]
+                            for exam in exams:
+                                for roi in exam.ROIs:
+                                    base_roi = [i for i in case.Base_ROIs if i.RS_Number == roi.RS_Number]
+                                    if not base_roi:
+                                        continue
+                                    if (roi.Name.lower() in wanted_rois or
+                                            (roi.Name.lower().find('opt') == -1 and base_roi[0].Type.lower() == 'ptv')):
+                                        out_rois.append((db_name, patient.MRN, case.CaseName, exam.ExamName,
+                                                         roi.Name, base_roi[0].Type, roi.Volume))
+    return out_rois
+
+def make_cohort(seed=0, n_databases=4, n_patients=60):
+    rng = random.Random(seed)
+    roi_choices = [('Prostate', 'CTV'), ('prostate only', 'CTV'), ('Pelvic Nodes', 'CTV'), ('nodes', 'GTV'),
+                   ('PTV_70', 'PTV'), ('PTV opt', 'PTV'), ('Bladder', 'Organ'), ('Rectum', 'Organ')]
+    patients_by_db = {}
+    for db_index in range(n_databases):
+        patients = []
+        for _ in range(n_patients):
+            mrn = str(rng.randrange(n_patients * 2))
+            cases = []
+            for case_index in range(rng.randint(1, 2)):
+                exams = []
+                base_rois = []
+                for exam_index in range(rng.randint(1, 2)):
+                    rois = []
+                    for rs_number, (name, roi_type) in enumerate(rng.sample(roi_choices, 4)):
+                        rs_number += 10 * exam_index
+                        rois.append(SimpleNamespace(Name=name, RS_Number=rs_number, Volume=rng.random()))
+                        # Some exam ROIs have no base ROI
+                        if rng.random() > 0.1:
+                            base_rois.append(SimpleNamespace(RS_Number=rs_number, Type=roi_type))
+                    exams.append(SimpleNamespace(ExamName=f'CT {exam_index}', ROIs=rois))
+                plans = []
+                for _ in range(rng.randint(0, 3)):
+                    review = rng.choice([None, SimpleNamespace(ApprovalStatus='Approved'),
+                                         SimpleNamespace(ApprovalStatus='UnApproved')])
+                    plans.append(SimpleNamespace(Referenced_Exam_Name=f'CT {rng.randint(0, 2)}', Review=review))
+                cases.append(SimpleNamespace(CaseName=f'Case {case_index}', Base_ROIs=base_rois,
+                                             Examinations=exams, TreatmentPlans=plans))
+            patients.append(SimpleNamespace(MRN=mrn, Cases=cases))
+        patients_by_db[f'db{db_index}'] = patients
+    return make_databases(patients_by_db)
+
+@pytest.mark.parametrize('seed', range(5))
+def test_query_matches_the_baseline_loop(seed):
+    databases = make_cohort(seed)
+    db_list = ['db2', 'db0', 'db3', 'db1']
+    wanted_rois = ['prostate', 'prostate only', 'nodes', 'pelvic nodes', 'lymph nodes']
+    expected = baseline_query(databases, db_list, wanted_rois)
+    filters = [ROIFilter(names=wanted_rois), ROIFilter(types=['ptv'], exclude_terms=['opt'])]
+    found = [(m.DataBase, m.Patient.MRN, m.Case.CaseName, m.Exam.ExamName, m.ROI.Name, m.BaseROI.Type, m.ROI.Volume)
+             for m in CohortIndex(databases, db_list).query(filters, approval_status='Approved')]
+    assert expected
+    assert found == expected
@@ -0,0 +1,52 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src', 'nodal_coverage', 'prostate', 'src'))
+from src.nodal_coverage.prostate.src.PreProcessing import sync_local_database, update_database
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as fid:
+        fid.write(content)
+
+def read(path):
+    with open(path) as fid:
+        return fid.read()
+
+def make_share(share):
+    write(os.path.join(share, '2023', 'patient1.json'), 'one')
+    write(os.path.join(share, '2023', 'patient2.json'), 'two')
+    write(os.path.join(share, '2022', 'patient3.json'), 'three')
+
+def test_sync_mirrors_the_share(tmp_path):
+    share, local = str(tmp_path / 'share'), str(tmp_path / 'local')
+    make_share(share)
+    assert len(sync_local_database(share, local)) == 3
+    assert sync_local_database(share, local) == []
+    
+    # Changed and new files on the share, a deleted and a modified local copy
+    write(os.path.join(share, '2023', 'patient1.json'), 'one, edited')
+    write(os.path.join(share, '2021', 'patient4.json'), 'four')
+    os.remove(os.path.join(local, '2023', 'patient2.json'))
+    write(os.path.join(local, '2022', 'patient3.json'), 'thr')
+    copied = sync_local_database(share, local)
+    assert sorted(copied) == sorted(os.path.join(*i) for i in [('2023', 'patient1.json'), ('2021', 'patient4.json'),
+                                                               ('2023', 'patient2.json'), ('2022', 'patient3.json')])
+    for root, directories, files in os.walk(share):
+        for file in files:
+            source = os.path.join(root, file)
+            assert read(source) == read(os.path.join(local, os.path.relpath(source, share)))
+    
+    os.remove(os.path.join(share, '2021', 'patient4.json'))
+    sync_local_database(share, local, delete_removed=True)
+    assert not os.path.exists(os.path.join(local, '2021', 'patient4.json'))
+
+def test_update_runs_once_a_day(tmp_path):
+    share, local = str(tmp_path / 'share'), str(tmp_path / 'local')
+    make_share(share)
+    update_database(share, local)
+    write(os.path.join(share, '2021', 'patient4.json'), 'four')
+    update_database(share, local)
+    assert not os.path.exists(os.path.join(local, '2021', 'patient4.json'))
+    write(os.path.join(local, 'Last_Updated.txt'), '2020.1.1')
+    update_database(share, local)
+    assert os.path.exists(os.path.join(local, '2021', 'patient4.json'))
@@ -0,0 +1,78 @@
+import os
+import time
+from types import SimpleNamespace
+from src.common.utils import load_json, save_json
+from src.nodal_coverage.prostate.src.ExportFromRS import ExportJobQueue
+
+class LocalExportStandIn:
+    """
+    Stand-in for ExportBaseClass that writes marker files to a local folder.
+    
+    Args:
+        failures (int): Number of exports that raise before exports start succeeding.
+        seconds (float): Simulated duration of every export.
+    """
+    def __init__(self, failures=0, seconds=0.0):
+        self.export_path = None
+        self.RSPatient = None
+        self.failures = failures
+        self.seconds = seconds
+        self.exported = []
+    
+    def set_export_path(self, export_path):
+        self.export_path = export_path
+    
+    def set_patient(self, patient):
+        self.RSPatient = patient
+    
+    def export_examinations_and_structures(self, patient):
+        time.sleep(self.seconds)
+        if self.failures > 0:
+            self.failures -= 1
+            raise IOError(f"Simulated export failure for {patient.RS_UID}")
+        os.makedirs(os.path.join(self.export_path, patient.RS_UID), exist_ok=True)
+        open(os.path.join(self.export_path, patient.RS_UID, 'exam.dcm'), 'w').close()
+    
+    def export_rois_as_meta_images(self, patient):
+        open(os.path.join(self.export_path, patient.RS_UID, 'rois.mhd'), 'w').close()
+        self.exported.append(patient.RS_UID)
+
+def make_patient(mrn):
+    return SimpleNamespace(MRN=mrn, RS_UID=f"uid{mrn}")
+
+def test_failed_exports_are_retried_and_durations_summed(tmp_path):
+    exporter = LocalExportStandIn(failures=2, seconds=0.05)
+    queue = ExportJobQueue(str(tmp_path / 'jobs.json'), lambda: exporter, str(tmp_path / 'export'),
+                           max_attempts=3, backoff_seconds=0)
+    queue.add(make_patient('1'))
+    assert queue.run() == {'done': 1}
+    job = load_json(str(tmp_path / 'jobs.json'))['uid1']
+    assert (job['status'], job['attempts'], job['error']) == ('done', 3, None)
+    assert job['duration'] >= 3 * 0.05
+
+def test_jobs_give_up_after_max_attempts(tmp_path):
+    queue = ExportJobQueue(str(tmp_path / 'jobs.json'), lambda: LocalExportStandIn(failures=5),
+                           str(tmp_path / 'export'), max_attempts=2, backoff_seconds=0)
+    queue.add(make_patient('1'))
+    assert queue.run() == {'failed': 1}
+    assert queue.run(retry_failed=True) == {'failed': 1}
+    assert queue.state['uid1']['attempts'] == 2
+
+def test_interrupted_run_resumes(tmp_path):
+    state_path = str(tmp_path / 'jobs.json')
+    export_path = str(tmp_path / 'export')
+    # A previous run died while exporting patient 2, after finishing patient 1
+    save_json({'uid1': {'MRN': '1', 'status': 'done', 'attempts': 1, 'error': None, 'duration': 1.0},
+               'uid2': {'MRN': '2', 'status': 'running', 'attempts': 1, 'error': None, 'duration': None}},
+              state_path)
+    # Patient 3 was exported before the queue existed
+    os.makedirs(os.path.join(export_path, 'uid3'))
+    for file in ('exam.dcm', 'rois.mhd'):
+        open(os.path.join(export_path, 'uid3', file), 'w').close()
+    exporter = LocalExportStandIn()
+    queue = ExportJobQueue(state_path, lambda: exporter, export_path, backoff_seconds=0)
+    for mrn in ('1', '2', '3', '4'):
+        queue.add(make_patient(mrn))
+    assert queue.run() == {'done': 4}
+    assert exporter.exported == ['uid2', 'uid4']
+    assert load_json(state_path)['uid2']['attempts'] == 2
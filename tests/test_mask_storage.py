@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+import SimpleITK as sitk
+from src.common.mask_storage import save_masks, load_masks, load_rtmask, read_mask_header, save_sitk_masks, load_masks_sitk
+
+METADATA = {'shape': [12, 20, 16], 'spacing': [0.9, 0.9, 2.5], 'origin': [-10.0, 5.0, 0.0],
+            'direction': [1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0]}
+
+def make_masks():
+    rng = np.random.default_rng(0)
+    prostate = np.zeros(METADATA['shape'], dtype=bool)
+    prostate[3:9, 5:15, 4:12] = rng.random((6, 10, 8)) > 0.3
+    nodes = np.zeros(METADATA['shape'], dtype=bool)
+    nodes[6:11, 2:18, 2:14] = True
+    empty = np.zeros(METADATA['shape'], dtype=bool)
+    return {'Prostate': prostate, 'Nodes': nodes, 'Empty': empty}
+
+@pytest.mark.parametrize('compress', [True, False])
+def test_masks_round_trip(tmp_path, compress):
+    file_path = str(tmp_path / 'Mask.rtmask')
+    masks = make_masks()
+    save_masks(file_path, masks, METADATA, compress=compress)
+    loaded, header = load_masks(file_path)
+    assert list(loaded) == list(masks)
+    for name, mask in masks.items():
+        assert loaded[name].dtype == bool
+        assert np.array_equal(loaded[name], mask)
+    assert header['spacing'] == METADATA['spacing']
+    assert read_mask_header(file_path)['rois'][2]['box'] is None
+    
+    subset, _ = load_masks(file_path, names=['Nodes'])
+    assert list(subset) == ['Nodes']
+    with pytest.raises(KeyError):
+        load_masks(file_path, names=['Bladder'])
+
+def test_label_map_puts_later_rois_on_top(tmp_path):
+    file_path = str(tmp_path / 'Mask.rtmask')
+    masks = make_masks()
+    save_masks(file_path, masks, METADATA)
+    label_map, header = load_rtmask(file_path)
+    assert header['labels'] == {1: 'Prostate', 2: 'Nodes', 3: 'Empty'}
+    expected = np.zeros(METADATA['shape'], dtype=np.uint8)
+    expected[masks['Prostate']] = 1
+    expected[masks['Nodes']] = 2
+    assert np.array_equal(label_map, expected)
+
+def test_sitk_masks_round_trip(tmp_path):
+    file_path = str(tmp_path / 'Mask.rtmask')
+    images = {}
+    for name, mask in make_masks().items():
+        image = sitk.GetImageFromArray(mask.astype(np.uint8))
+        image.SetSpacing(METADATA['spacing'])
+        image.SetOrigin(METADATA['origin'])
+        images[name] = image
+    save_sitk_masks(file_path, images)
+    for name, image in load_masks_sitk(file_path).items():
+        assert image.GetSpacing() == pytest.approx(images[name].GetSpacing())
+        assert image.GetOrigin() == pytest.approx(images[name].GetOrigin())
+        assert np.array_equal(sitk.GetArrayFromImage(image), sitk.GetArrayFromImage(images[name]))
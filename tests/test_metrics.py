@@ -0,0 +1,31 @@
+import json
+import logging
+import numpy as np
+from src.common import metrics
+from src.common.preprocessing import preprocess_image_data
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+    
+    def emit(self, record):
+        self.records.append(record)
+
+def test_events_go_to_the_metrics_file_only(tmp_path):
+    events_path = str(tmp_path / 'events.jsonl')
+    root_handler = ListHandler()
+    logging.getLogger().addHandler(root_handler)
+    metrics.enable_metrics(events_path)
+    try:
+        images = (np.random.rand(32, 32) for _ in range(3))
+        assert preprocess_image_data(images, target_size=(16, 16)).shape == (3, 16, 16)
+    finally:
+        metrics.disable_metrics()
+        metrics.reset_metrics()
+        logging.getLogger().removeHandler(root_handler)
+    with open(events_path) as events_file:
+        events = [json.loads(line) for line in events_file]
+    [event] = [e for e in events if e.get('name') == 'preprocess_image_data']
+    assert event['n_images'] == 3
+    assert root_handler.records == []
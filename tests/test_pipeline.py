@@ -0,0 +1,16 @@
+import pytest
+from src.common.pipeline import StreamPipeline
+
+def test_flush_failure_is_raised_to_the_consumer():
+    def flush():
+        raise RuntimeError("flush failed")
+    
+    pipeline = StreamPipeline(range(5))
+    pipeline.add_stage('double', lambda item: [item * 2], flush=flush)
+    with pytest.raises(RuntimeError, match="flush failed"):
+        list(pipeline)
+
+def test_flush_outputs_follow_the_stream():
+    pipeline = StreamPipeline(range(3))
+    pipeline.add_stage('double', lambda item: [item * 2], flush=lambda: ['end'])
+    assert list(pipeline) == [0, 2, 4, 'end']
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+from src.common.utils import load_table
+from src.common.preprocessing import (resample_volume, preprocess_clinical_data, fit_clinical_statistics,
+                                      preprocess_clinical_data_streaming)
+
+def test_resample_bool_mask():
+    mask = np.zeros((10, 20, 20), dtype=bool)
+    mask[2:8, 5:15, 5:15] = True
+    resampled = resample_volume(mask, (2.0, 2.0, 2.0), spacing=(1.0, 1.0, 2.0), is_mask=True)
+    assert resampled.dtype == bool
+    assert resampled.shape == (10, 10, 10)
+    assert resampled.sum() == 6 * 5 * 5
+
+def make_clinical_table(rows=53):
+    rng = np.random.default_rng(0)
+    table = pd.DataFrame({
+        'age': rng.normal(65, 8, rows),
+        'psa': rng.lognormal(1, 1, rows),
+        'stage': rng.choice(['T1', 'T2', 'T3'], rows),
+        'gleason': rng.integers(6, 10, rows).astype(float)
+    })
+    table.loc[rng.choice(rows, 9, replace=False), 'age'] = np.nan
+    # Missing for the whole first chunk, so only later chunks decide its type
+    table.loc[:9, 'psa'] = np.nan
+    return table
+
+def test_streaming_statistics_match_in_memory(tmp_path):
+    table = make_clinical_table()
+    expected = preprocess_clinical_data(table)
+    statistics = fit_clinical_statistics(table, chunksize=10)
+    assert statistics['columns'] == ['age', 'psa', 'gleason']
+    assert statistics['rows'] == len(table)
+    
+    source_path = str(tmp_path / 'clinical.csv')
+    table.to_csv(source_path, index=False)
+    for output_name in ('out.parquet', 'out.csv'):
+        output_path = str(tmp_path / output_name)
+        preprocess_clinical_data_streaming(source_path, output_path, str(tmp_path / f'{output_name}.json'),
+                                           chunksize=10)
+        result = load_table(output_path)
+        assert list(result.columns) == list(table.columns)
+        assert (result['stage'] == table['stage']).all()
+        for column in statistics['columns']:
+            np.testing.assert_allclose(result[column], expected[column], rtol=1e-5, atol=1e-5)
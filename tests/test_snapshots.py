@@ -0,0 +1,28 @@
+import os
+import sys
+import threading
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src', 'nodal_coverage', 'prostate', 'src'))
+import src.nodal_coverage.prostate.src.PreProcessing as PreProcessing
+
+def test_snapshot_is_reused_until_the_key_or_version_changes(tmp_path, monkeypatch):
+    snapshot_path = str(tmp_path / 'snapshot.pkl')
+    builds = []
+    
+    def build():
+        builds.append(1)
+        return {'patients': len(builds)}
+    
+    assert PreProcessing.load_or_build_snapshot(snapshot_path, ('db', 1), build) == {'patients': 1}
+    assert PreProcessing.load_or_build_snapshot(snapshot_path, ('db', 1), build) == {'patients': 1}
+    assert PreProcessing.load_or_build_snapshot(snapshot_path, ('db', 2), build) == {'patients': 2}
+    monkeypatch.setattr(PreProcessing, 'SNAPSHOT_VERSION', PreProcessing.SNAPSHOT_VERSION + 1)
+    assert PreProcessing.load_or_build_snapshot(snapshot_path, ('db', 2), build) == {'patients': 3}
+
+def test_unreadable_snapshot_is_deleted(tmp_path):
+    snapshot_path = str(tmp_path / 'snapshot.pkl')
+    with open(snapshot_path, 'wb') as fid:
+        fid.write(b'not a pickle')
+    # A result that cannot be pickled leaves no snapshot behind
+    lock = threading.Lock()
+    assert PreProcessing.load_or_build_snapshot(snapshot_path, 'key', lambda: lock) is lock
+    assert os.listdir(tmp_path) == []
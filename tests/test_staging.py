@@ -0,0 +1,51 @@
+import os
+from src.common.staging import FolderStager
+
+def make_folders(share, n=4, files=3, size=1000):
+    folders = []
+    for i in range(n):
+        folder = os.path.join(share, f'patient{i}')
+        os.makedirs(os.path.join(folder, 'sub'))
+        for j in range(files):
+            with open(os.path.join(folder, 'sub' if j == 0 else '', f'file{j}.dcm'), 'wb') as fid:
+                fid.write(os.urandom(size))
+        folders.append(folder)
+    return folders
+
+def read(path):
+    with open(path, 'rb') as fid:
+        return fid.read()
+
+def test_released_folders_leave_scratch(tmp_path):
+    folders = make_folders(str(tmp_path / 'share'))
+    scratch = str(tmp_path / 'scratch')
+    with FolderStager(scratch, read_ahead=2, max_bytes=5000) as stager:
+        staged_sources = []
+        for staged in stager.stage(folders):
+            assert staged.error is None
+            assert read(os.path.join(staged.path, 'sub', 'file0.dcm')) == read(os.path.join(staged.source, 'sub', 'file0.dcm'))
+            assert staged.size == 3000
+            assert stager.staged_bytes <= 5000
+            staged_sources.append(staged.source)
+            stager.release(staged)
+            assert not os.path.exists(staged.path)
+        assert staged_sources == folders
+        assert stager.staged_bytes == 0
+    assert os.listdir(scratch) == []
+
+def test_close_removes_unreleased_folders(tmp_path):
+    folders = make_folders(str(tmp_path / 'share'))
+    scratch = str(tmp_path / 'scratch')
+    with FolderStager(scratch, read_ahead=2) as stager:
+        staged = next(stager.stage(folders))
+        assert os.path.exists(staged.path)
+    assert os.listdir(scratch) == []
+
+def test_missing_folders_are_reported(tmp_path):
+    folders = make_folders(str(tmp_path / 'share'), n=2)
+    missing = str(tmp_path / 'share' / 'missing')
+    with FolderStager(str(tmp_path / 'scratch')) as stager:
+        results = list(stager.stage([folders[0], missing, (folders[1], ['file1.dcm'])]))
+        assert [i.source for i in results] == [folders[0], missing, folders[1]]
+        assert results[1].path is None and isinstance(results[1].error, FileNotFoundError)
+        assert os.listdir(results[2].path) == ['file1.dcm']
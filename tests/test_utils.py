@@ -0,0 +1,32 @@
+import os
+import pytest
+from src.common.utils import atomic_write, is_temp_file, files_fingerprint, save_json, load_json
+
+def test_atomic_write_replaces_on_success(tmp_path):
+    file_path = str(tmp_path / 'data.json')
+    save_json({'a': 1}, file_path, atomic=True)
+    assert load_json(file_path) == {'a': 1}
+    assert os.listdir(tmp_path) == ['data.json']
+
+def test_atomic_write_removes_temp_file_on_failure(tmp_path):
+    file_path = str(tmp_path / 'Image.nii.gz')
+    with pytest.raises(RuntimeError):
+        with atomic_write(file_path, keep_extension=True) as temp_path:
+            assert temp_path.endswith('.nii.gz') and is_temp_file(temp_path)
+            open(temp_path, 'w').close()
+            raise RuntimeError
+    assert os.listdir(tmp_path) == []
+
+def test_files_fingerprint_changes_with_content_not_location(tmp_path):
+    for folder in ('a', 'b'):
+        os.makedirs(tmp_path / folder)
+        with open(tmp_path / folder / 'x.dcm', 'w') as f:
+            f.write('1')
+        os.utime(tmp_path / folder / 'x.dcm', ns=(0, 0))
+    fingerprints = [files_fingerprint([str(tmp_path / folder / 'x.dcm')], root=str(tmp_path / folder))
+                    for folder in ('a', 'b')]
+    assert fingerprints[0] == fingerprints[1]
+    with open(tmp_path / 'b' / 'x.dcm', 'w') as f:
+        f.write('22')
+    assert files_fingerprint([str(tmp_path / 'b' / 'x.dcm')], root=str(tmp_path / 'b')) != fingerprints[0]
+    assert not is_temp_file('Image.nii.gz') and is_temp_file('Mask.rtmask.tmp12-34')
@@ -0,0 +1,52 @@
+import os
+import numpy as np
+import pytest
+from src.common import volume_store
+from src.common.volume_store import write_volume, RTVolume, load_rtvol, write_patient_volume, read_store_index
+
+def test_rewriting_a_volume_replaces_it(tmp_path):
+    path = str(tmp_path / 'ct.rtvol')
+    write_volume(path, np.zeros((10, 4, 4), dtype=np.int16), codec='zlib')
+    write_volume(path, np.ones((6, 4, 4), dtype=np.int16), codec='zlib')
+    assert np.array_equal(RTVolume(path)[:], np.ones((6, 4, 4), dtype=np.int16))
+    assert os.listdir(tmp_path) == ['ct.rtvol']
+
+def test_failed_rewrite_keeps_the_old_volume(tmp_path, monkeypatch):
+    path = str(tmp_path / 'ct.rtvol')
+    volume = np.arange(160, dtype=np.int16).reshape(10, 4, 4)
+    write_volume(path, volume, codec='zlib')
+    
+    def fail(data, codec, level):
+        raise IOError("disk full")
+    
+    monkeypatch.setattr(volume_store, '_compress', fail)
+    with pytest.raises(IOError):
+        write_volume(path, np.ones((6, 4, 4), dtype=np.int16), codec='zlib')
+    assert np.array_equal(RTVolume(path)[:], volume)
+    assert os.listdir(tmp_path) == ['ct.rtvol']
+
+@pytest.mark.parametrize('codec', volume_store.available_codecs() + ['raw'])
+@pytest.mark.parametrize('dtype', [np.int16, np.float32, np.uint8])
+def test_volume_round_trip(tmp_path, codec, dtype):
+    path = str(tmp_path / 'ct.rtvol')
+    volume = (np.random.default_rng(0).random((21, 6, 5)) * 100).astype(dtype)
+    meta = write_volume(path, volume, {'spacing': [0.9, 0.9, 2.5]}, chunk_slices=4, codec=codec)
+    assert meta['n_chunks'] == 6
+    stored = RTVolume(path)
+    assert np.array_equal(stored.read(), volume)
+    assert stored.read().dtype == volume.dtype
+    for key in (np.s_[5], np.s_[-1], np.s_[3:13], np.s_[::-2], np.s_[7:9, 2:4, 1]):
+        assert np.array_equal(stored[key], volume[key])
+    data, metadata = load_rtvol(path, window=np.s_[18:21])
+    assert np.array_equal(data, volume[18:21])
+    assert metadata == {'spacing': [0.9, 0.9, 2.5]}
+
+def test_patient_store_index(tmp_path):
+    root = str(tmp_path / 'store')
+    ct = np.zeros((4, 3, 3), dtype=np.int16)
+    write_patient_volume(root, 'p1', 'ct', ct, codec='zlib')
+    write_patient_volume(root, 'p1', 'mri', ct + 1, codec='zlib')
+    write_patient_volume(root, 'p2', 'ct', ct + 2, codec='zlib')
+    index = read_store_index(root)
+    assert sorted(index) == ['p1', 'p2'] and sorted(index['p1']) == ['ct', 'mri']
+    assert np.array_equal(load_rtvol(index['p1']['mri'])[0], ct + 1)